@@ -0,0 +1,147 @@
+import asyncio
+import itertools
+from typing import Any, Dict, List, Optional
+
+from .protocol import CODECS, JSON, encode_msg, hello_request, read_msg_async
+
+ASYNC_POOL_SIZE = 4
+
+
+class AsyncConnection:
+    """asyncio counterpart of tcp_client.MultiplexedConnection.
+
+    Requests are pipelined on one stream under connection-private request_ids;
+    a reader task resolves the waiting futures as responses arrive, in any order.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, codec):
+        self._reader = reader
+        self._writer = writer
+        self._codec = codec
+        self._pending: Dict[int, tuple] = {}  # wire id -> (future, caller request_id)
+        self._ids = itertools.count(1)
+        self.closed = False
+        self._read_task = asyncio.ensure_future(self._read_loop())
+
+    @classmethod
+    async def open(cls, host: str, port: int, timeout: float = 5.0, codec_name: str = JSON.name) -> "AsyncConnection":
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        codec = JSON
+        if codec_name != JSON.name:
+            try:
+                writer.write(encode_msg(hello_request([codec_name, JSON.name])))
+                resp = await asyncio.wait_for(read_msg_async(reader), timeout)
+            except BaseException:
+                writer.close()
+                raise
+            if resp.get("ok"):
+                codec = CODECS.get((resp.get("data") or {}).get("codec"), JSON)
+        return cls(reader, writer, codec)
+
+    async def request(self, req: Dict[str, Any], timeout: float = 5.0) -> Dict[str, Any]:
+        if self.closed:
+            raise ConnectionError("connection closed")
+        wire_id = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[wire_id] = (fut, req.get("request_id"))
+        try:
+            self._writer.write(encode_msg({**req, "request_id": wire_id}, self._codec))
+            await self._writer.drain()
+            return await asyncio.wait_for(fut, timeout)
+        finally:
+            self._pending.pop(wire_id, None)
+
+    async def _read_loop(self) -> None:
+        try:
+            while True:
+                resp = await read_msg_async(self._reader, self._codec)
+                entry = self._pending.pop(resp.get("request_id"), None)
+                if entry is None or entry[0].done():
+                    continue  # the caller already gave up on it
+                fut, request_id = entry
+                resp["request_id"] = request_id
+                fut.set_result(resp)
+        except asyncio.CancelledError:
+            self._fail(ConnectionError("closed by client"))
+        except Exception as exc:
+            self._fail(exc)
+
+    def _fail(self, exc: BaseException) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self._writer.close()
+        pending, self._pending = self._pending, {}
+        for fut, _ in pending.values():
+            if not fut.done():
+                fut.set_exception(ConnectionError(f"connection lost: {exc}"))
+
+    async def close(self) -> None:
+        self._read_task.cancel()
+        await asyncio.gather(self._read_task, return_exceptions=True)
+
+
+class AsyncConnectionPool:
+    """A few pipelined connections to one server, shared round-robin by every coroutine.
+
+    Connections are opened lazily and replaced when they fail, so any number of
+    concurrent callers costs at most `size` backend connections. Bound to the
+    event loop it is first used on.
+    """
+
+    def __init__(self, host: str, port: int, size: int = ASYNC_POOL_SIZE, codec_name: str = JSON.name):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.codec_name = codec_name
+        self._conns: List[Optional[AsyncConnection]] = [None] * size
+        self._opening: List[Optional[asyncio.Future]] = [None] * size
+        self._next = itertools.count()
+        self.requests = 0
+        self.created = 0
+        self.failures = 0
+
+    async def _connection(self, slot: int, timeout: float) -> AsyncConnection:
+        conn = self._conns[slot]
+        if conn is not None and not conn.closed:
+            return conn
+        # Callers that find the slot empty at the same time share one connect.
+        opening = self._opening[slot]
+        if opening is None:
+            opening = asyncio.ensure_future(AsyncConnection.open(self.host, self.port, timeout, self.codec_name))
+            self._opening[slot] = opening
+            try:
+                conn = await asyncio.shield(opening)
+            finally:
+                self._opening[slot] = None
+            self._conns[slot] = conn
+            self.created += 1
+            return conn
+        return await asyncio.shield(opening)
+
+    async def request(self, req: Dict[str, Any], timeout: float = 5.0) -> Dict[str, Any]:
+        self.requests += 1
+        slot = next(self._next) % self.size
+        try:
+            conn = await self._connection(slot, timeout)
+            return await conn.request(req, timeout)
+        except ConnectionError:
+            # A connection that died since its last use is replaced once.
+            self.failures += 1
+            conn = await self._connection(slot, timeout)
+            return await conn.request(req, timeout)
+
+    async def close(self) -> None:
+        for conn in self._conns:
+            if conn is not None:
+                await conn.close()
+        self._conns = [None] * self.size
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": self.size,
+            "open": sum(1 for c in self._conns if c is not None and not c.closed),
+            "requests": self.requests,
+            "created": self.created,
+            "failures": self.failures,
+        }
@@ -0,0 +1,206 @@
+import asyncio
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .protocol import BATCH_API, batch_request
+from .tcp_server import error_response
+
+MAX_BATCH_SIZE = 256
+BATCH_THREADS = 16
+
+
+def parse_batch(req: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], bool, Optional[Dict[str, Any]]]:
+    """Return (sub_requests, independent, error_response) for a Batch request."""
+    data = req.get("data") or {}
+    subs = data.get("requests")
+    if not isinstance(subs, list) or not all(isinstance(sub, dict) for sub in subs):
+        return [], False, error_response(req, "INVALID_ARGUMENT", "requests must be a list of request objects")
+    if len(subs) > MAX_BATCH_SIZE:
+        return [], False, error_response(req, "INVALID_ARGUMENT", f"at most {MAX_BATCH_SIZE} requests per batch")
+    return subs, bool(data.get("independent")), None
+
+
+def batch_response(req: Dict[str, Any], responses: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "type": "Response",
+        "request_id": req.get("request_id"),
+        "ok": True,
+        "error": None,
+        "data": {"responses": responses},
+    }
+
+
+def _run_one(handle: Callable[[Dict[str, Any]], Dict[str, Any]], sub: Dict[str, Any]) -> Dict[str, Any]:
+    if sub.get("api") == BATCH_API:
+        return error_response(sub, "INVALID_ARGUMENT", "batches cannot be nested")
+    try:
+        return handle(sub)
+    except Exception as exc:
+        return error_response(sub, "INTERNAL", str(exc))
+
+
+def run_batch(
+    req: Dict[str, Any],
+    handle: Callable[[Dict[str, Any]], Dict[str, Any]],
+    executor: Optional[Executor] = None,
+) -> Dict[str, Any]:
+    """Answer a Batch request with a blocking handler.
+
+    Sub-requests run in order, each seeing the effects of the ones before it.
+    Those of a batch marked independent run side by side on `executor`, if one
+    is given. That pays off when sub-requests spend their time waiting (say on
+    a group commit); for CPU-bound handlers on few cores, threads only add
+    switching, so leave it out. Either way the responses come back in request
+    order.
+    """
+    subs, independent, error = parse_batch(req)
+    if error:
+        return error
+    if executor is None or not independent or len(subs) < 2:
+        return batch_response(req, [_run_one(handle, sub) for sub in subs])
+    futures = [executor.submit(_run_one, handle, sub) for sub in subs]
+    return batch_response(req, [fut.result() for fut in futures])
+
+
+async def _run_one_async(handle, sub: Dict[str, Any], *args) -> Dict[str, Any]:
+    if sub.get("api") == BATCH_API:
+        return error_response(sub, "INVALID_ARGUMENT", "batches cannot be nested")
+    try:
+        return await handle(sub, *args)
+    except Exception as exc:
+        return error_response(sub, "INTERNAL", str(exc))
+
+
+class _Deferred:
+    """A backend call parked by a sub-request until the batch driver sends it."""
+
+    __slots__ = ("addr", "req")
+
+    def __init__(self, addr: Tuple[str, int], req: Dict[str, Any]):
+        self.addr = addr
+        self.req = req
+
+    def __await__(self):
+        return (yield self)
+
+
+class BatchForwarder:
+    """Runs the sub-requests of a frontend Batch and forwards their backend calls in batches.
+
+    `run(req, handle)` answers a Batch with a handler of the form
+    `async handle(sub, call=db_call)`, where `call(host, port, api, data,
+    request_id)` stands in for the handler's usual DB call. In an independent
+    batch all sub-requests run together: whenever every one of them is waiting on the
+    backend, the calls bound for each DB service go out as a single Batch, so
+    ten AddItemToCart lines cost two backend round trips instead of twenty. An
+    ordered batch runs its sub-requests one after another with plain calls.
+
+    `send(host, port, req)` performs one backend call; it is a coroutine
+    function when `asynchronous`, and blocking otherwise (the sub-requests then
+    never suspend except at `call`, and a small driver steps them instead of an
+    event loop).
+    """
+
+    def __init__(self, send: Callable[..., Any], asynchronous: bool):
+        self._send = send
+        self.asynchronous = asynchronous
+        self.batches = 0
+        self.forwarded = 0
+
+    async def run(self, req: Dict[str, Any], handle) -> Dict[str, Any]:
+        subs, independent, error = parse_batch(req)
+        if error:
+            return error
+        if not independent or len(subs) < 2:
+            return batch_response(req, [await _run_one_async(handle, sub) for sub in subs])
+        if self.asynchronous:
+            return batch_response(req, await self._run_async(subs, handle))
+        return batch_response(req, self._run_stepped(subs, handle))
+
+    def _group(self, calls: List[Tuple[Tuple[str, int], Dict[str, Any]]]) -> Dict[Tuple[str, int], List[int]]:
+        groups: Dict[Tuple[str, int], List[int]] = {}
+        for i, (addr, _) in enumerate(calls):
+            groups.setdefault(addr, []).append(i)
+        return groups
+
+    def _wrap(self, reqs: List[Dict[str, Any]]) -> Dict[str, Any]:
+        self.forwarded += len(reqs)
+        if len(reqs) == 1:
+            return reqs[0]
+        self.batches += 1
+        return batch_request(reqs, independent=True)
+
+    @staticmethod
+    def _unwrap(reqs: List[Dict[str, Any]], resp: Dict[str, Any]) -> List[Dict[str, Any]]:
+        if len(reqs) == 1:
+            return [resp]
+        if not resp.get("ok"):
+            return [{**resp, "request_id": sub.get("request_id")} for sub in reqs]
+        return resp["data"]["responses"]
+
+    def _run_stepped(self, subs: List[Dict[str, Any]], handle) -> List[Dict[str, Any]]:
+        def call(host, port, api, data, request_id):
+            return _Deferred((host, port), {"type": "Request", "request_id": request_id, "api": api, "data": data})
+
+        coros = {i: _run_one_async(handle, sub, call) for i, sub in enumerate(subs)}
+        results: List[Any] = [None] * len(subs)
+        ready: List[Tuple[int, Any, Optional[BaseException]]] = [(i, None, None) for i in coros]
+        while ready:
+            parked: List[Tuple[int, _Deferred]] = []
+            for i, value, exc in ready:
+                coro = coros[i]
+                try:
+                    deferred = coro.throw(exc) if exc is not None else coro.send(value)
+                except StopIteration as done:
+                    results[i] = done.value
+                    continue
+                if not isinstance(deferred, _Deferred):
+                    coro.close()
+                    raise RuntimeError("sub-request suspended outside a backend call")
+                parked.append((i, deferred))
+            ready = []
+            calls = [(d.addr, d.req) for _, d in parked]
+            for addr, indexes in self._group(calls).items():
+                reqs = [calls[j][1] for j in indexes]
+                try:
+                    resps = self._unwrap(reqs, self._send(addr[0], addr[1], self._wrap(reqs)))
+                except Exception as exc:
+                    ready.extend((parked[j][0], None, exc) for j in indexes)
+                    continue
+                ready.extend((parked[j][0], resp, None) for j, resp in zip(indexes, resps))
+        return results
+
+    async def _run_async(self, subs: List[Dict[str, Any]], handle) -> List[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        queued: List[Tuple[Tuple[str, int], Dict[str, Any], asyncio.Future]] = []
+
+        async def flush(batch) -> None:
+            calls = [(addr, req) for addr, req, _ in batch]
+            for addr, indexes in self._group(calls).items():
+                reqs = [calls[j][1] for j in indexes]
+                try:
+                    resps = self._unwrap(reqs, await self._send(addr[0], addr[1], self._wrap(reqs)))
+                except Exception as exc:
+                    for j in indexes:
+                        batch[j][2].set_exception(exc)
+                    continue
+                for j, resp in zip(indexes, resps):
+                    batch[j][2].set_result(resp)
+
+        def schedule_flush() -> None:
+            batch = queued[:]
+            queued.clear()
+            asyncio.ensure_future(flush(batch))
+
+        async def call(host, port, api, data, request_id):
+            fut = loop.create_future()
+            if not queued:
+                # Runs once every sub-request that is ready has reached its next call.
+                loop.call_soon(schedule_flush)
+            queued.append(((host, port), {"type": "Request", "request_id": request_id, "api": api, "data": data}, fut))
+            return await fut
+
+        return list(await asyncio.gather(*(_run_one_async(handle, sub, call) for sub in subs)))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"batches": self.batches, "forwarded": self.forwarded}
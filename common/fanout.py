@@ -0,0 +1,112 @@
+import asyncio
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, List, Optional, Tuple, Union
+
+from .tcp_server import run_sync
+
+FANOUT_TIMEOUT_SEC = 5.0
+FANOUT_MAX_THREADS = 64
+
+Call = Union[Callable[[], Awaitable[Any]], Tuple[Callable[[], Awaitable[Any]], float]]
+
+
+def _is_error(result: Any) -> bool:
+    return isinstance(result, dict) and result.get("ok") is False
+
+
+def _run(fn):
+    return run_sync(fn())
+
+
+class FanOut:
+    """Issues independent backend calls concurrently and joins their results.
+
+    Each call is a zero-argument function returning an awaitable (typically
+    `lambda: db_call(...)`), optionally paired with its own timeout as
+    `(fn, seconds)`. Awaiting `fan_out(*calls)` returns their results in call
+    order, after the slowest one rather than after all of them in turn.
+
+    As soon as one call raises or returns an error response (`"ok": False`),
+    the calls still running are cancelled and their results are None; an
+    exception, including TimeoutError, is re-raised.
+
+    With `asynchronous=False` the calls must never suspend (see run_sync): each
+    runs on a thread of a shared pool while the caller blocks. A call already
+    running there cannot be interrupted, so it finishes in the background and
+    its result is dropped.
+    """
+
+    def __init__(
+        self,
+        asynchronous: bool,
+        timeout: float = FANOUT_TIMEOUT_SEC,
+        max_threads: int = FANOUT_MAX_THREADS,
+    ):
+        self.asynchronous = asynchronous
+        self.timeout = timeout
+        self._executor: Optional[ThreadPoolExecutor] = None
+        if not asynchronous:
+            self._executor = ThreadPoolExecutor(max_threads, thread_name_prefix="fanout")
+
+    async def __call__(self, *calls: Call) -> List[Any]:
+        specs = [call if isinstance(call, tuple) else (call, self.timeout) for call in calls]
+        if self.asynchronous:
+            return await self._gather_async(specs)
+        return self._gather_threads(specs)
+
+    async def _gather_async(self, specs) -> List[Any]:
+        start = time.monotonic()
+        tasks = [asyncio.ensure_future(fn()) for fn, _ in specs]
+        index = {task: i for i, task in enumerate(tasks)}
+        deadlines = {task: start + timeout for task, (_, timeout) in zip(tasks, specs)}
+        results: List[Any] = [None] * len(tasks)
+        pending = set(tasks)
+        try:
+            while pending:
+                remaining = min(deadlines[task] for task in pending) - time.monotonic()
+                done, pending = await asyncio.wait(pending, timeout=max(remaining, 0), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    results[index[task]] = result
+                    if _is_error(result):
+                        return results
+                now = time.monotonic()
+                if any(deadlines[task] <= now for task in pending):
+                    raise TimeoutError("fan-out call timed out")
+            return results
+        finally:
+            for task in pending:
+                task.cancel()
+            for task in tasks:
+                # Mark errors of calls nobody looked at as retrieved.
+                if task.done() and not task.cancelled():
+                    task.exception()
+
+    def _gather_threads(self, specs) -> List[Any]:
+        start = time.monotonic()
+        futures = [self._executor.submit(_run, fn) for fn, _ in specs]
+        index = {fut: i for i, fut in enumerate(futures)}
+        deadlines = {fut: start + timeout for fut, (_, timeout) in zip(futures, specs)}
+        results: List[Any] = [None] * len(futures)
+        pending = set(futures)
+        try:
+            while pending:
+                remaining = min(deadlines[fut] for fut in pending) - time.monotonic()
+                done, pending = wait(pending, max(remaining, 0), FIRST_COMPLETED)
+                for fut in done:
+                    result = fut.result()
+                    results[index[fut]] = result
+                    if _is_error(result):
+                        return results
+                now = time.monotonic()
+                if any(deadlines[fut] <= now for fut in pending):
+                    raise TimeoutError("fan-out call timed out")
+            return results
+        finally:
+            for fut in pending:
+                fut.cancel()
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,197 @@
+import os
+from typing import Any, Dict
+
+from .async_tcp_client import ASYNC_POOL_SIZE, AsyncConnectionPool
+from .batch import BatchForwarder
+from .protocol import CODECS
+from .session_cache import SESSION_CACHE_SIZE, SESSION_CACHE_TTL_SEC, SessionCache
+from .session_token import REVOCATION_REFRESH_SEC, TokenVerifier, is_token
+from .tcp_client import POOL_MAX_SIZE, ConnectionPool
+from .tcp_server import run_sync
+
+
+def _err(req, code, message):
+    return {
+        "type": "Response",
+        "request_id": req.get("request_id"),
+        "ok": False,
+        "error": {"code": code, "message": message},
+        "data": None,
+    }
+
+
+class FrontendContext:
+    """DB connections and session checks shared by the buyer and seller frontends."""
+
+    def __init__(
+        self,
+        customer_host,
+        customer_port,
+        product_host,
+        product_port,
+        token_key: bytes | None = None,
+        revocation_refresh: float = REVOCATION_REFRESH_SEC,
+        session_cache_ttl: float = SESSION_CACHE_TTL_SEC,
+        session_cache_size: int = SESSION_CACHE_SIZE,
+        db_codec: str = "json",
+        db_pool_size: int | None = None,
+        asynchronous: bool = False,
+    ):
+        self.customer = (customer_host, customer_port)
+        self.product = (product_host, product_port)
+        self.asynchronous = asynchronous
+        # Calls to the DB services share a bounded set of connections, however many
+        # client connections this frontend is serving.
+        if asynchronous:
+            size = db_pool_size or ASYNC_POOL_SIZE
+            pool_class = AsyncConnectionPool
+        else:
+            size = db_pool_size or POOL_MAX_SIZE
+            pool_class = ConnectionPool
+        self.db_pools = {
+            "customer": pool_class(customer_host, customer_port, size, codec_name=db_codec),
+            "product": pool_class(product_host, product_port, size, codec_name=db_codec),
+        }
+        self._pools_by_addr = {(pool.host, pool.port): pool for pool in self.db_pools.values()}
+
+        # Batches from clients reach the DB services as batches too.
+        self.batch_forwarder = BatchForwarder(
+            lambda host, port, req: self._pools_by_addr[(host, port)].request(req), asynchronous
+        )
+        self.session_cache = SessionCache(session_cache_ttl, session_cache_size)
+
+        # With a shared token key, signed session tokens are verified locally and
+        # only the revocation list is fetched from db_customer, in the background.
+        self.verifier = None
+        if token_key is not None:
+            # The refresh runs on its own thread, so it always makes blocking calls.
+            revocation_pool = self.db_pools["customer"]
+            if asynchronous:
+                revocation_pool = ConnectionPool(customer_host, customer_port, 1, codec_name=db_codec)
+            self.verifier = TokenVerifier(
+                token_key,
+                lambda: revocation_pool.request(
+                    {"type": "Request", "request_id": None, "api": "GetRevokedTokens", "data": {}}
+                )["data"],
+                revocation_refresh,
+            )
+
+    async def db_call(self, host, port, api, data, request_id):
+        req = {
+            "type": "Request",
+            "request_id": request_id,
+            "api": api,
+            "data": data,
+        }
+        if self.asynchronous:
+            return await self._pools_by_addr[(host, port)].request(req)
+        # A blocking call, so this coroutine never suspends (see run_sync).
+        return self._pools_by_addr[(host, port)].request(req)
+
+    async def validate_session(self, session_id, request_id):
+        def load():
+            return self.db_call(*self.customer, "ValidateSession", {"session_id": session_id}, request_id)
+
+        if self.asynchronous:
+            return await self.session_cache.get_async(session_id, load)
+        return self.session_cache.get(session_id, lambda: run_sync(load()))
+
+    def session_needs_lookup(self, data) -> bool:
+        session_id = data.get("session_id")
+        if not session_id or (self.verifier is not None and is_token(session_id)):
+            return False
+        return self.session_cache.peek(session_id) is None
+
+    async def require_session(self, data, request_id):
+        session_id = data.get("session_id")
+        if not session_id:
+            return None, _err({"request_id": request_id}, "NOT_LOGGED_IN", "session_id required")
+        if self.verifier is not None and is_token(session_id):
+            claims, error = self.verifier.check(session_id)
+            if error:
+                return None, _err({"request_id": request_id}, *error)
+            return {"role": claims["r"], "user_id": int(claims["u"])}, None
+        sess = await self.validate_session(session_id, request_id)
+        if not sess.get("ok"):
+            return None, sess
+        return sess["data"], None
+
+    async def logout(self, data, request_id, call):
+        session_id = data.get("session_id")
+        resp = await call(*self.customer, "Logout", {"session_id": session_id}, request_id)
+        self.session_cache.invalidate(session_id)
+        if self.verifier is not None and resp.get("ok") and is_token(session_id):
+            self.verifier.revoke(session_id)
+        return resp
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "session_cache": self.session_cache.stats(),
+            "db_pools": {name: pool.stats() for name, pool in self.db_pools.items()},
+            "batches": self.batch_forwarder.stats(),
+        }
+
+    def handler(self, handle):
+        """Adapt an `async def handle(req)` to the engine this context was built for."""
+        if self.asynchronous:
+            return handle
+        return lambda req: run_sync(handle(req))
+
+
+def add_frontend_args(parser, port: int) -> None:
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=port)
+    parser.add_argument("--customer-host", default="127.0.0.1")
+    parser.add_argument("--customer-port", type=int, default=6001)
+    parser.add_argument("--product-host", default="127.0.0.1")
+    parser.add_argument("--product-port", type=int, default=6002)
+    parser.add_argument(
+        "--token-key",
+        default=os.environ.get("SESSION_TOKEN_KEY"),
+        help="Shared HMAC key for verifying signed session tokens locally.",
+    )
+    parser.add_argument("--revocation-refresh", type=float, default=REVOCATION_REFRESH_SEC)
+    parser.add_argument(
+        "--session-cache-ttl",
+        type=float,
+        default=SESSION_CACHE_TTL_SEC,
+        help="Seconds a successful ValidateSession result is reused (0 disables the cache).",
+    )
+    parser.add_argument("--session-cache-size", type=int, default=SESSION_CACHE_SIZE)
+    parser.add_argument(
+        "--db-codec",
+        choices=sorted(CODECS),
+        default="json",
+        help="Wire encoding to negotiate on connections to the DB services.",
+    )
+    parser.add_argument(
+        "--db-pool-size",
+        type=int,
+        default=None,
+        help=(
+            "Maximum connections to each DB service; callers beyond that wait for a free one "
+            f"(default {POOL_MAX_SIZE}, or {ASYNC_POOL_SIZE} pipelined connections with --engine asyncio)."
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker processes sharing the port through SO_REUSEPORT, restarted if they die.",
+    )
+
+
+def frontend_options(args) -> Dict[str, Any]:
+    return {
+        "customer_host": args.customer_host,
+        "customer_port": args.customer_port,
+        "product_host": args.product_host,
+        "product_port": args.product_port,
+        "token_key": args.token_key.encode("utf-8") if args.token_key else None,
+        "revocation_refresh": args.revocation_refresh,
+        "session_cache_ttl": args.session_cache_ttl,
+        "session_cache_size": args.session_cache_size,
+        "db_codec": args.db_codec,
+        "db_pool_size": args.db_pool_size,
+        "asynchronous": args.engine == "asyncio",
+    }
@@ -1,31 +1,354 @@
+import asyncio
 import json
 import socket
 import struct
-from typing import Any, Dict
+from typing import Any, Dict, List
 
 
 _HEADER_FMT = ">I"  # 4-byte big-endian unsigned length
 _HEADER_SIZE = 4
+_HEADER = struct.Struct(_HEADER_FMT)
+READ_BUFFER_SIZE = 64 * 1024
+# Below this, joining header and payload is cheaper than a two-buffer sendmsg.
+SCATTER_MIN_SIZE = 16 * 1024
+
+HELLO_API = "Hello"
+BATCH_API = "Batch"
+
+
+class JsonCodec:
+    name = "json"
+
+    def encode(self, obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+    def decode(self, payload) -> Any:
+        # str() decodes straight out of a memoryview without copying it to bytes first.
+        return json.loads(str(payload, "utf-8"))
+
+
+# Strings that appear in almost every message: envelope keys, API names and
+# common data keys. BinaryCodec sends each as two bytes. The table is part of
+# the wire format, so changing it means a new codec name.
+_INTERNED = (
+    "type", "request_id", "api", "data", "ok", "error", "code", "message", "Request", "Response",
+    "item_id", "name", "category", "keywords", "condition", "price", "quantity", "seller_id",
+    "buyer_id", "feedback", "up", "down", "items", "item", "session_id", "user_id", "role",
+    "password", "quantity_delta", "available", "vote", "cart", "new", "used", "buyer", "seller",
+    "Ping", "Hello", "CreateBuyer", "CreateSeller", "Login", "Logout", "ValidateSession",
+    "RegisterItem", "ChangeItemPrice", "UpdateUnitsForSale", "DisplayItemsForSale", "SearchItems",
+    "GetItem", "CheckAvailability", "ProvideFeedback", "GetSellerRating", "GetBuyerPurchases",
+    "UpdateCart", "GetCart", "ClearCart", "GetStats", "GetRevokedTokens",
+)
+
+
+class BinaryCodec:
+    """msgpack-style binary encoding with a table of interned strings.
+
+    Tags follow msgpack (fixint/fixstr/fixarray/fixmap, nil, bool, float64,
+    int64, str/array/map with 8/16/32-bit lengths) plus 0xd4 <index> for a
+    string from `_INTERNED`. Integers must fit in 64 bits.
+    """
+
+    name = "bin1"
+
+    def __init__(self):
+        self._intern = {s: bytes((0xD4, i)) for i, s in enumerate(_INTERNED)}
+
+    def encode(self, obj: Any) -> bytes:
+        out = bytearray()
+        self._encode(obj, out)
+        return bytes(out)
+
+    def _encode(self, obj: Any, out: bytearray) -> None:
+        t = type(obj)
+        if t is str:
+            tag = self._intern.get(obj)
+            if tag is not None:
+                out += tag
+                return
+            raw = obj.encode("utf-8")
+            n = len(raw)
+            if n < 32:
+                out.append(0xA0 | n)
+            elif n < 0x100:
+                out += bytes((0xD9, n))
+            elif n < 0x10000:
+                out += b"\xda" + n.to_bytes(2, "big")
+            else:
+                out += b"\xdb" + n.to_bytes(4, "big")
+            out += raw
+        elif t is dict:
+            n = len(obj)
+            if n < 16:
+                out.append(0x80 | n)
+            elif n < 0x10000:
+                out += b"\xde" + n.to_bytes(2, "big")
+            else:
+                out += b"\xdf" + n.to_bytes(4, "big")
+            for k, v in obj.items():
+                self._encode(k, out)
+                self._encode(v, out)
+        elif t is int:
+            if 0 <= obj < 0x80:
+                out.append(obj)
+            elif -32 <= obj < 0:
+                out.append(obj & 0xFF)
+            else:
+                out += b"\xd3" + obj.to_bytes(8, "big", signed=True)
+        elif t is float:
+            out += b"\xcb" + struct.pack(">d", obj)
+        elif obj is None:
+            out.append(0xC0)
+        elif t is bool:
+            out.append(0xC3 if obj else 0xC2)
+        elif t is list or t is tuple:
+            n = len(obj)
+            if n < 16:
+                out.append(0x90 | n)
+            elif n < 0x10000:
+                out += b"\xdc" + n.to_bytes(2, "big")
+            else:
+                out += b"\xdd" + n.to_bytes(4, "big")
+            for v in obj:
+                self._encode(v, out)
+        else:
+            raise TypeError(f"cannot encode {t.__name__}")
+
+    def decode(self, payload: bytes) -> Any:
+        try:
+            obj, end = _bin_decode(payload, 0)
+        except (IndexError, TypeError, struct.error) as exc:
+            raise ValueError(f"malformed message: {exc}") from None
+        if end != len(payload):
+            raise ValueError("trailing bytes in message")
+        return obj
+
+
+_unpack_double = struct.Struct(">d").unpack_from
+_LENGTH_WIDTH = {0xD9: 1, 0xDA: 2, 0xDB: 4, 0xDC: 2, 0xDD: 4, 0xDE: 2, 0xDF: 4}
+
+
+def _bin_decode(buf, i: int):
+    # A module-level function with the common tags first: this runs once per
+    # value, so attribute lookups and dispatch order matter.
+    tag = buf[i]
+    if tag == 0xD4:
+        return _INTERNED[buf[i + 1]], i + 2
+    i += 1
+    if tag < 0x80:
+        return tag, i
+    if tag < 0x90:
+        out = {}
+        for _ in range(tag & 0x0F):
+            if buf[i] == 0xD4:
+                key = _INTERNED[buf[i + 1]]
+                i += 2
+            else:
+                key, i = _bin_decode(buf, i)
+            out[key], i = _bin_decode(buf, i)
+        return out, i
+    if tag < 0xA0:
+        out = []
+        for _ in range(tag & 0x0F):
+            value, i = _bin_decode(buf, i)
+            out.append(value)
+        return out, i
+    if tag < 0xC0:
+        end = i + (tag & 0x1F)
+        return str(buf[i:end], "utf-8"), end
+    if tag >= 0xE0:
+        return tag - 0x100, i
+    if tag == 0xCB:
+        return _unpack_double(buf, i)[0], i + 8
+    if tag == 0xC0:
+        return None, i
+    if tag == 0xC3:
+        return True, i
+    if tag == 0xC2:
+        return False, i
+    if tag == 0xD3:
+        return int.from_bytes(buf[i : i + 8], "big", signed=True), i + 8
+    width = _LENGTH_WIDTH.get(tag)
+    if width is None:
+        raise ValueError(f"bad type tag 0x{tag:02x}")
+    n = int.from_bytes(buf[i : i + width], "big")
+    i += width
+    if tag <= 0xDB:
+        return str(buf[i : i + n], "utf-8"), i + n
+    if tag <= 0xDD:
+        out = []
+        for _ in range(n):
+            value, i = _bin_decode(buf, i)
+            out.append(value)
+        return out, i
+    out = {}
+    for _ in range(n):
+        key, i = _bin_decode(buf, i)
+        out[key], i = _bin_decode(buf, i)
+    return out, i
+
+
+JSON = JsonCodec()
+BINARY = BinaryCodec()
+CODECS = {codec.name: codec for codec in (JSON, BINARY)}
 
 
 def _recv_exact(sock: socket.socket, n: int) -> bytes:
-    data = bytearray()
-    while len(data) < n:
-        chunk = sock.recv(n - len(data))
+    data = sock.recv(n)
+    if len(data) == n:
+        return data  # the common case: no buffer to grow and copy
+    if not data:
+        raise ConnectionError("socket closed")
+    buf = bytearray(data)
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
         if not chunk:
             raise ConnectionError("socket closed")
-        data.extend(chunk)
-    return bytes(data)
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+class FrameReader:
+    """Buffered reader for the frames arriving on one socket.
+
+    Pulls whatever the kernel has with `recv_into` into a reusable buffer and
+    slices frames out of it, so a small request costs one syscall instead of two
+    and a burst of pipelined requests is often read in a single call. Payloads
+    are handed out as memoryviews into the buffer; they are only valid until the
+    next read.
+    """
+
+    def __init__(self, sock: socket.socket, size: int = READ_BUFFER_SIZE):
+        self._sock = sock
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._start = 0  # first unread byte
+        self._end = 0  # end of received data
+
+    def buffered(self) -> bool:
+        """Whether bytes of a further frame are already sitting in the buffer."""
+        return self._end > self._start
+
+    def read_frame(self) -> memoryview:
+        while True:
+            available = self._end - self._start
+            if available >= _HEADER_SIZE:
+                (length,) = _HEADER.unpack_from(self._buf, self._start)
+                needed = _HEADER_SIZE + length
+                if available >= needed:
+                    begin = self._start + _HEADER_SIZE
+                    self._start += needed
+                    return self._view[begin : self._start]
+            else:
+                needed = _HEADER_SIZE
+            self._make_room(needed)
+            n = self._sock.recv_into(self._view[self._end :])
+            if not n:
+                raise ConnectionError("socket closed")
+            self._end += n
+
+    def _make_room(self, needed: int) -> None:
+        if self._start == self._end:
+            self._start = self._end = 0
+        if len(self._buf) - self._start >= needed:
+            return
+        pending = self._end - self._start
+        if needed > len(self._buf):
+            # Allocate rather than resize: earlier payload views may still exist.
+            buf = bytearray(max(needed, 2 * len(self._buf)))
+            buf[:pending] = self._view[self._start : self._end]
+            self._buf, self._view = buf, memoryview(buf)
+        else:
+            self._buf[:pending] = self._buf[self._start : self._end]
+        self._start, self._end = 0, pending
+
+    def recv_msg(self, codec=JSON) -> Dict[str, Any]:
+        return codec.decode(self.read_frame())
+
+
+def encode_msg(obj: Dict[str, Any], codec=JSON) -> bytes:
+    """Return the full frame (length header + encoded payload) for `obj`."""
+    payload = codec.encode(obj)
+    return _HEADER.pack(len(payload)) + payload
+
+
+def decode_payload(payload, codec=JSON) -> Dict[str, Any]:
+    return codec.decode(payload)
+
+
+def send_msg(sock: socket.socket, obj: Dict[str, Any], codec=JSON) -> None:
+    payload = codec.encode(obj)
+    header = _HEADER.pack(len(payload))
+    if len(payload) < SCATTER_MIN_SIZE:
+        sock.sendall(header + payload)
+        return
+    # Scatter write: a large payload goes out in one syscall without being copied next to its header.
+    sent = sock.sendmsg((header, payload))
+    if sent < _HEADER_SIZE + len(payload):
+        if sent < _HEADER_SIZE:
+            sock.sendall(header[sent:])
+            sent = _HEADER_SIZE
+        sock.sendall(memoryview(payload)[sent - _HEADER_SIZE :])
+
+
+def recv_msg(sock: socket.socket, codec=JSON) -> Dict[str, Any]:
+    (length,) = _HEADER.unpack(_recv_exact(sock, _HEADER_SIZE))
+    return decode_payload(_recv_exact(sock, length), codec)
+
+
+async def read_msg_async(reader: asyncio.StreamReader, codec=JSON) -> Dict[str, Any]:
+    header = await reader.readexactly(_HEADER_SIZE)
+    (length,) = _HEADER.unpack(header)
+    return decode_payload(await reader.readexactly(length), codec)
+
+
+# Codec negotiation. A connection starts out in JSON; a client that wants
+# another codec sends a Hello listing the ones it accepts, in order of
+# preference, as its first message. The server answers (in JSON) with its pick,
+# and both sides switch. Servers that predate Hello answer UNIMPLEMENTED and the
+# connection simply stays in JSON.
+
+
+def hello_request(codec_names: List[str]) -> Dict[str, Any]:
+    return {"type": "Request", "request_id": None, "api": HELLO_API, "data": {"codecs": codec_names}}
+
+
+def answer_hello(req: Dict[str, Any]):
+    """Server side: return (response, codec) for a Hello request."""
+    offered = (req.get("data") or {}).get("codecs") or []
+    codec = next((CODECS[name] for name in offered if name in CODECS), JSON)
+    resp = {
+        "type": "Response",
+        "request_id": req.get("request_id"),
+        "ok": True,
+        "error": None,
+        "data": {"codec": codec.name},
+    }
+    return resp, codec
+
+
+def client_hello(sock: socket.socket, codec_name: str):
+    """Client side: negotiate `codec_name` on a fresh connection, returning the codec to use."""
+    if codec_name == JSON.name:
+        return JSON
+    send_msg(sock, hello_request([codec_name, JSON.name]))
+    resp = recv_msg(sock)
+    if not resp.get("ok"):
+        return JSON
+    return CODECS.get((resp.get("data") or {}).get("codec"), JSON)
 
 
-def send_msg(sock: socket.socket, obj: Dict[str, Any]) -> None:
-    payload = json.dumps(obj, separators=(",", ":")).encode("utf-8")
-    header = struct.pack(_HEADER_FMT, len(payload))
-    sock.sendall(header + payload)
+# Batches. A Batch request carries a list of complete sub-requests in
+# data["requests"] and is answered with their responses, in the same order, in
+# data["responses"]. Sub-requests run in order unless data["independent"] is
+# true, in which case the server may run them concurrently.
 
 
-def recv_msg(sock: socket.socket) -> Dict[str, Any]:
-    header = _recv_exact(sock, _HEADER_SIZE)
-    (length,) = struct.unpack(_HEADER_FMT, header)
-    payload = _recv_exact(sock, length)
-    return json.loads(payload.decode("utf-8"))
+def batch_request(requests: List[Dict[str, Any]], independent: bool = False, request_id=None) -> Dict[str, Any]:
+    return {
+        "type": "Request",
+        "request_id": request_id,
+        "api": BATCH_API,
+        "data": {"requests": requests, "independent": independent},
+    }
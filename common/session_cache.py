@@ -0,0 +1,141 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+SESSION_CACHE_TTL_SEC = 2.0
+SESSION_CACHE_SIZE = 10000
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[BaseException] = None
+
+
+class SessionCache:
+    """Bounded LRU of successful ValidateSession responses, kept for `ttl` seconds.
+
+    Concurrent misses for the same session wait on a single in-flight lookup
+    instead of each calling db_customer. Failed validations are never cached.
+    A ttl of 0 disables caching (lookups are still collapsed).
+    """
+
+    def __init__(self, ttl: float = SESSION_CACHE_TTL_SEC, max_entries: int = SESSION_CACHE_SIZE):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # session_id -> (expires_at, response)
+        self._inflight: Dict[str, _Flight] = {}
+        self._async_inflight: Dict[str, "asyncio.Future"] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _cached(self, session_id: str, now: float) -> Optional[Dict[str, Any]]:
+        # Caller holds self._lock.
+        entry = self._entries.get(session_id)
+        if entry is not None:
+            if entry[0] > now:
+                self._entries.move_to_end(session_id)
+                self.hits += 1
+                return entry[1]
+            del self._entries[session_id]
+        return None
+
+    def _store(self, session_id: str, result: Dict[str, Any]) -> None:
+        # Caller holds self._lock.
+        if self._ttl > 0 and result.get("ok"):
+            self._entries[session_id] = (time.monotonic() + self._ttl, result)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, session_id: str, load: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cached(session_id, now)
+            if cached is not None:
+                return cached
+            flight = self._inflight.get(session_id)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[session_id] = flight
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = load()
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                # An invalidate() while loading detaches the flight; don't cache then.
+                if self._inflight.get(session_id) is flight:
+                    del self._inflight[session_id]
+                    if flight.error is None:
+                        self._store(session_id, flight.result)
+            flight.done.set()
+        return flight.result
+
+    async def get_async(self, session_id: str, load: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """`get` for coroutines on one event loop: concurrent misses await a single `load()`."""
+        with self._lock:
+            cached = self._cached(session_id, time.monotonic())
+            if cached is not None:
+                return cached
+            flight = self._async_inflight.get(session_id)
+            if flight is not None:
+                self.coalesced += 1
+            else:
+                self.misses += 1
+        if flight is not None:
+            return await asyncio.shield(flight)
+
+        flight = asyncio.ensure_future(load())
+        self._async_inflight[session_id] = flight
+        try:
+            result = await asyncio.shield(flight)
+        finally:
+            if self._async_inflight.get(session_id) is flight:
+                del self._async_inflight[session_id]
+                if flight.done() and not flight.cancelled() and flight.exception() is None:
+                    with self._lock:
+                        self._store(session_id, flight.result())
+        return result
+
+    def peek(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """The cached response for `session_id`, if fresh, without loading or counting a hit."""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+            return None
+
+    def invalidate(self, session_id: str) -> None:
+        with self._lock:
+            self._entries.pop(session_id, None)
+            self._inflight.pop(session_id, None)
+            self._async_inflight.pop(session_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "ttl": self._ttl,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+            }
@@ -0,0 +1,132 @@
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+# Tokens look like "v1.<claims>.<signature>", both parts unpadded base64url.
+# Claims: sid (token id used for revocation), r (role), u (user_id), exp (unix time).
+_PREFIX = "v1."
+
+REVOCATION_REFRESH_SEC = 2.0
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(key: bytes, body: str) -> str:
+    return _b64encode(hmac.new(key, body.encode("ascii"), hashlib.sha256).digest())
+
+
+def is_token(value: Any) -> bool:
+    return isinstance(value, str) and value.startswith(_PREFIX)
+
+
+def issue_token(key: bytes, token_id: str, role: str, user_id: int, expires_at: float) -> str:
+    claims = {"sid": token_id, "r": role, "u": int(user_id), "exp": int(expires_at)}
+    body = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    return f"{_PREFIX}{body}.{_sign(key, body)}"
+
+
+def decode_token(key: bytes, token: str) -> Optional[Dict[str, Any]]:
+    """Return the token's claims if its signature is valid, ignoring expiry."""
+    if not is_token(token):
+        return None
+    try:
+        body, signature = token[len(_PREFIX):].split(".")
+        # Compared as bytes: compare_digest rejects str with non-ASCII characters.
+        if not hmac.compare_digest(signature.encode("ascii"), _sign(key, body).encode("ascii")):
+            return None
+        claims = json.loads(_b64decode(body))
+    except (ValueError, UnicodeError):
+        return None
+    if not isinstance(claims, dict) or not {"sid", "r", "u", "exp"} <= claims.keys():
+        return None
+    return claims
+
+
+def check_token(key: bytes, token: str, is_revoked: Callable[[str], bool], now: Optional[float] = None):
+    """Return (claims, None) for a usable token, else (None, (error_code, message))."""
+    claims = decode_token(key, token)
+    if claims is None:
+        return None, ("NOT_LOGGED_IN", "invalid session")
+    if (now or time.time()) >= claims["exp"]:
+        return None, ("SESSION_TIMEOUT", "session expired")
+    if is_revoked(claims["sid"]):
+        return None, ("NOT_LOGGED_IN", "invalid session")
+    return claims, None
+
+
+class RevocationList:
+    """Revoked token ids, each kept only until the token itself would expire."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._revoked: Dict[str, float] = {}
+
+    def add(self, token_id: str, expires_at: float) -> None:
+        with self._lock:
+            self._revoked[token_id] = float(expires_at)
+
+    def merge(self, entries: Iterable[Tuple[str, float]]) -> None:
+        with self._lock:
+            for token_id, exp in entries:
+                self._revoked[token_id] = float(exp)
+
+    def prune(self, now: float) -> list:
+        with self._lock:
+            expired = [token_id for token_id, exp in self._revoked.items() if exp <= now]
+            for token_id in expired:
+                del self._revoked[token_id]
+        return expired
+
+    def entries(self) -> list:
+        with self._lock:
+            return [[token_id, exp] for token_id, exp in self._revoked.items()]
+
+    def __contains__(self, token_id: str) -> bool:
+        return token_id in self._revoked
+
+
+class TokenVerifier:
+    """Verifies session tokens locally in a frontend, without a round trip.
+
+    The revocation list is refreshed from db_customer every `refresh_interval`
+    seconds by `fetch_revocations`, which returns the `GetRevokedTokens` payload.
+    Logouts seen by this frontend are revoked immediately.
+    """
+
+    def __init__(self, key: bytes, fetch_revocations: Callable[[], Dict[str, Any]], refresh_interval: float):
+        self._key = key
+        self._fetch = fetch_revocations
+        self._refresh_interval = refresh_interval
+        self._revoked = RevocationList()
+        threading.Thread(target=self._refresh_loop, name="token-revocations", daemon=True).start()
+
+    def check(self, token: str):
+        return check_token(self._key, token, self._revoked.__contains__)
+
+    def revoke(self, token: str) -> None:
+        claims = decode_token(self._key, token)
+        if claims is not None:
+            self._revoked.add(claims["sid"], claims["exp"])
+
+    def refresh(self) -> None:
+        payload = self._fetch() or {}
+        self._revoked.merge(payload.get("revoked", []))
+        self._revoked.prune(time.time())
+
+    def _refresh_loop(self) -> None:
+        while True:
+            try:
+                self.refresh()
+            except (OSError, ConnectionError, KeyError, TypeError):
+                pass
+            time.sleep(self._refresh_interval)
@@ -0,0 +1,144 @@
+import pathlib
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+
+class ReadConnectionPool:
+    """Hands each thread its own read-only connection to a WAL-mode database.
+
+    Readers never take the writer lock: under WAL every statement sees the latest
+    committed snapshot and runs concurrently with other readers and the writer.
+    """
+
+    def __init__(self, path: str):
+        self._uri = pathlib.Path(path).absolute().as_uri() + "?mode=ro"
+        self._tls = threading.local()
+
+    def get(self) -> sqlite3.Connection:
+        conn = getattr(self._tls, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._uri, uri=True, check_same_thread=False)
+            self._tls.conn = conn
+        return conn
+
+
+class GroupCommitter:
+    """Runs write operations on the single writer connection with group commit.
+
+    `run(op)` calls `op(conn, after)` inside a transaction and returns its result
+    only once that transaction is committed. `after` is a list the op may append
+    callables to; they run after the commit, in submission order, and are where
+    in-memory state mirroring the database gets updated.
+
+    With `batch_size` 1 each op commits on its own under `lock`. With a larger
+    batch size a committer thread gathers up to `batch_size` concurrent ops,
+    waiting at most `max_wait` seconds after the first one, runs each under its
+    own savepoint and pays a single commit (and fsync) for the whole group.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, lock: threading.Lock, batch_size: int = 1, max_wait: float = 0.0):
+        self._conn = conn
+        self._lock = lock
+        self._batch_size = max(1, int(batch_size))
+        self._max_wait = max(0.0, float(max_wait))
+        self._queue: "queue.Queue[_PendingWrite]" = queue.Queue()
+        self.batches = 0
+        self.ops = 0
+        if self._batch_size > 1:
+            threading.Thread(target=self._commit_loop, name="group-commit", daemon=True).start()
+
+    def run(self, op: Callable[[sqlite3.Connection, List[Callable[[], None]]], Any]) -> Any:
+        if self._batch_size == 1:
+            after: List[Callable[[], None]] = []
+            with self._lock:
+                try:
+                    result = op(self._conn, after)
+                    self._conn.commit()
+                except BaseException:
+                    self._conn.rollback()
+                    raise
+                self.batches += 1
+                self.ops += 1
+                for fn in after:
+                    fn()
+            return result
+
+        pending = _PendingWrite(op)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batch_size": self._batch_size,
+            "max_wait": self._max_wait,
+            "batches": self.batches,
+            "ops": self.ops,
+            "avg_batch": self.ops / self.batches if self.batches else 0.0,
+        }
+
+    def _gather(self) -> List["_PendingWrite"]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self._max_wait
+        while len(batch) < self._batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _commit_loop(self) -> None:
+        while True:
+            batch = self._gather()
+            with self._lock:
+                try:
+                    # Without an enclosing transaction each savepoint would be
+                    # the outermost one and its RELEASE would commit on its own.
+                    self._conn.execute("BEGIN")
+                    for pending in batch:
+                        self._conn.execute("SAVEPOINT group_op")
+                        try:
+                            pending.result = pending.op(self._conn, pending.after)
+                        except BaseException as exc:
+                            self._conn.execute("ROLLBACK TO group_op")
+                            pending.error = exc
+                            pending.after = []
+                        self._conn.execute("RELEASE group_op")
+                    self._conn.commit()
+                except BaseException as exc:
+                    # Nothing of the group is durable, so no op may report success.
+                    self._conn.rollback()
+                    for pending in batch:
+                        pending.error = pending.error or exc
+                        pending.after = []
+                self.batches += 1
+                self.ops += len(batch)
+                for pending in batch:
+                    for fn in pending.after:
+                        fn()
+            for pending in batch:
+                pending.done.set()
+
+
+class _PendingWrite:
+    __slots__ = ("op", "after", "result", "error", "done")
+
+    def __init__(self, op):
+        self.op = op
+        self.after: List[Callable[[], None]] = []
+        self.result = None
+        self.error: BaseException | None = None
+        self.done = threading.Event()
@@ -1,57 +1,348 @@
+import itertools
 import socket
 import threading
-from typing import Any, Dict
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Dict, Optional, Tuple
 
-from .protocol import recv_msg, send_msg
+from .protocol import JSON, FrameReader, client_hello, recv_msg, send_msg
 
+POOL_MAX_SIZE = 32
+POOL_IDLE_TIMEOUT_SEC = 60.0
 
-_tls = threading.local()
 
+def _connect(host: str, port: int, timeout: float, codec_name: str):
+    sock = socket.create_connection((host, port), timeout=timeout)
+    try:
+        return sock, client_hello(sock, codec_name)
+    except Exception:
+        sock.close()
+        raise
+
+
+def _is_healthy(sock: socket.socket) -> bool:
+    # An idle connection should have nothing to read: readable means the peer
+    # closed it (EOF) or sent something nobody asked for. A socket with a
+    # timeout waits out MSG_DONTWAIT, so make it non-blocking first.
+    sock.settimeout(0)
+    try:
+        return not sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+    except (BlockingIOError, InterruptedError):
+        return True
+    except OSError:
+        return False
 
-def _get_pooled_socket(host: str, port: int, timeout: float) -> socket.socket:
-    key = (host, port)
-    pool = getattr(_tls, "pool", None)
-    if pool is None:
-        pool = {}
-        _tls.pool = pool
-    sock = pool.get(key)
-    if sock is None:
-        sock = socket.create_connection((host, port), timeout=timeout)
-        pool[key] = sock
-    sock.settimeout(timeout)
-    return sock
 
+class _PooledConnection:
+    __slots__ = ("sock", "codec", "reader", "idle_since")
 
-def _drop_pooled_socket(host: str, port: int) -> None:
-    pool = getattr(_tls, "pool", None)
-    if not pool:
-        return
-    sock = pool.pop((host, port), None)
-    if sock is not None:
+    def __init__(self, sock: socket.socket, codec):
+        self.sock = sock
+        self.codec = codec
+        self.reader = FrameReader(sock)
+        self.idle_since = 0.0
+
+    def close(self) -> None:
         try:
-            sock.close()
+            self.sock.close()
         except Exception:
             pass
 
 
+class ConnectionPool:
+    """Bounded set of request/response connections to one server, shared by all threads.
+
+    `checkout` hands out an idle connection (most recently used first, so extra
+    ones go cold and are evicted after `idle_timeout`), opens a new one while
+    fewer than `max_size` exist, or waits for a `checkin`. Idle connections are
+    health-checked before reuse. The number of backend connections is therefore
+    capped no matter how many threads make calls; `stats()` reports how long
+    callers waited for one.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        max_size: int = POOL_MAX_SIZE,
+        idle_timeout: float = POOL_IDLE_TIMEOUT_SEC,
+        codec_name: str = JSON.name,
+    ):
+        self.host = host
+        self.port = port
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.codec_name = codec_name
+        self._cond = threading.Condition()
+        self._idle: "deque[_PooledConnection]" = deque()
+        self._size = 0
+        self.checkouts = 0
+        self.created = 0
+        self.discarded = 0
+        self.evicted = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def checkout(self, timeout: float = 5.0) -> _PooledConnection:
+        deadline = None
+        waited_from = None
+        with self._cond:
+            while True:
+                self._evict_idle(time.monotonic())
+                while self._idle:
+                    conn = self._idle.pop()
+                    if _is_healthy(conn.sock) and not conn.reader.buffered():
+                        self._checked_out(waited_from)
+                        return conn
+                    self._size -= 1
+                    self.discarded += 1
+                    conn.close()
+                if self._size < self.max_size:
+                    self._size += 1
+                    self._checked_out(waited_from)
+                    break
+                if waited_from is None:
+                    waited_from = time.monotonic()
+                    deadline = waited_from + timeout
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._record_wait(waited_from)
+                    raise TimeoutError(f"no connection to {self.host}:{self.port} free within {timeout}s")
+                self._cond.wait(remaining)
+        try:
+            sock, codec = _connect(self.host, self.port, timeout, self.codec_name)
+        except BaseException:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self.created += 1
+        return _PooledConnection(sock, codec)
+
+    def _checked_out(self, waited_from: Optional[float]) -> None:
+        self.checkouts += 1
+        if waited_from is not None:
+            self._record_wait(waited_from)
+
+    def _record_wait(self, waited_from: float) -> None:
+        waited = time.monotonic() - waited_from
+        self.waits += 1
+        self.wait_time += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def checkin(self, conn: _PooledConnection, reusable: bool = True) -> None:
+        with self._cond:
+            if reusable:
+                conn.idle_since = time.monotonic()
+                self._idle.append(conn)
+            else:
+                self._size -= 1
+                self.discarded += 1
+                conn.close()
+            self._cond.notify()
+
+    def _evict_idle(self, now: float) -> None:
+        while self._idle and now - self._idle[0].idle_since > self.idle_timeout:
+            self._idle.popleft().close()
+            self._size -= 1
+            self.evicted += 1
+
+    def request(self, req: Dict[str, Any], timeout: float = 5.0) -> Dict[str, Any]:
+        try:
+            return self._request_once(req, timeout)
+        except ConnectionError:
+            # The server may have closed a connection between the health check and
+            # our send; one retry on a fresh checkout covers that.
+            return self._request_once(req, timeout)
+
+    def _request_once(self, req: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        conn = self.checkout(timeout)
+        try:
+            conn.sock.settimeout(timeout)
+            send_msg(conn.sock, req, conn.codec)
+            resp = conn.reader.recv_msg(conn.codec)
+        except BaseException:
+            # Timed out or failed mid-exchange: the framing state is unknown.
+            self.checkin(conn, reusable=False)
+            raise
+        self.checkin(conn)
+        return resp
+
+    def close(self) -> None:
+        with self._cond:
+            while self._idle:
+                self._idle.pop().close()
+                self._size -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "checkouts": self.checkouts,
+                "created": self.created,
+                "discarded": self.discarded,
+                "evicted": self.evicted,
+                "waits": self.waits,
+                "wait_ms_total": round(self.wait_time * 1000, 3),
+                "wait_ms_max": round(self.max_wait * 1000, 3),
+            }
+
+
+_pools_lock = threading.Lock()
+_pools: Dict[Tuple[str, int, str], ConnectionPool] = {}
+
+
+def get_pool(host: str, port: int, codec_name: str = JSON.name) -> ConnectionPool:
+    """The process-wide pool behind `tcp_request(..., reuse_socket=True)`."""
+    key = (host, port, codec_name)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(host, port, codec_name=codec_name)
+            _pools[key] = pool
+        return pool
+
+
+class MultiplexedConnection:
+    """One socket shared by many threads, with any number of requests in flight.
+
+    Each request goes out under a connection-private request_id; a reader thread
+    hands responses back to the waiting futures in whatever order the server
+    sends them, with the caller's own request_id restored.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float = 5.0, codec_name: str = JSON.name):
+        self._sock, self._codec = _connect(host, port, timeout, codec_name)
+        self._sock.settimeout(None)
+        self._reader = FrameReader(self._sock)
+        self._send_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._pending: Dict[int, Tuple[Future, Any]] = {}  # wire id -> (future, caller request_id)
+        self._ids = itertools.count(1)
+        self.closed = False
+        threading.Thread(target=self._read_loop, name=f"mux-{host}:{port}", daemon=True).start()
+
+    def _submit(self, req: Dict[str, Any]) -> Tuple[int, Future]:
+        fut: Future = Future()
+        wire_id = next(self._ids)
+        with self._lock:
+            if self.closed:
+                raise ConnectionError("connection closed")
+            self._pending[wire_id] = (fut, req.get("request_id"))
+        try:
+            with self._send_lock:
+                send_msg(self._sock, {**req, "request_id": wire_id}, self._codec)
+        except OSError as exc:
+            self._fail(exc)
+            raise
+        return wire_id, fut
+
+    def submit(self, req: Dict[str, Any]) -> Future:
+        return self._submit(req)[1]
+
+    def request(self, req: Dict[str, Any], timeout: float = 5.0) -> Dict[str, Any]:
+        wire_id, fut = self._submit(req)
+        try:
+            return fut.result(timeout)
+        except TimeoutError:
+            with self._lock:
+                self._pending.pop(wire_id, None)
+            raise
+
+    def _read_loop(self) -> None:
+        try:
+            while True:
+                resp = self._reader.recv_msg(self._codec)
+                with self._lock:
+                    entry = self._pending.pop(resp.get("request_id"), None)
+                if entry is None:
+                    continue  # the caller already gave up on it
+                fut, request_id = entry
+                resp["request_id"] = request_id
+                fut.set_result(resp)
+        except Exception as exc:
+            self._fail(exc)
+
+    def _fail(self, exc: BaseException) -> None:
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            pending, self._pending = self._pending, {}
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        for fut, _ in pending.values():
+            fut.set_exception(ConnectionError(f"connection lost: {exc}"))
+
+    def close(self) -> None:
+        self._fail(ConnectionError("closed by client"))
+
+
+_mux_lock = threading.Lock()
+_mux_connections: Dict[Tuple[str, int, str], MultiplexedConnection] = {}
+
+
+def _get_mux_connection(host: str, port: int, timeout: float, codec_name: str = JSON.name) -> MultiplexedConnection:
+    key = (host, port, codec_name)
+    with _mux_lock:
+        conn = _mux_connections.get(key)
+        if conn is None or conn.closed:
+            conn = MultiplexedConnection(host, port, timeout, codec_name)
+            _mux_connections[key] = conn
+        return conn
+
+
+def tcp_submit(
+    host: str,
+    port: int,
+    req: Dict[str, Any],
+    timeout: float = 5.0,
+    codec_name: str = JSON.name,
+) -> Future:
+    """Send `req` on the process-wide multiplexed connection to (host, port).
+
+    Returns a future for the response without waiting, so one thread can have
+    several calls in flight at once and collect them with `.result(timeout)`.
+    """
+    try:
+        return _get_mux_connection(host, port, timeout, codec_name).submit(req)
+    except ConnectionError:
+        return _get_mux_connection(host, port, timeout, codec_name).submit(req)
+
+
 def tcp_request(
     host: str,
     port: int,
     req: Dict[str, Any],
     timeout: float = 5.0,
     reuse_socket: bool = False,
+    multiplex: bool = False,
+    codec_name: str = JSON.name,
 ) -> Dict[str, Any]:
+    """Send `req` and wait for its response.
+
+    `codec_name` other than "json" is negotiated with the server when the
+    connection is opened; servers that don't know it keep the connection in JSON.
+    """
+    if multiplex:
+        try:
+            return _get_mux_connection(host, port, timeout, codec_name).request(req, timeout)
+        except ConnectionError:
+            # Covers a connection found dead on send as well as one lost mid-call.
+            return _get_mux_connection(host, port, timeout, codec_name).request(req, timeout)
+
     if not reuse_socket:
-        with socket.create_connection((host, port), timeout=timeout) as sock:
-            send_msg(sock, req)
-            return recv_msg(sock)
+        sock, codec = _connect(host, port, timeout, codec_name)
+        with sock:
+            send_msg(sock, req, codec)
+            return recv_msg(sock, codec)
 
-    sock = _get_pooled_socket(host, port, timeout)
-    try:
-        send_msg(sock, req)
-        return recv_msg(sock)
-    except (OSError, ConnectionError):
-        _drop_pooled_socket(host, port)
-        sock = _get_pooled_socket(host, port, timeout)
-        send_msg(sock, req)
-        return recv_msg(sock)
+    return get_pool(host, port, codec_name).request(req, timeout)
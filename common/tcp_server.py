@@ -1,33 +1,432 @@
+import asyncio
+import os
+import queue
+import signal
+import socket
 import socketserver
-from typing import Any, Dict
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
 
-from .protocol import recv_msg, send_msg
+from .protocol import HELLO_API, JSON, FrameReader, answer_hello, encode_msg, read_msg_async, send_msg
+
+ENGINES = ("threading", "asyncio")
+DEFAULT_HANDLER_THREADS = 32
+DEFAULT_QUEUE_SIZE = 256
+DEFAULT_QUEUE_TIMEOUT_SEC = 1.0
+WORKER_RESTART_DELAY_SEC = 0.5
+MAX_DISPATCH_THREADS = 1024
+
+
+def error_response(req: Dict[str, Any], code: str, message: str) -> Dict[str, Any]:
+    return {
+        "type": "Response",
+        "request_id": req.get("request_id") if isinstance(req, dict) else None,
+        "ok": False,
+        "error": {"code": code, "message": message},
+        "data": None,
+    }
+
+
+class WorkerPool:
+    """Fixed set of handler threads fed by a bounded queue, with load shedding.
+
+    `submit` never blocks: when the queue is full, or a request has waited longer
+    than `queue_timeout` by the time a worker picks it up, the returned future
+    resolves to an OVERLOADED error instead of running the handler. Under overload
+    callers get a fast rejection rather than an ever-growing queueing delay.
+    """
+
+    def __init__(
+        self,
+        handler_fn,
+        size: int = DEFAULT_HANDLER_THREADS,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        queue_timeout: Optional[float] = DEFAULT_QUEUE_TIMEOUT_SEC,
+    ):
+        self._handler_fn = handler_fn
+        self._queue: "queue.Queue[tuple]" = queue.Queue(maxsize=queue_size)
+        self._queue_timeout = queue_timeout
+        self.size = size
+        self.completed = 0
+        self.rejected = 0
+        self.expired = 0
+        for i in range(size):
+            threading.Thread(target=self._work, name=f"handler-{i}", daemon=True).start()
+
+    def submit(self, req: Dict[str, Any]) -> Future:
+        fut: Future = Future()
+        try:
+            self._queue.put_nowait((time.monotonic(), req, fut))
+        except queue.Full:
+            self.rejected += 1
+            fut.set_result(error_response(req, "OVERLOADED", "server overloaded, request queue full"))
+        return fut
+
+    def _work(self) -> None:
+        while True:
+            enqueued_at, req, fut = self._queue.get()
+            if self._queue_timeout and time.monotonic() - enqueued_at > self._queue_timeout:
+                self.expired += 1
+                fut.set_result(error_response(req, "OVERLOADED", "server overloaded, request waited too long"))
+                continue
+            try:
+                resp = self._handler_fn(req)
+            except Exception as exc:
+                resp = error_response(req, "INTERNAL", str(exc))
+            self.completed += 1
+            fut.set_result(resp)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": self.size,
+            "queued": self._queue.qsize(),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "expired": self.expired,
+        }
 
 
 class JsonTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
     allow_reuse_address = True
     daemon_threads = True
+    request_queue_size = 1024
+    reuse_port = False
+    worker_pool: Optional[WorkerPool] = None
+
+    def __init__(self, *args, **kwargs):
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def server_bind(self) -> None:
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def dispatch(self, req: Dict[str, Any], client_address) -> Future:
+        """Start handling `req` and return a future for its response."""
+        if self.worker_pool is not None:
+            return self.worker_pool.submit(req)
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    # Idle threads are reused, so this only grows to the peak number
+                    # of requests in flight at once.
+                    self._executor = ThreadPoolExecutor(MAX_DISPATCH_THREADS, thread_name_prefix="handler")
+        return self._executor.submit(self._handle_safely, req, client_address)
+
+    def _handle_safely(self, req: Dict[str, Any], client_address):
+        try:
+            return self.handle_request_msg(req, client_address)  # type: ignore[attr-defined]
+        except Exception as exc:
+            return error_response(req, "INTERNAL", str(exc))
+
+    def server_close(self) -> None:
+        super().server_close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
 
 
 class JsonRequestHandler(socketserver.BaseRequestHandler):
+    """Reads requests off one connection and answers them.
+
+    Clients may pipeline: several requests can be in flight on the connection at
+    once, and responses are written as they complete, possibly out of order, to
+    be matched up by `request_id`. A connection is served inline, one request at
+    a time, until a read brings in more than one request; from then on each
+    request is dispatched as soon as it arrives.
+    """
+
     def handle(self) -> None:
+        server = self.server
+        pipelined = server.worker_pool is not None  # type: ignore[attr-defined]
+        codec = JSON
+        reader = FrameReader(self.request)
+        send_lock = threading.Lock()
+        idle = threading.Condition()
+        in_flight = 0
+
+        def reply(fut: Future, codec) -> None:
+            nonlocal in_flight
+            resp = fut.result()
+            if resp is not None:
+                with send_lock:
+                    try:
+                        send_msg(self.request, resp, codec)
+                    except Exception:
+                        pass
+            with idle:
+                in_flight -= 1
+                if not in_flight:
+                    idle.notify_all()
+
         while True:
             try:
-                req = recv_msg(self.request)
+                req = reader.recv_msg(codec)
             except Exception:
                 break
-            resp = self.server.handle_request_msg(req, self.client_address)  # type: ignore[attr-defined]
+            if req.get("api") == HELLO_API:
+                resp, new_codec = answer_hello(req)
+                with send_lock:
+                    try:
+                        send_msg(self.request, resp, codec)
+                    except Exception:
+                        break
+                codec = new_codec
+                continue
+            if not pipelined:
+                resp = server._handle_safely(req, self.client_address)  # type: ignore[attr-defined]
+                # Checked before answering, so only a client that really pipelines trips it.
+                pipelined = reader.buffered()
+                if resp is not None:
+                    try:
+                        send_msg(self.request, resp, codec)
+                    except Exception:
+                        break
+                continue
+            try:
+                fut = server.dispatch(req, self.client_address)  # type: ignore[attr-defined]
+            except RuntimeError:
+                break  # server closed
+            with idle:
+                in_flight += 1
+            fut.add_done_callback(lambda f, c=codec: reply(f, c))
+
+        # A client may half-close after its last request; finish answering first.
+        with idle:
+            idle.wait_for(lambda: not in_flight)
+
+
+def run_sync(coro):
+    """Run a coroutine that never suspends to completion, without an event loop.
+
+    Lets one `async def` handler body serve both engines: with blocking backend
+    calls underneath, its awaits all complete immediately and the threading
+    engine can call it like a plain function.
+    """
+    try:
+        coro.send(None)
+    except StopIteration as done:
+        return done.value
+    coro.close()
+    raise RuntimeError("coroutine suspended; it needs an event loop")
+
+
+class AsyncJsonServer:
+    """asyncio engine: one event loop holds every connection.
+
+    Connections cost a coroutine instead of an OS thread, so thousands of idle or
+    slow clients are cheap. A blocking handler runs on a WorkerPool; a coroutine
+    handler (`async def`) runs on the event loop itself, with no threads at all.
+    Both use the same framing as the threading engine.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        handler_fn,
+        worker_pool: Optional[WorkerPool] = None,
+        reuse_port: bool = False,
+    ):
+        self._sock = socket.create_server((host, port), backlog=1024, reuse_port=reuse_port)
+        self.server_address = self._sock.getsockname()[:2]
+        self._handler_fn = handler_fn
+        self.worker_pool = None
+        if not asyncio.iscoroutinefunction(handler_fn):
+            self.worker_pool = worker_pool or WorkerPool(handler_fn, queue_size=0, queue_timeout=None)
+        self._loop = asyncio.new_event_loop()
+        self._serving = False
+        self._stopped = threading.Event()
+
+    async def _serve_conn(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        codec = JSON
+        pending = set()
+
+        async def reply(req: Dict[str, Any], codec) -> None:
+            if self.worker_pool is not None:
+                resp = await asyncio.wrap_future(self.worker_pool.submit(req))
+            else:
+                try:
+                    resp = await self._handler_fn(req)
+                except Exception as exc:
+                    resp = error_response(req, "INTERNAL", str(exc))
             if resp is not None:
+                writer.write(encode_msg(resp, codec))
+                try:
+                    await writer.drain()
+                except ConnectionError:
+                    pass
+
+        try:
+            while True:
                 try:
-                    send_msg(self.request, resp)
-                except Exception:
+                    req = await read_msg_async(reader, codec)
+                except (asyncio.IncompleteReadError, ConnectionError, ValueError):
                     break
+                if req.get("api") == HELLO_API:
+                    resp, new_codec = answer_hello(req)
+                    writer.write(encode_msg(resp, codec))
+                    codec = new_codec
+                    continue
+                task = asyncio.ensure_future(reply(req, codec))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def serve_forever(self) -> None:
+        self._serving = True
+        asyncio.set_event_loop(self._loop)
+        server = self._loop.run_until_complete(asyncio.start_server(self._serve_conn, sock=self._sock))
+        try:
+            self._loop.run_forever()
+        finally:
+            server.close()
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.run_until_complete(server.wait_closed())
+            self._loop.close()
+            self._stopped.set()
+
+    def shutdown(self) -> None:
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def server_close(self) -> None:
+        if self._serving:
+            self._stopped.wait(timeout=5)
+        else:
+            self._sock.close()
+
+
+def add_engine_args(parser) -> None:
+    parser.add_argument("--engine", choices=ENGINES, default="threading")
+    parser.add_argument(
+        "--handler-threads",
+        type=int,
+        default=None,
+        help=(
+            "Run handlers on a fixed pool of this many threads with admission control "
+            f"(always on for the asyncio engine, default {DEFAULT_HANDLER_THREADS})."
+        ),
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=DEFAULT_QUEUE_SIZE,
+        help="Requests allowed to wait for a handler thread before new ones get OVERLOADED.",
+    )
+    parser.add_argument(
+        "--queue-timeout-ms",
+        type=float,
+        default=DEFAULT_QUEUE_TIMEOUT_SEC * 1000,
+        help="Requests that waited longer than this for a handler thread get OVERLOADED (0 disables).",
+    )
+
+
+def engine_options(args) -> Dict[str, Any]:
+    return {
+        "engine": args.engine,
+        "handler_threads": args.handler_threads,
+        "queue_size": args.queue_size,
+        "queue_timeout": args.queue_timeout_ms / 1000.0 or None,
+    }
 
 
-def run_server(host: str, port: int, handler_fn):
+def run_server(
+    host: str,
+    port: int,
+    handler_fn,
+    engine: str = "threading",
+    handler_threads: Optional[int] = None,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    queue_timeout: Optional[float] = DEFAULT_QUEUE_TIMEOUT_SEC,
+    reuse_port: bool = False,
+):
+    """Serve `handler_fn` until interrupted.
+
+    With the threading engine and no `handler_threads`, each connection thread
+    runs the handler itself, as before. Otherwise handlers run on a WorkerPool
+    that sheds load with OVERLOADED responses once `queue_size` requests are
+    waiting or a request waited longer than `queue_timeout` seconds. A coroutine
+    handler needs the asyncio engine and runs on its event loop.
+    """
+    pool = None
+    if asyncio.iscoroutinefunction(handler_fn):
+        if engine != "asyncio":
+            raise ValueError("coroutine handlers need the asyncio engine")
+    elif handler_threads or engine == "asyncio":
+        pool = WorkerPool(handler_fn, handler_threads or DEFAULT_HANDLER_THREADS, queue_size, queue_timeout)
+
+    if engine == "asyncio":
+        server = AsyncJsonServer(host, port, handler_fn, pool, reuse_port)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+        return
+
     class _Server(JsonTCPServer):
+        worker_pool = pool
+
         def handle_request_msg(self, req: Dict[str, Any], _addr):
             return handler_fn(req)
 
+    _Server.reuse_port = reuse_port
     with _Server((host, port), JsonRequestHandler) as server:
         server.serve_forever()
+
+
+def run_workers(host: str, port: int, handler_factory: Callable[[], Any], workers: int = 1, **options):
+    """Serve from `workers` processes sharing (host, port) through SO_REUSEPORT.
+
+    Meant for stateless services: each worker builds its own handler with
+    `handler_factory` after the fork and runs `run_server`, and the kernel spreads
+    incoming connections across them. The parent only supervises, restarting any
+    worker that exits. With one worker the server runs in-process as before.
+    """
+    if workers <= 1:
+        run_server(host, port, handler_factory(), **options)
+        return
+
+    children: Dict[int, int] = {}
+
+    def spawn(slot: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                run_server(host, port, handler_factory(), reuse_port=True, **options)
+            finally:
+                os._exit(1)
+        children[pid] = slot
+
+    def stop(_signum, _frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    for slot in range(workers):
+        spawn(slot)
+    try:
+        while True:
+            pid, _status = os.wait()
+            slot = children.pop(pid, None)
+            if slot is None:
+                continue
+            time.sleep(WORKER_RESTART_DELAY_SEC)
+            spawn(slot)
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
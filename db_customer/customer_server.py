@@ -1,20 +1,33 @@
+import heapq
+import logging
 import os
 import sqlite3
 import sys
 import threading
 import time
 import uuid
-from typing import Any, Dict
+from collections import deque
+from typing import Any, Deque, Dict, List, Set, Tuple
 
 _ROOT = os.path.dirname(os.path.dirname(__file__))
 if _ROOT not in sys.path:
     sys.path.append(_ROOT)
 
-from common.tcp_server import run_server
+from common.batch import run_batch
+from common.protocol import BATCH_API
+from common.session_token import RevocationList, check_token, decode_token, is_token, issue_token
+from common.sqlite_pool import ReadConnectionPool
+from common.tcp_server import add_engine_args, engine_options, run_server
+
+logger = logging.getLogger(__name__)
 
 MAX_NAME_LEN = 32
 
 SESSION_TIMEOUT_SEC = 5 * 60
+SESSION_FLUSH_INTERVAL_SEC = 1.0
+SESSION_SWEEP_BATCH = 1000
+SESSION_FLUSH_CHUNK = 500
+SESSION_STATS_WINDOW_SEC = 60.0
 
 
 def _ok(req, data=None):
@@ -39,11 +52,149 @@ def _err(req, code, message):
 
 def _new_session(conn: sqlite3.Connection, role: str, user_id: int):
     session_id = str(uuid.uuid4())
+    last_active = time.time()
     conn.execute(
         "INSERT INTO sessions(session_id, role, user_id, last_active) VALUES (?, ?, ?, ?)",
-        (session_id, role, user_id, time.time()),
+        (session_id, role, user_id, last_active),
     )
-    return session_id
+    return session_id, last_active
+
+
+class _SessionStore:
+    """In-memory view of the sessions table.
+
+    ValidateSession is answered from a dict under a short store lock and never
+    touches SQLite. Refreshed last_active values and evicted sessions are written
+    back in batches by `flush`; Login and Logout write through, so they stay
+    durable.
+
+    Expiry is driven by a min-heap of (deadline, session_id) holding at most one
+    live entry per session. Touches do not push new entries: when an entry comes
+    due, `sweep` re-checks the session's real deadline and either evicts it or
+    re-queues it, so abandoned sessions are removed without anyone validating them.
+    """
+
+    def __init__(self, timeouts: Dict[str, float]):
+        self._lock = threading.Lock()
+        self._timeouts = timeouts
+        self._sessions: Dict[str, List[Any]] = {}  # session_id -> [role, user_id, last_active]
+        self._deadlines: List[Tuple[float, str]] = []
+        self._dirty: Set[str] = set()
+        self._expired: Set[str] = set()
+        self._started = time.time()
+        self._evicted_by_sweep = 0
+        self._evicted_on_access = 0
+        self._recent_evictions: Deque[Tuple[float, int]] = deque()
+
+    def _timeout(self, role: str) -> float:
+        return self._timeouts.get(role, SESSION_TIMEOUT_SEC)
+
+    def _track(self, session_id: str, entry: List[Any]) -> None:
+        self._sessions[session_id] = entry
+        heapq.heappush(self._deadlines, (entry[2] + self._timeout(entry[0]), session_id))
+
+    def load(self, conn: sqlite3.Connection) -> None:
+        cur = conn.execute("SELECT session_id, role, user_id, last_active FROM sessions")
+        with self._lock:
+            for session_id, role, user_id, last_active in cur.fetchall():
+                self._track(session_id, [role, int(user_id), float(last_active)])
+
+    def add(self, session_id: str, role: str, user_id: int, last_active: float) -> None:
+        with self._lock:
+            self._track(session_id, [role, user_id, last_active])
+
+    def remove(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._dirty.discard(session_id)
+
+    def touch(self, session_id: str, now: float) -> Tuple[str, Any]:
+        """Return ("ok", (role, user_id)), ("expired", None) or ("missing", None)."""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return "missing", None
+            if now - entry[2] > self._timeout(entry[0]):
+                self._evict(session_id)
+                self._evicted_on_access += 1
+                return "expired", None
+            entry[2] = now
+            self._dirty.add(session_id)
+            return "ok", (entry[0], entry[1])
+
+    def sweep(self, now: float, limit: int) -> int:
+        """Evict up to `limit` sessions whose deadline has passed; return how many."""
+        evicted = 0
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now and evicted < limit:
+                _, session_id = heapq.heappop(self._deadlines)
+                entry = self._sessions.get(session_id)
+                if entry is None:
+                    continue
+                deadline = entry[2] + self._timeout(entry[0])
+                if deadline > now:
+                    heapq.heappush(self._deadlines, (deadline, session_id))
+                    continue
+                self._evict(session_id)
+                evicted += 1
+            self._evicted_by_sweep += evicted
+            self._recent_evictions.append((now, evicted))
+            while self._recent_evictions and now - self._recent_evictions[0][0] > SESSION_STATS_WINDOW_SEC:
+                self._recent_evictions.popleft()
+        return evicted
+
+    def _evict(self, session_id: str) -> None:
+        del self._sessions[session_id]
+        self._dirty.discard(session_id)
+        self._expired.add(session_id)
+
+    def flush(self, conn: sqlite3.Connection, lock: threading.Lock, chunk: int = SESSION_FLUSH_CHUNK) -> None:
+        with self._lock:
+            touched = [(self._sessions[sid][2], sid) for sid in self._dirty]
+            expired = [(sid,) for sid in self._expired]
+            self._dirty = set()
+            self._expired = set()
+        # One transaction per chunk, releasing the writer lock in between, so a
+        # burst of expiries never stalls other writes for long.
+        writes = [
+            ("UPDATE sessions SET last_active = ? WHERE session_id = ?", touched[i : i + chunk])
+            for i in range(0, len(touched), chunk)
+        ]
+        writes += [
+            ("DELETE FROM sessions WHERE session_id = ?", expired[i : i + chunk]) for i in range(0, len(expired), chunk)
+        ]
+        for done, (sql, rows) in enumerate(writes):
+            with lock:
+                try:
+                    conn.executemany(sql, rows)
+                    conn.commit()
+                except sqlite3.Error:
+                    conn.rollback()
+                    with self._lock:
+                        # Retried by the next flush; sessions logged out meanwhile are gone for good.
+                        for unwritten_sql, unwritten in writes[done:]:
+                            if unwritten_sql.startswith("UPDATE"):
+                                self._dirty |= {sid for _, sid in unwritten if sid in self._sessions}
+                            else:
+                                self._expired |= {sid for (sid,) in unwritten}
+                    raise
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            by_role: Dict[str, int] = {}
+            for role, _, _ in self._sessions.values():
+                by_role[role] = by_role.get(role, 0) + 1
+            recent = sum(n for _, n in self._recent_evictions)
+            window = min(SESSION_STATS_WINDOW_SEC, max(time.time() - self._started, 1e-9))
+            return {
+                "active": len(self._sessions),
+                "by_role": by_role,
+                "timeouts": dict(self._timeouts),
+                "evicted_by_sweep": self._evicted_by_sweep,
+                "evicted_on_access": self._evicted_on_access,
+                "evictions_per_sec": recent / window,
+                "pending_deletes": len(self._expired),
+            }
 
 
 def _get_user_row(conn: sqlite3.Connection, table: str, user_id, req, not_found_message: str):
@@ -87,6 +238,14 @@ def _init_db(conn: sqlite3.Connection) -> None:
         )
         """
     )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS revoked_tokens (
+            token_id TEXT PRIMARY KEY,
+            expires_at REAL
+        )
+        """
+    )
     conn.execute(
         """
         CREATE TABLE IF NOT EXISTS cart_items (
@@ -100,12 +259,53 @@ def _init_db(conn: sqlite3.Connection) -> None:
     conn.commit()
 
 
-def handle_request_factory(state_path: str):
+def handle_request_factory(
+    state_path: str,
+    session_flush_interval: float = SESSION_FLUSH_INTERVAL_SEC,
+    session_timeouts: Dict[str, float] | None = None,
+    token_key: bytes | None = None,
+    token_ttl: float = SESSION_TIMEOUT_SEC,
+):
     conn = sqlite3.connect(state_path, check_same_thread=False)
     conn.execute("PRAGMA foreign_keys = ON")
     conn.execute("PRAGMA journal_mode = WAL")
     _init_db(conn)
     lock = threading.Lock()
+    readers = ReadConnectionPool(state_path)
+    sessions = _SessionStore(session_timeouts or {"buyer": SESSION_TIMEOUT_SEC, "seller": SESSION_TIMEOUT_SEC})
+    sessions.load(conn)
+    # In token mode Login hands out signed tokens instead of session rows; only
+    # logged-out tokens are stored, until they would have expired anyway.
+    revocations = RevocationList()
+    revocations.merge(conn.execute("SELECT token_id, expires_at FROM revoked_tokens").fetchall())
+
+    def prune_revocations():
+        expired = revocations.prune(time.time())
+        if expired:
+            with lock:
+                try:
+                    conn.executemany("DELETE FROM revoked_tokens WHERE token_id = ?", [(t,) for t in expired])
+                    conn.commit()
+                except sqlite3.Error:
+                    conn.rollback()
+                    raise
+
+    def maintain_sessions():
+        while True:
+            time.sleep(session_flush_interval)
+            try:
+                # Evict in bounded batches so the store lock is released between them.
+                while sessions.sweep(time.time(), SESSION_SWEEP_BATCH) == SESSION_SWEEP_BATCH:
+                    pass
+                sessions.flush(conn, lock)
+                prune_revocations()
+            except sqlite3.Error:
+                logger.exception("session flush failed; retrying on the next pass")
+            except Exception:
+                # Never let one bad pass stop session expiry for the rest of the process.
+                logger.exception("session maintenance failed")
+
+    threading.Thread(target=maintain_sessions, name="session-maintenance", daemon=True).start()
 
     def handle(req: Dict[str, Any]):
         api = req.get("api")
@@ -114,6 +314,9 @@ def handle_request_factory(state_path: str):
         if api == "Ping":
             return _ok(req, {"now": time.time()})
 
+        if api == BATCH_API:
+            return run_batch(req, handle)
+
         if api == "CreateBuyer":
             name = data.get("name")
             password = data.get("password")
@@ -160,76 +363,89 @@ def handle_request_factory(state_path: str):
                 if not row or row[1] != password:
                     return _err(req, "AUTH_FAILED", "invalid credentials")
                 user_id = int(row[0])
-                session_id = _new_session(conn, role, user_id)
+                if token_key is not None:
+                    expires_at = time.time() + token_ttl
+                    token = issue_token(token_key, str(uuid.uuid4()), role, user_id, expires_at)
+                    return _ok(req, {"session_id": token, "user_id": user_id, "role": role, "expires_at": expires_at})
+                session_id, last_active = _new_session(conn, role, user_id)
                 conn.commit()
+                sessions.add(session_id, role, user_id, last_active)
                 return _ok(req, {"session_id": session_id, "user_id": user_id, "role": role})
 
         if api == "Logout":
             session_id = data.get("session_id")
             if not session_id:
                 return _err(req, "INVALID_ARGUMENT", "session_id required")
+            if token_key is not None and is_token(session_id):
+                claims = decode_token(token_key, session_id)
+                if claims is not None:
+                    with lock:
+                        conn.execute(
+                            "INSERT OR REPLACE INTO revoked_tokens(token_id, expires_at) VALUES (?, ?)",
+                            (claims["sid"], claims["exp"]),
+                        )
+                        conn.commit()
+                        revocations.add(claims["sid"], claims["exp"])
+                return _ok(req, {"logged_out": True})
             with lock:
                 conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
                 conn.commit()
+                sessions.remove(session_id)
                 return _ok(req, {"logged_out": True})
 
         if api == "ValidateSession":
             session_id = data.get("session_id")
             if not session_id:
                 return _err(req, "INVALID_ARGUMENT", "session_id required")
-            with lock:
-                cur = conn.execute(
-                    "SELECT role, user_id, last_active FROM sessions WHERE session_id = ?",
-                    (session_id,),
-                )
-                row = cur.fetchone()
-                if not row:
-                    return _err(req, "NOT_LOGGED_IN", "invalid session")
-                role, user_id, last_active = row
-                now = time.time()
-                if now - float(last_active) > SESSION_TIMEOUT_SEC:
-                    conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
-                    conn.commit()
-                    return _err(req, "SESSION_TIMEOUT", "session expired")
-                conn.execute(
-                    "UPDATE sessions SET last_active = ? WHERE session_id = ?",
-                    (now, session_id),
-                )
-                conn.commit()
-                return _ok(req, {"role": role, "user_id": int(user_id)})
+            if token_key is not None and is_token(session_id):
+                claims, error = check_token(token_key, session_id, revocations.__contains__)
+                if error:
+                    return _err(req, *error)
+                return _ok(req, {"role": claims["r"], "user_id": int(claims["u"])})
+            status, sess = sessions.touch(session_id, time.time())
+            if status == "missing":
+                return _err(req, "NOT_LOGGED_IN", "invalid session")
+            if status == "expired":
+                return _err(req, "SESSION_TIMEOUT", "session expired")
+            role, user_id = sess
+            return _ok(req, {"role": role, "user_id": user_id})
+
+        if api == "GetRevokedTokens":
+            return _ok(req, {"revoked": revocations.entries(), "now": time.time()})
+
+        if api == "GetStats":
+            return _ok(req, {"sessions": sessions.stats()})
 
         if api == "GetSellerRating":
-            with lock:
-                row, err = _get_user_row(conn, "sellers", data.get("seller_id"), req, "seller not found")
-                if err:
-                    return err
-                return _ok(
-                    req,
-                    {
-                        "seller_id": int(row[0]),
-                        "feedback": {"up": int(row[3]), "down": int(row[4])},
-                    },
-                )
+            row, err = _get_user_row(readers.get(), "sellers", data.get("seller_id"), req, "seller not found")
+            if err:
+                return err
+            return _ok(
+                req,
+                {
+                    "seller_id": int(row[0]),
+                    "feedback": {"up": int(row[3]), "down": int(row[4])},
+                },
+            )
 
         if api == "GetBuyerPurchases":
-            with lock:
-                row, err = _get_user_row(conn, "buyers", data.get("buyer_id"), req, "buyer not found")
-                if err:
-                    return err
-                return _ok(req, {"buyer_id": int(row[0]), "purchases_count": int(row[3])})
+            row, err = _get_user_row(readers.get(), "buyers", data.get("buyer_id"), req, "buyer not found")
+            if err:
+                return err
+            return _ok(req, {"buyer_id": int(row[0]), "purchases_count": int(row[3])})
 
         if api == "GetCart":
-            with lock:
-                row, err = _get_user_row(conn, "buyers", data.get("buyer_id"), req, "buyer not found")
-                if err:
-                    return err
-                buyer_id = int(row[0])
-                cur = conn.execute(
-                    "SELECT item_id, quantity FROM cart_items WHERE buyer_id = ?",
-                    (buyer_id,),
-                )
-                cart = {item_id: int(qty) for item_id, qty in cur.fetchall()}
-                return _ok(req, {"cart": cart})
+            reader = readers.get()
+            row, err = _get_user_row(reader, "buyers", data.get("buyer_id"), req, "buyer not found")
+            if err:
+                return err
+            buyer_id = int(row[0])
+            cur = reader.execute(
+                "SELECT item_id, quantity FROM cart_items WHERE buyer_id = ?",
+                (buyer_id,),
+            )
+            cart = {item_id: int(qty) for item_id, qty in cur.fetchall()}
+            return _ok(req, {"cart": cart})
 
         if api == "UpdateCart":
             item_id = data.get("item_id")
@@ -289,10 +505,31 @@ def main():
     parser.add_argument("--host", default="127.0.0.1")
     parser.add_argument("--port", type=int, default=6001)
     parser.add_argument("--state", default="db_customer/state.db")
+    parser.add_argument(
+        "--session-flush-interval",
+        type=float,
+        default=SESSION_FLUSH_INTERVAL_SEC,
+        help="Seconds between session expiry sweeps and batched write-backs of last_active times.",
+    )
+    parser.add_argument("--buyer-session-timeout", type=float, default=SESSION_TIMEOUT_SEC)
+    parser.add_argument("--seller-session-timeout", type=float, default=SESSION_TIMEOUT_SEC)
+    parser.add_argument(
+        "--token-key",
+        default=os.environ.get("SESSION_TOKEN_KEY"),
+        help="Shared HMAC key; when set, Login returns signed session tokens the frontends verify locally.",
+    )
+    parser.add_argument("--token-ttl", type=float, default=SESSION_TIMEOUT_SEC)
+    add_engine_args(parser)
     args = parser.parse_args()
 
-    handler = handle_request_factory(args.state)
-    run_server(args.host, args.port, handler)
+    handler = handle_request_factory(
+        args.state,
+        args.session_flush_interval,
+        {"buyer": args.buyer_session_timeout, "seller": args.seller_session_timeout},
+        args.token_key.encode("utf-8") if args.token_key else None,
+        args.token_ttl,
+    )
+    run_server(args.host, args.port, handler, **engine_options(args))
 
 
 if __name__ == "__main__":
@@ -1,18 +1,34 @@
+import heapq
+import json
 import os
 import sqlite3
 import sys
 import threading
 import time
-from typing import Any, Dict, List
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Set, Tuple
 
 _ROOT = os.path.dirname(os.path.dirname(__file__))
 if _ROOT not in sys.path:
     sys.path.append(_ROOT)
 
-from common.tcp_server import run_server
+from common.batch import BATCH_THREADS, run_batch
+from common.protocol import BATCH_API
+from common.sqlite_pool import GroupCommitter, ReadConnectionPool
+from common.tcp_server import DEFAULT_HANDLER_THREADS, add_engine_args, engine_options, run_server
 
 MAX_KEYWORDS = 5
 MAX_KEYWORD_LEN = 8
+MAX_BULK_ITEMS = 1000
+SEARCH_CACHE_SIZE = 1024
+MAX_SEARCH_LIMIT = 1000
+CHANGE_FEED_SIZE = 10000
+WATCH_TIMEOUT_MS = 2000
+MAX_WATCH_TIMEOUT_MS = 30000
+MAX_WATCH_EVENTS = 1000
+# Each waiting watcher holds a handler thread; the rest of the pool stays free for other requests.
+MAX_WATCHERS = DEFAULT_HANDLER_THREADS // 4
 
 
 def _ok(req, data=None):
@@ -35,17 +51,287 @@ def _err(req, code, message):
     }
 
 
-def _assign_item_id(conn: sqlite3.Connection, category: int) -> str:
-    cur = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM items WHERE category = ?", (category,))
-    next_seq = int(cur.fetchone()[0]) + 1
-    return f"{category}:{next_seq}", next_seq
+class _SequenceAllocator:
+    """Per-category item sequence numbers, kept in `item_sequences`; use inside a writer op."""
 
+    def __init__(self):
+        self._next: Dict[int, int] = {}
 
-def _keyword_score(item_keywords: List[str], query_keywords: List[str]) -> int:
-    if not query_keywords:
-        return 0
-    item_set = {k.lower() for k in item_keywords}
-    return sum(1 for k in query_keywords if k.lower() in item_set)
+    def allocate(self, conn: sqlite3.Connection, category: int, count: int = 1) -> int:
+        """Reserve `count` consecutive sequence numbers in `category` and return the first."""
+        first = self._next.get(category)
+        if first is None:
+            row = conn.execute("SELECT next_seq FROM item_sequences WHERE category = ?", (category,)).fetchone()
+            first = int(row[0]) if row else 1
+        self._next[category] = first + count
+        conn.execute(
+            """
+            INSERT INTO item_sequences(category, next_seq) VALUES (?, ?)
+            ON CONFLICT(category) DO UPDATE SET next_seq = excluded.next_seq
+            """,
+            (category, first + count),
+        )
+        return first
+
+    def item_ids(self, conn: sqlite3.Connection, category: int, count: int = 1) -> List[Tuple[str, int]]:
+        first = self.allocate(conn, category, count)
+        return [(f"{category}:{seq}", seq) for seq in range(first, first + count)]
+
+
+class _VersionClock:
+    """Item versions from one counter shared by every item; use inside a writer op."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._last = int(conn.execute("SELECT COALESCE(MAX(version), 0) FROM items").fetchone()[0])
+
+    @property
+    def last(self) -> int:
+        return self._last
+
+    def next(self, count: int = 1) -> int:
+        """Reserve `count` consecutive versions and return the first."""
+        first = self._last + 1
+        self._last += count
+        return first
+
+
+class _ChangeFeed:
+    """Bounded in-memory log of item changes, for WatchItems; seq is the version."""
+
+    def __init__(self, last_seq: int, max_events: int = CHANGE_FEED_SIZE):
+        self._cond = threading.Condition()
+        self._events: "deque[Dict[str, Any]]" = deque()
+        self._max_events = max(1, max_events)
+        self._floor = last_seq  # events with seq <= floor are no longer retained
+        self._last = last_seq
+        self.watching = 0
+
+    def append(self, events: List[Dict[str, Any]]) -> None:
+        with self._cond:
+            for event in events:
+                self._events.append(event)
+                self._last = event["seq"]
+                if len(self._events) > self._max_events:
+                    self._floor = self._events.popleft()["seq"]
+            self._cond.notify_all()
+
+    def watch(
+        self, since: int, match: Callable[[Dict[str, Any]], bool], limit: int, timeout: float
+    ) -> Tuple[List[Dict[str, Any]] | None, int]:
+        """Return (matching events after `since`, next seq); events are None on resync."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self.watching += 1
+            try:
+                while True:
+                    if since < self._floor or since > self._last:
+                        return None, self._last
+                    new = []
+                    for event in reversed(self._events):
+                        if event["seq"] <= since:
+                            break
+                        new.append(event)
+                    matched = []
+                    for event in reversed(new):
+                        since = event["seq"]
+                        if match(event):
+                            matched.append(event)
+                            if len(matched) == limit:
+                                break
+                    if matched:
+                        return matched, since
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return [], since
+                    self._cond.wait(remaining)
+            finally:
+                self.watching -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "max_events": self._max_events,
+                "events": len(self._events),
+                "first_seq": self._floor + 1,
+                "last_seq": self._last,
+                "watching": self.watching,
+            }
+
+
+class _KeywordIndex:
+    """Inverted index from lowercased keyword to in-stock item_ids, split by category."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings: Dict[str, Dict[int, Set[str]]] = {}
+        self._items: Dict[str, Tuple[int, Tuple[str, ...]]] = {}
+        self._order: Dict[str, Tuple[int, int]] = {}  # item_id -> (category, seq), oldest first
+        self._in_stock: Set[str] = set()
+
+    def load(self, conn: sqlite3.Connection) -> None:
+        cur = conn.execute(
+            """
+            SELECT items.item_id, items.category, items.quantity, item_keywords.keyword
+            FROM items LEFT JOIN item_keywords ON item_keywords.item_id = items.item_id
+            """
+        )
+        keywords: Dict[str, List[str]] = {}
+        meta: Dict[str, Tuple[int, int]] = {}
+        for item_id, category, quantity, keyword in cur.fetchall():
+            meta[item_id] = (int(category), int(quantity))
+            kws = keywords.setdefault(item_id, [])
+            if keyword is not None:
+                kws.append(keyword)
+        for item_id, (category, quantity) in meta.items():
+            self.add(item_id, category, keywords[item_id], quantity > 0)
+
+    def add(self, item_id: str, category: int, keywords: List[str], in_stock: bool) -> None:
+        normalized = tuple(sorted({k.lower() for k in keywords}))
+        seq = int(item_id.split(":", 1)[1])
+        with self._lock:
+            self._items[item_id] = (category, normalized)
+            self._order[item_id] = (category, seq)
+            if in_stock:
+                self._link(item_id)
+
+    def set_in_stock(self, item_id: str, in_stock: bool) -> None:
+        with self._lock:
+            if item_id not in self._items or (item_id in self._in_stock) == in_stock:
+                return
+            if in_stock:
+                self._link(item_id)
+            else:
+                self._unlink(item_id)
+
+    def match(self, query_keywords: List[str], category=None) -> Dict[str, int]:
+        """Return item_id -> number of query keywords the item carries."""
+        scores: Dict[str, int] = {}
+        with self._lock:
+            for kw in query_keywords:
+                by_category = self._postings.get(kw.lower())
+                if not by_category:
+                    continue
+                if category is None:
+                    posting_lists = by_category.values()
+                else:
+                    posting_lists = [by_category.get(int(category), ())]
+                for posting in posting_lists:
+                    for item_id in posting:
+                        scores[item_id] = scores.get(item_id, 0) + 1
+        return scores
+
+    def ranked(self, query_keywords: List[str], category=None, limit=None, after=None) -> List[Tuple[tuple, str]]:
+        """Return up to limit + 1 matches after `after` as ((-score, category, seq), item_id)."""
+        buckets: Dict[int, List[str]] = {}
+        for item_id, score in self.match(query_keywords, category).items():
+            buckets.setdefault(score, []).append(item_id)
+        out: List[Tuple[tuple, str]] = []
+        with self._lock:
+            order = self._order
+            for score in sorted(buckets, reverse=True):
+                item_ids = buckets[score]
+                if after is not None:
+                    if -score < after[0]:
+                        continue
+                    if -score == after[0]:
+                        item_ids = [item_id for item_id in item_ids if order[item_id] > after[1:]]
+                if limit is None:
+                    chosen = sorted(item_ids, key=order.__getitem__)
+                else:
+                    chosen = heapq.nsmallest(limit + 1 - len(out), item_ids, key=order.__getitem__)
+                out.extend(((-score,) + order[item_id], item_id) for item_id in chosen)
+                if limit is not None and len(out) > limit:
+                    break
+        return out
+
+    def _link(self, item_id: str) -> None:
+        category, keywords = self._items[item_id]
+        for kw in keywords:
+            self._postings.setdefault(kw, {}).setdefault(category, set()).add(item_id)
+        self._in_stock.add(item_id)
+
+    def _unlink(self, item_id: str) -> None:
+        category, keywords = self._items[item_id]
+        for kw in keywords:
+            by_category = self._postings.get(kw)
+            if not by_category:
+                continue
+            posting = by_category.get(category)
+            if posting is None:
+                continue
+            posting.discard(item_id)
+            if not posting:
+                del by_category[category]
+            if not by_category:
+                del self._postings[kw]
+        self._in_stock.discard(item_id)
+
+
+class _SearchCache:
+    """Bounded LRU of SearchItems pages, invalidated by per-category write versions."""
+
+    def __init__(self, max_entries: int = SEARCH_CACHE_SIZE):
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (version, page)
+        self._versions: Dict[int, int] = {}
+        self._global_version = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.invalidations = 0
+
+    def _version(self, category) -> int:
+        # Caller holds self._lock.
+        if category is None:
+            return self._global_version
+        return self._versions.get(category, 0)
+
+    def version(self, category) -> int:
+        with self._lock:
+            return self._version(category)
+
+    def get(self, key: tuple):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == self._version(key[0]):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+                self.stale += 1
+            self.misses += 1
+            return None
+
+    def put(self, key: tuple, version: int, page: Any) -> None:
+        if self._max_entries <= 0:
+            return
+        with self._lock:
+            if version != self._version(key[0]):
+                return  # a write committed while this result was computed
+            self._entries[key] = (version, page)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def bump(self, categories) -> None:
+        with self._lock:
+            for category in set(categories):
+                self._versions[category] = self._versions.get(category, 0) + 1
+            self._global_version += 1
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_entries": self._max_entries,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "invalidations": self.invalidations,
+            }
 
 
 def _init_db(conn: sqlite3.Connection) -> None:
@@ -61,11 +347,16 @@ def _init_db(conn: sqlite3.Connection) -> None:
             quantity INTEGER,
             seller_id INTEGER,
             feedback_up INTEGER DEFAULT 0,
-            feedback_down INTEGER DEFAULT 0
+            feedback_down INTEGER DEFAULT 0,
+            version INTEGER NOT NULL DEFAULT 1
         )
         """
     )
+    # Databases from before item versions: every existing item starts at version 1.
+    if "version" not in {row[1] for row in conn.execute("PRAGMA table_info(items)")}:
+        conn.execute("ALTER TABLE items ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_items_category ON items(category)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_items_seller_version ON items(seller_id, version)")
     conn.execute(
         """
         CREATE TABLE IF NOT EXISTS item_keywords (
@@ -77,6 +368,23 @@ def _init_db(conn: sqlite3.Connection) -> None:
         """
     )
     conn.execute("CREATE INDEX IF NOT EXISTS idx_keywords_keyword ON item_keywords(keyword)")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS item_sequences (
+            category INTEGER PRIMARY KEY,
+            next_seq INTEGER NOT NULL
+        )
+        """
+    )
+    # Databases from before item_sequences existed: seed it from the items, once.
+    conn.execute(
+        """
+        INSERT INTO item_sequences(category, next_seq)
+        SELECT category, MAX(seq) + 1 FROM items
+        WHERE category NOT IN (SELECT category FROM item_sequences)
+        GROUP BY category
+        """
+    )
     conn.commit()
 
 
@@ -88,25 +396,106 @@ def _get_item_row(conn: sqlite3.Connection, item_id, req):
     return row, None
 
 
-def _item_keywords(conn: sqlite3.Connection, item_id: str) -> List[str]:
-    cur = conn.execute("SELECT keyword FROM item_keywords WHERE item_id = ?", (item_id,))
-    return [row[0] for row in cur.fetchall()]
+# Item columns followed by the item's keywords joined with _KEYWORD_SEP, so
+# item-returning APIs load rows and keywords with one statement regardless of
+# result size.
+_KEYWORD_SEP = "\x1f"
+_KEYWORDS_SQL = (
+    "(SELECT group_concat(keyword, char(31)) FROM item_keywords WHERE item_keywords.item_id = items.item_id)"
+)
+_ITEM_SELECT = f"SELECT items.*, {_KEYWORDS_SQL} FROM items"
 
 
-def _row_to_item(row, keywords: List[str]) -> Dict[str, Any]:
+def _row_to_item(row) -> Dict[str, Any]:
     return {
         "item_id": row[0],
         "name": row[1],
         "category": int(row[2]),
-        "keywords": keywords,
+        "keywords": row[11].split(_KEYWORD_SEP) if row[11] else [],
         "condition": row[4],
         "price": float(row[5]),
         "quantity": int(row[6]),
         "seller_id": int(row[7]),
         "feedback": {"up": int(row[8]), "down": int(row[9])},
+        "version": int(row[10]),
     }
 
 
+# Item field -> (columns it is built from, decoder of those column values), in response order.
+_ITEM_FIELDS: Dict[str, Tuple[Tuple[str, ...], Callable[..., Any]]] = {
+    "item_id": (("items.item_id",), lambda v: v),
+    "name": (("items.name",), lambda v: v),
+    "category": (("items.category",), int),
+    "keywords": ((_KEYWORDS_SQL,), lambda v: v.split(_KEYWORD_SEP) if v else []),
+    "condition": (("items.condition",), lambda v: v),
+    "price": (("items.price",), float),
+    "quantity": (("items.quantity",), int),
+    "seller_id": (("items.seller_id",), int),
+    "feedback": (("items.feedback_up", "items.feedback_down"), lambda up, down: {"up": int(up), "down": int(down)}),
+    "version": (("items.version",), int),
+}
+
+
+class _Projection:
+    """The SELECT and row decoder for a subset of item fields; rows start with item_id."""
+
+    def __init__(self, fields: Tuple[str, ...]):
+        columns = ["items.item_id"]
+        self._decoders = []
+        for name in fields:
+            field_columns, decode = _ITEM_FIELDS[name]
+            self._decoders.append((name, len(columns), len(columns) + len(field_columns), decode))
+            columns.extend(field_columns)
+        self.select = f"SELECT {', '.join(columns)} FROM items"
+
+    def item(self, row) -> Dict[str, Any]:
+        return {name: decode(*row[start:stop]) for name, start, stop, decode in self._decoders}
+
+
+class _FullProjection:
+    select = _ITEM_SELECT
+    item = staticmethod(_row_to_item)
+
+
+_FULL_PROJECTION = _FullProjection()
+_projections: Dict[Tuple[str, ...], _Projection] = {}
+
+
+def _item_projection(data: Dict[str, Any]):
+    """Return (projection, error) for the optional `fields` argument of item reads."""
+    fields = data.get("fields")
+    if fields is None:
+        return _FULL_PROJECTION, None
+    if not isinstance(fields, list) or not fields:
+        return None, "fields must be a non-empty list"
+    if not all(isinstance(name, str) for name in fields):
+        return None, "fields must be a list of strings"
+    unknown = [name for name in fields if name not in _ITEM_FIELDS]
+    if unknown:
+        return None, f"unknown item fields: {', '.join(unknown)}"
+    key = tuple(name for name in _ITEM_FIELDS if name in fields)
+    projection = _projections.get(key)
+    if projection is None:
+        projection = _projections.setdefault(key, _Projection(key))
+    return projection, None
+
+
+def _validate_item(data: Dict[str, Any]) -> str | None:
+    required = (data.get(k) for k in ("name", "category", "condition", "price", "quantity", "seller_id"))
+    if None in required:
+        return "missing required item fields"
+    return _validate_keywords(data.get("keywords", []))
+
+
+def _bulk_list(data: Dict[str, Any], key: str) -> Tuple[List[Any], str | None]:
+    values = data.get(key)
+    if not isinstance(values, list) or not values:
+        return [], f"{key} must be a non-empty list"
+    if len(values) > MAX_BULK_ITEMS:
+        return [], f"{key} must have at most {MAX_BULK_ITEMS} entries"
+    return values, None
+
+
 def _validate_keywords(keywords) -> str | None:
     if not isinstance(keywords, list):
         return "keywords must be a list"
@@ -120,12 +509,127 @@ def _validate_keywords(keywords) -> str | None:
     return None
 
 
-def handle_request_factory(state_path: str):
+def _if_version(data: Dict[str, Any]) -> Tuple[int | None, str | None]:
+    """Return (version, error) for the optional `if_version` argument of conditional reads."""
+    version = data.get("if_version")
+    if version is not None and (isinstance(version, bool) or not isinstance(version, int)):
+        return None, "if_version must be an integer"
+    return version, None
+
+
+def _not_modified(req, data: Dict[str, Any]):
+    return _ok(req, {**data, "not_modified": True})
+
+
+def _event(seq: int, kind: str, item_id: str, category, seller_id, **changes) -> Dict[str, Any]:
+    return {
+        "seq": seq,
+        "type": kind,
+        "item_id": item_id,
+        "category": int(category),
+        "seller_id": int(seller_id),
+        **changes,
+    }
+
+
+def _watch_args(data: Dict[str, Any]) -> Tuple[Dict[str, Any] | None, str | None]:
+    """Validate WatchItems arguments; return (args, error)."""
+    args = {}
+    for name, default, high in (
+        ("since", None, None),
+        ("limit", MAX_WATCH_EVENTS, MAX_WATCH_EVENTS),
+        ("timeout_ms", WATCH_TIMEOUT_MS, MAX_WATCH_TIMEOUT_MS),
+        ("category", None, None),
+        ("seller_id", None, None),
+    ):
+        value = data.get(name, default)
+        if value is None:
+            args[name] = -1 if name == "since" else None
+            continue
+        if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+            return None, f"{name} must be a non-negative integer"
+        if high is not None and value > high:
+            return None, f"{name} must be at most {high}"
+        args[name] = value
+    if args["limit"] == 0:
+        return None, "limit must be positive"
+    item_ids = data.get("item_ids")
+    if item_ids is not None:
+        if not isinstance(item_ids, list) or len(item_ids) > MAX_BULK_ITEMS:
+            return None, f"item_ids must be a list of at most {MAX_BULK_ITEMS} entries"
+        if not all(isinstance(item_id, str) for item_id in item_ids):
+            return None, "item_ids must be a list of strings"
+        item_ids = set(item_ids)
+    args["item_ids"] = item_ids
+    return args, None
+
+
+def _encode_cursor(key: Tuple[int, int, int]) -> str:
+    return f"{-key[0]}:{key[1]}:{key[2]}"
+
+
+def _search_page(data: Dict[str, Any]) -> Tuple[int | None, Tuple[int, int, int] | None, str | None]:
+    """Return (limit, after, error) for SearchItems paging arguments."""
+    limit = data.get("limit")
+    valid_limit = isinstance(limit, int) and not isinstance(limit, bool) and 0 < limit <= MAX_SEARCH_LIMIT
+    if limit is not None and not valid_limit:
+        return None, None, f"limit must be an integer between 1 and {MAX_SEARCH_LIMIT}"
+    cursor = data.get("cursor")
+    if cursor is None:
+        return limit, None, None
+    try:
+        score, category, seq = (int(part) for part in cursor.split(":"))
+    except (AttributeError, ValueError):
+        return None, None, "invalid cursor"
+    return limit, (-score, category, seq), None
+
+
+def handle_request_factory(
+    state_path: str,
+    group_commit_size: int = 1,
+    group_commit_wait: float = 0.0,
+    search_cache_size: int = SEARCH_CACHE_SIZE,
+    change_feed_size: int = CHANGE_FEED_SIZE,
+    max_watchers: int = MAX_WATCHERS,
+):
     conn = sqlite3.connect(state_path, check_same_thread=False)
     conn.execute("PRAGMA foreign_keys = ON")
     conn.execute("PRAGMA journal_mode = WAL")
     _init_db(conn)
     lock = threading.Lock()
+    readers = ReadConnectionPool(state_path)
+    index = _KeywordIndex()
+    index.load(conn)
+    sequences = _SequenceAllocator()
+    versions = _VersionClock(conn)
+    feed = _ChangeFeed(versions.last, change_feed_size)
+    watch_slots = threading.BoundedSemaphore(max(1, max_watchers))
+    search_cache = _SearchCache(search_cache_size)
+    writer = GroupCommitter(conn, lock, group_commit_size, group_commit_wait)
+    # With group commit, the writes of an independent batch run side by side and
+    # share one commit instead of waiting out a commit window each; without it
+    # they gain nothing from threads.
+    batch_executor = None
+    if group_commit_size > 1:
+        batch_executor = ThreadPoolExecutor(BATCH_THREADS, thread_name_prefix="batch")
+
+    def search_items(
+        keywords: List[str], category, limit, after, projection
+    ) -> Tuple[List[Dict[str, Any]], str | None]:
+        """Return one page of matches and the cursor of the next page."""
+        ranked = index.ranked(keywords, category, limit, after)
+        next_cursor = None
+        if limit is not None and len(ranked) > limit:
+            ranked = ranked[:limit]
+            next_cursor = _encode_cursor(ranked[-1][0])
+        if not ranked:
+            return [], None
+        cur = readers.get().execute(
+            projection.select + " WHERE item_id IN (SELECT value FROM json_each(?)) AND quantity > 0",
+            (json.dumps([item_id for _, item_id in ranked]),),
+        )
+        rows = {row[0]: row for row in cur.fetchall()}
+        return [projection.item(rows[item_id]) for _, item_id in ranked if item_id in rows], next_cursor
 
     def handle(req: Dict[str, Any]):
         api = req.get("api")
@@ -134,6 +638,15 @@ def handle_request_factory(state_path: str):
         if api == "Ping":
             return _ok(req, {"now": time.time()})
 
+        if api == BATCH_API:
+            return run_batch(req, handle, batch_executor)
+
+        if api == "GetStats":
+            return _ok(
+                req,
+                {"search_cache": search_cache.stats(), "group_commit": writer.stats(), "change_feed": feed.stats()},
+            )
+
         if api == "RegisterItem":
             name = data.get("name")
             category = data.get("category")
@@ -142,63 +655,253 @@ def handle_request_factory(state_path: str):
             price = data.get("price")
             quantity = data.get("quantity")
             seller_id = data.get("seller_id")
-            if None in (name, category, condition, price, quantity, seller_id):
-                return _err(req, "INVALID_ARGUMENT", "missing required item fields")
-            kw_err = _validate_keywords(keywords)
-            if kw_err:
-                return _err(req, "INVALID_ARGUMENT", kw_err)
-            with lock:
-                item_id, seq = _assign_item_id(conn, int(category))
+            item_err = _validate_item(data)
+            if item_err:
+                return _err(req, "INVALID_ARGUMENT", item_err)
+
+            def register(conn, after):
+                [(item_id, seq)] = sequences.item_ids(conn, int(category))
+                version = versions.next()
                 conn.execute(
                     """
-                    INSERT INTO items(item_id, name, category, seq, condition, price, quantity, seller_id, feedback_up, feedback_down)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, 0)
+                    INSERT INTO items(
+                        item_id, name, category, seq, condition, price, quantity, seller_id,
+                        feedback_up, feedback_down, version
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, 0, ?)
                     """,
-                    (item_id, name, int(category), seq, condition, float(price), int(quantity), int(seller_id)),
+                    (
+                        item_id,
+                        name,
+                        int(category),
+                        seq,
+                        condition,
+                        float(price),
+                        int(quantity),
+                        int(seller_id),
+                        version,
+                    ),
                 )
                 for kw in keywords:
                     conn.execute(
                         "INSERT OR IGNORE INTO item_keywords(item_id, keyword) VALUES (?, ?)",
                         (item_id, kw),
                     )
-                conn.commit()
-                return _ok(req, {"item_id": item_id})
+                after.append(lambda: index.add(item_id, int(category), keywords, int(quantity) > 0))
+                after.append(lambda: search_cache.bump([int(category)]))
+                event = _event(
+                    version, "created", item_id, category, seller_id, price=float(price), quantity=int(quantity)
+                )
+                after.append(lambda: feed.append([event]))
+                return _ok(req, {"item_id": item_id, "version": version})
+
+            return writer.run(register)
+
+        if api == "RegisterItemsBulk":
+            # All or nothing: one transaction, one commit, ids in request order.
+            items, list_err = _bulk_list(data, "items")
+            if list_err:
+                return _err(req, "INVALID_ARGUMENT", list_err)
+            seller_id = data.get("seller_id")
+            for i, item in enumerate(items):
+                if not isinstance(item, dict):
+                    return _err(req, "INVALID_ARGUMENT", f"items[{i}]: must be an object")
+                item_err = _validate_item({**item, "seller_id": seller_id})
+                if item_err:
+                    return _err(req, "INVALID_ARGUMENT", f"items[{i}]: {item_err}")
+
+            def register_bulk(conn, after):
+                by_category: Dict[int, List[int]] = {}
+                for i, item in enumerate(items):
+                    by_category.setdefault(int(item["category"]), []).append(i)
+                assigned: Dict[int, Tuple[str, int]] = {}
+                for category, positions in by_category.items():
+                    assigned.update(zip(positions, sequences.item_ids(conn, category, len(positions))))
+                ids = [assigned[i] for i in range(len(items))]
+                first_version = versions.next(len(items))
+                conn.executemany(
+                    """
+                    INSERT INTO items(
+                        item_id, name, category, seq, condition, price, quantity, seller_id,
+                        feedback_up, feedback_down, version
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, 0, ?)
+                    """,
+                    [
+                        (
+                            item_id,
+                            item["name"],
+                            int(item["category"]),
+                            seq,
+                            item["condition"],
+                            float(item["price"]),
+                            int(item["quantity"]),
+                            int(seller_id),
+                            first_version + i,
+                        )
+                        for i, ((item_id, seq), item) in enumerate(zip(ids, items))
+                    ],
+                )
+                conn.executemany(
+                    "INSERT OR IGNORE INTO item_keywords(item_id, keyword) VALUES (?, ?)",
+                    [(item_id, kw) for (item_id, _), item in zip(ids, items) for kw in item.get("keywords", [])],
+                )
+
+                def index_all():
+                    for (item_id, _), item in zip(ids, items):
+                        index.add(item_id, int(item["category"]), item.get("keywords", []), int(item["quantity"]) > 0)
+
+                after.append(index_all)
+                after.append(lambda: search_cache.bump(by_category))
+                events = [
+                    _event(
+                        first_version + i,
+                        "created",
+                        item_id,
+                        item["category"],
+                        seller_id,
+                        price=float(item["price"]),
+                        quantity=int(item["quantity"]),
+                    )
+                    for i, ((item_id, _), item) in enumerate(zip(ids, items))
+                ]
+                after.append(lambda: feed.append(events))
+                return _ok(req, {"item_ids": [item_id for item_id, _ in ids]})
+
+            return writer.run(register_bulk)
 
         if api == "ChangeItemPrice":
             item_id = data.get("item_id")
             price = data.get("price")
-            with lock:
+
+            def change_price(conn, after):
                 row, err = _get_item_row(conn, item_id, req)
                 if err:
                     return err
-                conn.execute("UPDATE items SET price = ? WHERE item_id = ?", (float(price), item_id))
-                conn.commit()
-                return _ok(req, {"item_id": item_id, "price": float(price)})
+                version = versions.next()
+                conn.execute(
+                    "UPDATE items SET price = ?, version = ? WHERE item_id = ?", (float(price), version, item_id)
+                )
+                after.append(lambda: search_cache.bump([int(row[2])]))
+                event = _event(version, "price", item_id, row[2], row[7], price=float(price))
+                after.append(lambda: feed.append([event]))
+                return _ok(req, {"item_id": item_id, "price": float(price), "version": version})
+
+            return writer.run(change_price)
 
         if api == "UpdateUnitsForSale":
             item_id = data.get("item_id")
             quantity_delta = data.get("quantity_delta")
             if item_id is None or quantity_delta is None:
                 return _err(req, "INVALID_ARGUMENT", "item_id and quantity_delta required")
-            with lock:
+
+            def update_units(conn, after):
                 row, err = _get_item_row(conn, item_id, req)
                 if err:
                     return err
                 new_qty = int(row[6]) + int(quantity_delta)
                 if new_qty < 0:
                     return _err(req, "INVALID_ARGUMENT", "quantity cannot be negative")
-                conn.execute("UPDATE items SET quantity = ? WHERE item_id = ?", (new_qty, item_id))
-                conn.commit()
-                return _ok(req, {"item_id": item_id, "quantity": new_qty})
+                version = versions.next()
+                conn.execute(
+                    "UPDATE items SET quantity = ?, version = ? WHERE item_id = ?", (new_qty, version, item_id)
+                )
+                after.append(lambda: index.set_in_stock(item_id, new_qty > 0))
+                after.append(lambda: search_cache.bump([int(row[2])]))
+                event = _event(version, "quantity", item_id, row[2], row[7], quantity=new_qty)
+                after.append(lambda: feed.append([event]))
+                return _ok(req, {"item_id": item_id, "quantity": new_qty, "version": version})
+
+            return writer.run(update_units)
+
+        if api in ("ChangeItemPrices", "UpdateUnitsBulk"):
+            # All or nothing: every item must exist, and one commit covers the lot.
+            updates, list_err = _bulk_list(data, "updates")
+            if list_err:
+                return _err(req, "INVALID_ARGUMENT", list_err)
+            field, column = ("price", "price") if api == "ChangeItemPrices" else ("quantity_delta", "quantity")
+            for i, update in enumerate(updates):
+                if not isinstance(update, dict) or update.get("item_id") is None or update.get(field) is None:
+                    return _err(req, "INVALID_ARGUMENT", f"updates[{i}]: item_id and {field} required")
+
+            def update_bulk(conn, after):
+                item_ids = list(dict.fromkeys(update["item_id"] for update in updates))
+                cur = conn.execute(
+                    """
+                    SELECT item_id, quantity, category, seller_id FROM items
+                    WHERE item_id IN (SELECT value FROM json_each(?))
+                    """,
+                    (json.dumps(item_ids),),
+                )
+                rows = cur.fetchall()
+                values = {item_id: int(quantity) for item_id, quantity, _, _ in rows}
+                missing = [item_id for item_id in item_ids if item_id not in values]
+                if missing:
+                    return _err(req, "NOT_FOUND", f"items not found: {', '.join(map(str, missing))}")
+                for update in updates:
+                    if column == "price":
+                        values[update["item_id"]] = float(update["price"])
+                    else:
+                        values[update["item_id"]] += int(update["quantity_delta"])
+                if column == "quantity":
+                    negative = [item_id for item_id in item_ids if values[item_id] < 0]
+                    if negative:
+                        return _err(req, "INVALID_ARGUMENT", f"quantity cannot be negative: {', '.join(negative)}")
+                first_version = versions.next(len(item_ids))
+                new_versions = {item_id: first_version + i for i, item_id in enumerate(item_ids)}
+                conn.executemany(
+                    f"UPDATE items SET {column} = ?, version = ? WHERE item_id = ?",
+                    [(values[item_id], new_versions[item_id], item_id) for item_id in item_ids],
+                )
+                if column == "quantity":
+
+                    def reindex():
+                        for item_id in item_ids:
+                            index.set_in_stock(item_id, values[item_id] > 0)
+
+                    after.append(reindex)
+                after.append(lambda: search_cache.bump(int(category) for _, _, category, _ in rows))
+                owners = {item_id: (category, seller_id) for item_id, _, category, seller_id in rows}
+                events = [
+                    _event(new_versions[item_id], column, item_id, *owners[item_id], **{column: values[item_id]})
+                    for item_id in item_ids
+                ]
+                after.append(lambda: feed.append(events))
+                return _ok(
+                    req,
+                    {
+                        "items": [
+                            {"item_id": item_id, column: values[item_id], "version": new_versions[item_id]}
+                            for item_id in item_ids
+                        ]
+                    },
+                )
+
+            return writer.run(update_bulk)
+
+        if api in ("DisplayItemsForSale", "SearchItems", "GetItem", "GetItems"):
+            projection, fields_err = _item_projection(data)
+            if fields_err:
+                return _err(req, "INVALID_ARGUMENT", fields_err)
+
+        if api in ("DisplayItemsForSale", "GetItem"):
+            if_version, version_err = _if_version(data)
+            if version_err:
+                return _err(req, "INVALID_ARGUMENT", version_err)
 
         if api == "DisplayItemsForSale":
             seller_id = int(data.get("seller_id"))
-            with lock:
-                cur = conn.execute("SELECT * FROM items WHERE seller_id = ?", (seller_id,))
-                items = []
-                for row in cur.fetchall():
-                    items.append(_row_to_item(row, _item_keywords(conn, row[0])))
-                return _ok(req, {"items": items})
+            reader = readers.get()
+            # Read the listing version before the items: a write landing in
+            # between then shows up as a newer listing on the next poll rather
+            # than being hidden behind an up-to-date version.
+            cur = reader.execute("SELECT COALESCE(MAX(version), 0) FROM items WHERE seller_id = ?", (seller_id,))
+            listing_version = int(cur.fetchone()[0])
+            if if_version == listing_version:
+                return _not_modified(req, {"version": listing_version})
+            cur = reader.execute(projection.select + " WHERE seller_id = ?", (seller_id,))
+            items = [projection.item(row) for row in cur.fetchall()]
+            return _ok(req, {"items": items, "version": listing_version})
 
         if api == "SearchItems":
             category = data.get("category")
@@ -208,59 +911,108 @@ def handle_request_factory(state_path: str):
             kw_err = _validate_keywords(keywords)
             if kw_err:
                 return _err(req, "INVALID_ARGUMENT", kw_err)
-            with lock:
-                if category is None:
-                    cur = conn.execute("SELECT * FROM items WHERE quantity > 0")
-                else:
-                    cur = conn.execute(
-                        "SELECT * FROM items WHERE quantity > 0 AND category = ?",
-                        (int(category),),
-                    )
-                matches = []
-                for row in cur.fetchall():
-                    kws = _item_keywords(conn, row[0])
-                    score = _keyword_score(kws, keywords)
-                    if score == 0:
-                        continue
-                    matches.append((score, _row_to_item(row, kws)))
-                matches.sort(key=lambda t: t[0], reverse=True)
-                return _ok(req, {"items": [m[1] for m in matches]})
+            limit, after, page_err = _search_page(data)
+            if page_err:
+                return _err(req, "INVALID_ARGUMENT", page_err)
+            if category is not None:
+                category = int(category)
+            key = (category, tuple(sorted(k.lower() for k in keywords)), limit, after, projection)
+            page = search_cache.get(key)
+            if page is None:
+                version = search_cache.version(category)
+                page = search_items(keywords, category, limit, after, projection)
+                search_cache.put(key, version, page)
+            items, next_cursor = page
+            return _ok(req, {"items": items, "next_cursor": next_cursor})
 
         if api == "GetItem":
             item_id = data.get("item_id")
-            with lock:
-                row, err = _get_item_row(conn, item_id, req)
-                if err:
-                    return err
-                return _ok(req, {"item": _row_to_item(row, _item_keywords(conn, item_id))})
+            reader = readers.get()
+            if if_version is not None:
+                current = reader.execute("SELECT version FROM items WHERE item_id = ?", (item_id,)).fetchone()
+                if current and int(current[0]) == if_version:
+                    return _not_modified(req, {"item_id": item_id, "version": if_version})
+            row = reader.execute(projection.select + " WHERE item_id = ?", (item_id,)).fetchone()
+            if not row:
+                return _err(req, "NOT_FOUND", "item not found")
+            return _ok(req, {"item": projection.item(row)})
+
+        if api == "GetItems":
+            item_ids, list_err = _bulk_list(data, "item_ids")
+            if list_err:
+                return _err(req, "INVALID_ARGUMENT", list_err)
+            cur = readers.get().execute(
+                projection.select + " WHERE item_id IN (SELECT value FROM json_each(?))",
+                (json.dumps(item_ids),),
+            )
+            found = {row[0]: projection.item(row) for row in cur.fetchall()}
+            return _ok(
+                req,
+                {
+                    "items": [found[item_id] for item_id in item_ids if item_id in found],
+                    "missing": [item_id for item_id in item_ids if item_id not in found],
+                },
+            )
 
         if api == "ProvideFeedback":
             item_id = data.get("item_id")
             vote = data.get("vote")  # "up" or "down"
             if vote not in ("up", "down"):
                 return _err(req, "INVALID_ARGUMENT", "vote must be up or down")
-            with lock:
+
+            def provide_feedback(conn, after):
                 row, err = _get_item_row(conn, item_id, req)
                 if err:
                     return err
+                version = versions.next()
+                column = "feedback_up" if vote == "up" else "feedback_down"
+                conn.execute(
+                    f"UPDATE items SET {column} = {column} + 1, version = ? WHERE item_id = ?", (version, item_id)
+                )
                 if vote == "up":
-                    conn.execute("UPDATE items SET feedback_up = feedback_up + 1 WHERE item_id = ?", (item_id,))
                     feedback = {"up": int(row[8]) + 1, "down": int(row[9])}
                 else:
-                    conn.execute("UPDATE items SET feedback_down = feedback_down + 1 WHERE item_id = ?", (item_id,))
                     feedback = {"up": int(row[8]), "down": int(row[9]) + 1}
-                conn.commit()
-                return _ok(req, {"item_id": item_id, "feedback": feedback})
+                after.append(lambda: search_cache.bump([int(row[2])]))
+                event = _event(version, "feedback", item_id, row[2], row[7], feedback=feedback)
+                after.append(lambda: feed.append([event]))
+                return _ok(req, {"item_id": item_id, "feedback": feedback, "version": version})
+
+            return writer.run(provide_feedback)
+
+        if api == "WatchItems":
+            args, watch_err = _watch_args(data)
+            if watch_err:
+                return _err(req, "INVALID_ARGUMENT", watch_err)
+            category, seller_id, watched = args["category"], args["seller_id"], args["item_ids"]
+
+            def match(event):
+                return (
+                    (category is None or event["category"] == category)
+                    and (seller_id is None or event["seller_id"] == seller_id)
+                    and (watched is None or event["item_id"] in watched)
+                )
+
+            timeout = args["timeout_ms"] / 1000.0
+            if timeout > 0 and not watch_slots.acquire(blocking=False):
+                return _err(req, "OVERLOADED", f"at most {max_watchers} WatchItems may wait at once")
+            try:
+                events, last_seq = feed.watch(args["since"], match, args["limit"], timeout)
+            finally:
+                if timeout > 0:
+                    watch_slots.release()
+            if events is None:
+                return _ok(req, {"resync": True, "events": [], "last_seq": last_seq})
+            return _ok(req, {"resync": False, "events": events, "last_seq": last_seq})
 
         if api == "CheckAvailability":
             item_id = data.get("item_id")
             qty = int(data.get("quantity", 0))
-            with lock:
-                row, err = _get_item_row(conn, item_id, req)
-                if err:
-                    return err
-                available = int(row[6])
-                return _ok(req, {"available": available, "ok": available >= qty})
+            row, err = _get_item_row(readers.get(), item_id, req)
+            if err:
+                return err
+            available = int(row[6])
+            return _ok(req, {"available": available, "ok": available >= qty})
 
         return _err(req, "UNIMPLEMENTED", f"unknown api {api}")
 
@@ -274,10 +1026,48 @@ def main():
     parser.add_argument("--host", default="127.0.0.1")
     parser.add_argument("--port", type=int, default=6002)
     parser.add_argument("--state", default="db_product/state.db")
+    parser.add_argument(
+        "--group-commit-size",
+        type=int,
+        default=1,
+        help="Max write requests committed together in one transaction (1 disables group commit).",
+    )
+    parser.add_argument(
+        "--group-commit-wait-ms",
+        type=float,
+        default=1.0,
+        help="Max time a group waits for more writes after its first one.",
+    )
+    parser.add_argument(
+        "--search-cache-size",
+        type=int,
+        default=SEARCH_CACHE_SIZE,
+        help="SearchItems results kept in memory, invalidated by writes (0 disables).",
+    )
+    parser.add_argument(
+        "--change-feed-size",
+        type=int,
+        default=CHANGE_FEED_SIZE,
+        help="Item change events kept in memory for WatchItems.",
+    )
+    parser.add_argument(
+        "--max-watchers",
+        type=int,
+        default=None,
+        help="WatchItems that may wait at once; more are rejected as OVERLOADED (default: handler threads / 4).",
+    )
+    add_engine_args(parser)
     args = parser.parse_args()
 
-    handler = handle_request_factory(args.state)
-    run_server(args.host, args.port, handler)
+    handler = handle_request_factory(
+        args.state,
+        args.group_commit_size,
+        args.group_commit_wait_ms / 1000.0,
+        args.search_cache_size,
+        args.change_feed_size,
+        args.max_watchers or max(1, (args.handler_threads or DEFAULT_HANDLER_THREADS) // 4),
+    )
+    run_server(args.host, args.port, handler, **engine_options(args))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,119 @@
+import argparse
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from common.protocol import CODECS
+from common.tcp_client import tcp_request
+from common.tcp_server import JsonRequestHandler, JsonTCPServer
+
+
+def _item(i: int):
+    return {
+        "item_id": f"1:{i + 1}",
+        "name": f"Book {i}",
+        "category": 1,
+        "keywords": ["book", f"k{i % 50}"],
+        "condition": "new",
+        "price": 10.0 + i % 7,
+        "quantity": 100,
+        "seller_id": 1,
+        "feedback": {"up": i % 5, "down": i % 3},
+    }
+
+
+def _messages(items: int):
+    return {
+        "ChangeItemPrice request": {
+            "type": "Request",
+            "request_id": "7f3c2a",
+            "api": "ChangeItemPrice",
+            "data": {"session_id": "0f8e4b1c9d2a7e6f5a4b3c2d1e0f9a8b", "item_id": "1:42", "price": 11.0},
+        },
+        "ChangeItemPrice response": {
+            "type": "Response",
+            "request_id": "7f3c2a",
+            "ok": True,
+            "error": None,
+            "data": {"item_id": "1:42", "price": 11.0},
+        },
+        f"SearchItems response ({items} items)": {
+            "type": "Response",
+            "request_id": "7f3c2b",
+            "ok": True,
+            "error": None,
+            "data": {"items": [_item(i) for i in range(items)]},
+        },
+    }
+
+
+def _best(fn, arg, iterations: int, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / iterations
+
+
+def bench_codecs(items: int, iterations: int, repeat: int):
+    for label, msg in _messages(items).items():
+        for codec in CODECS.values():
+            payload = codec.encode(msg)
+            assert codec.decode(payload) == msg
+            encode = _best(codec.encode, msg, iterations, repeat)
+            decode = _best(codec.decode, payload, iterations, repeat)
+            print(
+                f"{label} [{codec.name}]: bytes={len(payload)} "
+                f"encode={encode * 1e6:.1f}us decode={decode * 1e6:.1f}us"
+            )
+
+
+def bench_roundtrip(items: int, iterations: int, repeat: int):
+    """Time request/response over loopback TCP, where both ends pay for the codec."""
+    messages = list(_messages(items).values())
+    request, search = messages[0], messages[2]
+
+    class _Server(JsonTCPServer):
+        def handle_request_msg(self, req, _addr):
+            return {**search, "request_id": req["request_id"]}
+
+    server = _Server(("127.0.0.1", 0), JsonRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    try:
+        for name in CODECS:
+            per_call = _best(
+                lambda req: tcp_request(host, port, req, reuse_socket=True, codec_name=name),
+                request,
+                iterations,
+                repeat,
+            )
+            print(f"SearchItems round trip ({items} items) [{name}]: per_call={per_call * 1e3:.3f}ms")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the wire codecs in common/protocol.py.")
+    parser.add_argument("--mode", choices=["codec", "roundtrip"], default="codec")
+    parser.add_argument("--items", type=int, default=100, help="Items in the SearchItems response.")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5, help="Report the best of this many timing rounds.")
+    args = parser.parse_args()
+    if args.mode == "codec":
+        bench_codecs(args.items, args.iterations, args.repeat)
+    else:
+        bench_roundtrip(args.items, args.iterations, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
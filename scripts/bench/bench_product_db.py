@@ -0,0 +1,186 @@
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from common.protocol import encode_msg
+from db_product.product_server import SEARCH_CACHE_SIZE, handle_request_factory
+
+
+def _call(handler, api, data):
+    resp = handler({"type": "Request", "request_id": "1", "api": api, "data": data})
+    if not resp.get("ok"):
+        raise RuntimeError(f"{api} failed: {resp}")
+    return resp
+
+
+def _item(i: int, seller_id: int = 1):
+    return {
+        "name": f"Book {i}",
+        "category": 1,
+        "keywords": ["book", f"k{i % 50}"],
+        "condition": "new",
+        "price": 10.0,
+        "quantity": 100,
+        "seller_id": seller_id,
+    }
+
+
+def _seed(handler, items: int, seller_id: int = 1):
+    for i in range(items):
+        _call(handler, "RegisterItem", _item(i, seller_id))
+
+
+def _per_item_cost(handler, api, data, iterations: int, repeat: int):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            resp = _call(handler, api, data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    returned = len(resp["data"]["items"])
+    return best / iterations, returned
+
+
+def bench_reads(items: int, iterations: int, repeat: int, search_cache_size: int, search_limit=None, fields=None):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        handler = handle_request_factory(os.path.join(tmpdir, "product_state.db"), search_cache_size=search_cache_size)
+        _seed(handler, items)
+        for api, data in (
+            ("DisplayItemsForSale", {"seller_id": 1, "fields": fields}),
+            ("SearchItems", {"keywords": ["book"], "category": 1, "limit": search_limit, "fields": fields}),
+        ):
+            per_call, returned = _per_item_cost(handler, api, data, iterations, repeat)
+            size = len(encode_msg(_call(handler, api, data)))
+            print(
+                f"{api}: items={returned} per_call={per_call * 1e3:.3f}ms "
+                f"per_item={per_call / max(returned, 1) * 1e6:.2f}us bytes={size}"
+            )
+
+
+def _toggle_prices(handler, item_id, ops, barrier):
+    price = 10.0
+    barrier.wait()
+    for _ in range(ops):
+        price = 11.0 if price == 10.0 else 10.0
+        _call(handler, "ChangeItemPrice", {"item_id": item_id, "price": price})
+
+
+def _write_throughput(state_dir, writers: int, ops: int, batch_size: int, max_wait: float) -> float:
+    with tempfile.TemporaryDirectory(dir=state_dir) as tmpdir:
+        handler = handle_request_factory(os.path.join(tmpdir, "product_state.db"), batch_size, max_wait)
+        _seed(handler, writers)
+        barrier = threading.Barrier(writers + 1)
+        threads = [
+            threading.Thread(target=_toggle_prices, args=(handler, f"1:{i + 1}", ops, barrier), daemon=True)
+            for i in range(writers)
+        ]
+        for t in threads:
+            t.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for t in threads:
+            t.join()
+        return writers * ops / (time.perf_counter() - start)
+
+
+def bench_writes(state_dir, writers: int, ops: int, batch_size: int, max_wait: float):
+    """Price-toggle workload of scenario 3 run straight against the handler."""
+    baseline = _write_throughput(state_dir, writers, ops, 1, 0.0)
+    grouped = _write_throughput(state_dir, writers, ops, batch_size, max_wait)
+    print(f"ChangeItemPrice writers={writers} ops_per_writer={ops}")
+    print(f"  per-request commit: {baseline:.2f} ops/s")
+    print(f"  group commit (size={batch_size} wait={max_wait * 1e3:.1f}ms): {grouped:.2f} ops/s ({grouped / baseline:.2f}x)")
+
+
+def _timed_on_fresh_db(state_dir, seed_items: int, fn) -> float:
+    with tempfile.TemporaryDirectory(dir=state_dir) as tmpdir:
+        handler = handle_request_factory(os.path.join(tmpdir, "product_state.db"))
+        if seed_items:
+            _call(handler, "RegisterItemsBulk", {"seller_id": 1, "items": [_item(i) for i in range(seed_items)]})
+        start = time.perf_counter()
+        fn(handler)
+        return time.perf_counter() - start
+
+
+def bench_bulk(state_dir, items: int):
+    """Single-item calls against their bulk counterparts, each timed on a fresh database."""
+    ids = [f"1:{i + 1}" for i in range(items)]
+    cases = (
+        (
+            "RegisterItem / RegisterItemsBulk",
+            0,
+            lambda h: [_call(h, "RegisterItem", _item(i)) for i in range(items)],
+            lambda h: _call(h, "RegisterItemsBulk", {"seller_id": 1, "items": [_item(i) for i in range(items)]}),
+        ),
+        (
+            "GetItem / GetItems",
+            items,
+            lambda h: [_call(h, "GetItem", {"item_id": item_id}) for item_id in ids],
+            lambda h: _call(h, "GetItems", {"item_ids": ids}),
+        ),
+        (
+            "ChangeItemPrice / ChangeItemPrices",
+            items,
+            lambda h: [_call(h, "ChangeItemPrice", {"item_id": item_id, "price": 12.0}) for item_id in ids],
+            lambda h: _call(h, "ChangeItemPrices", {"updates": [{"item_id": i, "price": 12.0} for i in ids]}),
+        ),
+    )
+    for label, seed_items, single, bulk in cases:
+        one = _timed_on_fresh_db(state_dir, seed_items, single)
+        many = _timed_on_fresh_db(state_dir, seed_items, bulk)
+        print(f"{label} x{items}: single={one * 1e3:.1f}ms bulk={many * 1e3:.1f}ms ({one / many:.1f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process micro-benchmarks for db_product handlers.")
+    parser.add_argument("--mode", choices=["reads", "writes", "bulk"], default="reads")
+    parser.add_argument("--items", type=int, default=500)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5, help="Report the best of this many timing rounds.")
+    parser.add_argument(
+        "--search-cache-size",
+        type=int,
+        default=SEARCH_CACHE_SIZE,
+        help="SearchItems cache entries for --mode reads (0 measures uncached searches).",
+    )
+    parser.add_argument("--search-limit", type=int, default=None, help="SearchItems page size for --mode reads.")
+    parser.add_argument(
+        "--fields",
+        type=lambda value: value.split(","),
+        default=None,
+        help="Comma-separated item fields to return in --mode reads (default: all).",
+    )
+    parser.add_argument("--writers", type=int, default=100)
+    parser.add_argument("--ops-per-writer", type=int, default=100)
+    parser.add_argument("--group-commit-size", type=int, default=64)
+    parser.add_argument("--group-commit-wait-ms", type=float, default=1.0)
+    parser.add_argument(
+        "--state-dir",
+        default=None,
+        help="Directory for the temporary database; put it on the disk you want to measure fsync cost on.",
+    )
+    args = parser.parse_args()
+    if args.mode == "reads":
+        bench_reads(args.items, args.iterations, args.repeat, args.search_cache_size, args.search_limit, args.fields)
+    elif args.mode == "bulk":
+        bench_bulk(args.state_dir, args.items)
+    else:
+        bench_writes(
+            args.state_dir,
+            args.writers,
+            args.ops_per_writer,
+            args.group_commit_size,
+            args.group_commit_wait_ms / 1000.0,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -61,11 +61,33 @@ def _send_with_retries(host, port, sock, api, data):
     raise last_exc
 
 
+def _send_ops(host, port, sock, api, datas):
+    """Send one call per entry of `datas`, as a single independent Batch when there are several."""
+    if len(datas) == 1:
+        resp, sock = _send_with_retries(host, port, sock, api, datas[0])
+        return [resp], sock
+    subs = [{"type": "Request", "request_id": str(i), "api": api, "data": data} for i, data in enumerate(datas)]
+    resp, sock = _send_with_retries(host, port, sock, "Batch", {"requests": subs, "independent": True})
+    if not resp.get("ok"):
+        return [resp] * len(datas), sock
+    return resp["data"]["responses"], sock
+
+
 def _assert_ok(resp, ctx):
     if not resp.get("ok"):
         raise RuntimeError(f"{ctx} failed: {resp}")
 
 
+def _record(resp, ctx, elapsed, timings, shed):
+    # Requests the server sheds with OVERLOADED are counted apart from served ones.
+    error = resp.get("error") or {}
+    if not resp.get("ok") and error.get("code") == "OVERLOADED":
+        shed.append(elapsed)
+        return
+    _assert_ok(resp, ctx)
+    timings.append(elapsed)
+
+
 def _create_seller(seller_host, seller_port, idx: int):
     name = f"seller{idx}"
     resp = _request(seller_host, seller_port, "CreateAccount", {"name": name, "password": "pass"})
@@ -158,84 +180,76 @@ def _setup_buyers(buyer_host, buyer_port, count: int):
     return sessions
 
 
-def _buyer_worker(host, port, ops, barrier, timings, category):
+def _buyer_worker(host, port, ops, barrier, timings, shed, category, batch=1, search_limit=None):
     barrier.wait()
     sock = socket.create_connection((host, port), timeout=CONNECT_TIMEOUT)
     try:
-        for _ in range(ops):
+        for done in range(0, ops, batch):
+            datas = [{"keywords": ["book"], "category": category, "limit": search_limit}] * min(batch, ops - done)
             start = time.perf_counter()
             try:
-                resp, sock = _send_with_retries(
-                    host,
-                    port,
-                    sock,
-                    "SearchItemsForSale",
-                    {"keywords": ["book"], "category": category},
-                )
+                resps, sock = _send_ops(host, port, sock, "SearchItemsForSale", datas)
             except (ConnectionError, OSError):
-                resp, sock = _send_with_retries(
-                    host,
-                    port,
-                    sock,
-                    "SearchItemsForSale",
-                    {"keywords": ["book"], "category": category},
-                )
+                resps, sock = _send_ops(host, port, sock, "SearchItemsForSale", datas)
             end = time.perf_counter()
-            _assert_ok(resp, "SearchItemsForSale")
-            timings.append(end - start)
+            for resp in resps:
+                _record(resp, "SearchItemsForSale", end - start, timings, shed)
     finally:
         sock.close()
 
 
-def _seller_worker(host, port, session_id, item_id, ops, barrier, timings):
+def _seller_worker(host, port, session_id, item_id, ops, barrier, timings, shed, batch=1):
     price = 10.0
     barrier.wait()
     sock = socket.create_connection((host, port), timeout=CONNECT_TIMEOUT)
     try:
-        for _ in range(ops):
-            price = 11.0 if price == 10.0 else 10.0
+        for done in range(0, ops, batch):
+            datas = []
+            for _ in range(min(batch, ops - done)):
+                price = 11.0 if price == 10.0 else 10.0
+                datas.append({"session_id": session_id, "item_id": item_id, "price": price})
             start = time.perf_counter()
             try:
-                resp, sock = _send_with_retries(
-                    host,
-                    port,
-                    sock,
-                    "ChangeItemPrice",
-                    {"session_id": session_id, "item_id": item_id, "price": price},
-                )
+                resps, sock = _send_ops(host, port, sock, "ChangeItemPrice", datas)
             except (ConnectionError, OSError):
-                resp, sock = _send_with_retries(
-                    host,
-                    port,
-                    sock,
-                    "ChangeItemPrice",
-                    {"session_id": session_id, "item_id": item_id, "price": price},
-                )
+                resps, sock = _send_ops(host, port, sock, "ChangeItemPrice", datas)
             end = time.perf_counter()
-            _assert_ok(resp, "ChangeItemPrice")
-            timings.append(end - start)
+            for resp in resps:
+                _record(resp, "ChangeItemPrice", end - start, timings, shed)
     finally:
         sock.close()
 
 
-def _run_once(buyer_host, buyer_port, seller_host, seller_port, seller_sessions, buyers, ops_per_client, category):
+def _run_once(
+    buyer_host,
+    buyer_port,
+    seller_host,
+    seller_port,
+    seller_sessions,
+    buyers,
+    ops_per_client,
+    category,
+    batch=1,
+    search_limit=None,
+):
 
     total_clients = buyers + len(seller_sessions)
     barrier = threading.Barrier(total_clients)
     timings: List[float] = []
+    shed: List[float] = []
 
     threads = []
     for i in range(buyers):
         t = threading.Thread(
             target=_buyer_worker,
-            args=(buyer_host, buyer_port, ops_per_client, barrier, timings, category),
+            args=(buyer_host, buyer_port, ops_per_client, barrier, timings, shed, category, batch, search_limit),
             daemon=True,
         )
         threads.append(t)
     for i, (session_id, item_id) in enumerate(seller_sessions):
         t = threading.Thread(
             target=_seller_worker,
-            args=(seller_host, seller_port, session_id, item_id, ops_per_client, barrier, timings),
+            args=(seller_host, seller_port, session_id, item_id, ops_per_client, barrier, timings, shed, batch),
             daemon=True,
         )
         threads.append(t)
@@ -247,10 +261,10 @@ def _run_once(buyer_host, buyer_port, seller_host, seller_port, seller_sessions,
         t.join()
     end = time.perf_counter()
 
-    total_ops = ops_per_client * total_clients
+    served_ops = len(timings)
     avg_resp = statistics.mean(timings) if timings else 0.0
-    throughput = total_ops / (end - start) if end > start else 0.0
-    return avg_resp, throughput
+    throughput = served_ops / (end - start) if end > start else 0.0
+    return avg_resp, throughput, len(shed)
 
 
 def _run_scenario(
@@ -264,13 +278,16 @@ def _run_scenario(
     runs,
     ops_per_client,
     category,
+    batch=1,
+    search_limit=None,
 ):
     # Create sellers once per scenario to avoid exhausting local ports during setup.
     seller_sessions = _setup_sellers(seller_host, seller_port, sellers)
     avg_resps = []
     throughputs = []
+    shed_total = 0
     for _ in range(runs):
-        avg_resp, throughput = _run_once(
+        avg_resp, throughput, shed = _run_once(
             buyer_host,
             buyer_port,
             seller_host,
@@ -279,9 +296,12 @@ def _run_scenario(
             buyers,
             ops_per_client,
             category,
+            batch,
+            search_limit,
         )
         avg_resps.append(avg_resp)
         throughputs.append(throughput)
+        shed_total += shed
     return {
         "name": name,
         "avg_response_time": statistics.mean(avg_resps),
@@ -289,6 +309,7 @@ def _run_scenario(
         "runs": runs,
         "clients": buyers + sellers,
         "ops_per_client": ops_per_client,
+        "shed": shed_total,
     }
 
 
@@ -308,6 +329,18 @@ def main():
         choices=[1, 2, 3],
         help="Run specific scenario(s). Repeatable. Default: all scenarios.",
     )
+    parser.add_argument(
+        "--batch",
+        type=int,
+        default=1,
+        help="Send each client's calls in independent Batch requests of this many (1 sends them one by one).",
+    )
+    parser.add_argument(
+        "--search-limit",
+        type=int,
+        default=None,
+        help="Page size for buyers' SearchItemsForSale (default: every match).",
+    )
     args = parser.parse_args()
 
     scenarios = [
@@ -332,11 +365,14 @@ def main():
             args.runs,
             args.ops_per_client,
             args.category,
+            args.batch,
+            args.search_limit,
         )
         print(
             f"{result['name']}: avg_response_time={result['avg_response_time']:.6f}s "
             f"avg_throughput={result['avg_throughput']:.2f} ops/s "
-            f"(clients={result['clients']} runs={result['runs']} ops_per_client={result['ops_per_client']})"
+            f"(clients={result['clients']} runs={result['runs']} ops_per_client={result['ops_per_client']} "
+            f"shed={result['shed']})"
         )
 
 
@@ -6,8 +6,10 @@ _ROOT = os.path.dirname(os.path.dirname(__file__))
 if _ROOT not in sys.path:
     sys.path.append(_ROOT)
 
-from common.tcp_client import tcp_request
-from common.tcp_server import run_server
+from common.fanout import FanOut
+from common.frontend import FrontendContext, add_frontend_args, frontend_options
+from common.protocol import BATCH_API
+from common.tcp_server import add_engine_args, engine_options, run_workers
 
 
 def _ok(req, data=None):
@@ -30,40 +32,13 @@ def _err(req, code, message):
     }
 
 
-def handle_request_factory(customer_host, customer_port, product_host, product_port):
-    def db_call(host, port, api, data, request_id):
-        return tcp_request(
-            host,
-            port,
-            {
-                "type": "Request",
-                "request_id": request_id,
-                "api": api,
-                "data": data,
-            },
-            reuse_socket=True,
-        )
-
-    def validate_session(session_id, request_id):
-        resp = db_call(
-            customer_host,
-            customer_port,
-            "ValidateSession",
-            {"session_id": session_id},
-            request_id,
-        )
-        return resp
-
-    def require_session(data, request_id):
-        session_id = data.get("session_id")
-        if not session_id:
-            return None, _err({"request_id": request_id}, "NOT_LOGGED_IN", "session_id required")
-        sess = validate_session(session_id, request_id)
-        if not sess.get("ok"):
-            return None, sess
-        return sess["data"], None
-
-    def handle(req: Dict[str, Any]):
+def handle_request_factory(customer_host, customer_port, product_host, product_port, **options):
+    frontend = FrontendContext(customer_host, customer_port, product_host, product_port, **options)
+    db_call = frontend.db_call
+    require_session = frontend.require_session
+    fan_out = FanOut(frontend.asynchronous)
+
+    async def handle(req: Dict[str, Any], call=db_call):
         api = req.get("api")
         data = req.get("data") or {}
         request_id = req.get("request_id")
@@ -71,22 +46,29 @@ def handle_request_factory(customer_host, customer_port, product_host, product_p
         if api == "Ping":
             return _ok(req, {"ok": True})
 
+        if api == "GetStats":
+            return _ok(req, frontend.stats())
+
+        if api == BATCH_API:
+            return await frontend.batch_forwarder.run(req, handle)
+
         if api == "CreateAccount":
-            return db_call(customer_host, customer_port, "CreateBuyer", data, request_id)
+            return await call(customer_host, customer_port, "CreateBuyer", data, request_id)
 
         if api == "Login":
             payload = {"role": "buyer", **data}
-            return db_call(customer_host, customer_port, "Login", payload, request_id)
+            return await call(customer_host, customer_port, "Login", payload, request_id)
 
         if api == "Logout":
-            return db_call(customer_host, customer_port, "Logout", {"session_id": data.get("session_id")}, request_id)
+            return await frontend.logout(data, request_id, call)
 
-        if api in ("SearchItemsForSale", "GetItem"):
+        if api in ("SearchItemsForSale", "GetItem", "GetItems"):
             mapped = {
                 "SearchItemsForSale": "SearchItems",
                 "GetItem": "GetItem",
+                "GetItems": "GetItems",
             }[api]
-            return db_call(product_host, product_port, mapped, data, request_id)
+            return await call(product_host, product_port, mapped, data, request_id)
 
         if api in (
             "AddItemToCart",
@@ -98,22 +80,51 @@ def handle_request_factory(customer_host, customer_port, product_host, product_p
             "GetSellerRating",
             "GetBuyerPurchases",
         ):
-            sess_data, err = require_session(data, request_id)
-            if err:
-                return err
+            item_id = data.get("item_id")
+            qty = int(data.get("quantity", 0)) if api in ("AddItemToCart", "RemoveItemFromCart") else 0
+
+            # Reads that don't depend on who the buyer is go out alongside the
+            # session lookup, so the request waits for the slower call, not both.
+            # Inside a batch the forwarder already overlaps calls.
+            side_call = None
+            if api == "AddItemToCart" and item_id and qty > 0:
+                side_call = lambda: call(
+                    product_host, product_port, "CheckAvailability", {"item_id": item_id, "quantity": qty}, request_id
+                )
+            elif api == "GetSellerRating":
+                side_call = lambda: call(customer_host, customer_port, "GetSellerRating", data, request_id)
+
+            side_result = None
+            if side_call is not None and call is db_call and frontend.session_needs_lookup(data):
+                sess, side_result = await fan_out(
+                    lambda: frontend.validate_session(data["session_id"], request_id), side_call
+                )
+                if sess is None:
+                    # The side call failed first. Its error must not reach a caller
+                    # who is not logged in, so finish checking the session.
+                    sess = await frontend.validate_session(data["session_id"], request_id)
+                if not sess.get("ok"):
+                    return sess
+                sess_data = sess["data"]
+            else:
+                sess_data, err = await require_session(data, request_id)
+                if err:
+                    return err
             buyer_id = sess_data["user_id"]
 
             if api == "AddItemToCart":
-                item_id = data.get("item_id")
-                qty = int(data.get("quantity", 0))
                 if not item_id or qty <= 0:
                     return _err(req, "INVALID_ARGUMENT", "item_id and positive quantity required")
-                avail = db_call(product_host, product_port, "CheckAvailability", {"item_id": item_id, "quantity": qty}, request_id)
+                avail = side_result
+                if avail is None:
+                    avail = await call(
+                        product_host, product_port, "CheckAvailability", {"item_id": item_id, "quantity": qty}, request_id
+                    )
                 if not avail.get("ok"):
                     return avail
                 if not avail["data"]["ok"]:
                     return _err(req, "OUT_OF_STOCK", "requested quantity not available")
-                return db_call(
+                return await call(
                     customer_host,
                     customer_port,
                     "UpdateCart",
@@ -122,11 +133,9 @@ def handle_request_factory(customer_host, customer_port, product_host, product_p
                 )
 
             if api == "RemoveItemFromCart":
-                item_id = data.get("item_id")
-                qty = int(data.get("quantity", 0))
                 if not item_id or qty <= 0:
                     return _err(req, "INVALID_ARGUMENT", "item_id and positive quantity required")
-                return db_call(
+                return await call(
                     customer_host,
                     customer_port,
                     "UpdateCart",
@@ -138,39 +147,48 @@ def handle_request_factory(customer_host, customer_port, product_host, product_p
                 return _ok(req, {"saved": True})
 
             if api == "ClearCart":
-                return db_call(customer_host, customer_port, "ClearCart", {"buyer_id": buyer_id}, request_id)
+                return await call(customer_host, customer_port, "ClearCart", {"buyer_id": buyer_id}, request_id)
 
             if api == "DisplayCart":
-                return db_call(customer_host, customer_port, "GetCart", {"buyer_id": buyer_id}, request_id)
+                return await call(customer_host, customer_port, "GetCart", {"buyer_id": buyer_id}, request_id)
 
             if api == "ProvideFeedback":
-                return db_call(product_host, product_port, "ProvideFeedback", data, request_id)
+                return await call(product_host, product_port, "ProvideFeedback", data, request_id)
 
             if api == "GetSellerRating":
-                return db_call(customer_host, customer_port, "GetSellerRating", data, request_id)
+                if side_result is not None:
+                    return side_result
+                return await call(customer_host, customer_port, "GetSellerRating", data, request_id)
 
             if api == "GetBuyerPurchases":
-                return db_call(customer_host, customer_port, "GetBuyerPurchases", {"buyer_id": buyer_id}, request_id)
+                return await call(customer_host, customer_port, "GetBuyerPurchases", {"buyer_id": buyer_id}, request_id)
 
         return _err(req, "UNIMPLEMENTED", f"unknown api {api}")
 
-    return handle
+    return frontend.handler(handle)
+
+
+def async_handle_request_factory(*args, **kwargs):
+    """Like handle_request_factory, but returns an `async def` handler for the asyncio
+    engine: DB calls go over pipelined asyncio connections and never block the loop."""
+    return handle_request_factory(*args, asynchronous=True, **kwargs)
 
 
 def main():
     import argparse
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("--host", default="127.0.0.1")
-    parser.add_argument("--port", type=int, default=6003)
-    parser.add_argument("--customer-host", default="127.0.0.1")
-    parser.add_argument("--customer-port", type=int, default=6001)
-    parser.add_argument("--product-host", default="127.0.0.1")
-    parser.add_argument("--product-port", type=int, default=6002)
+    add_frontend_args(parser, 6003)
+    add_engine_args(parser)
     args = parser.parse_args()
 
-    handler = handle_request_factory(args.customer_host, args.customer_port, args.product_host, args.product_port)
-    run_server(args.host, args.port, handler)
+    run_workers(
+        args.host,
+        args.port,
+        lambda: handle_request_factory(**frontend_options(args)),
+        args.workers,
+        **engine_options(args),
+    )
 
 
 if __name__ == "__main__":
@@ -6,8 +6,9 @@ _ROOT = os.path.dirname(os.path.dirname(__file__))
 if _ROOT not in sys.path:
     sys.path.append(_ROOT)
 
-from common.tcp_client import tcp_request
-from common.tcp_server import run_server
+from common.frontend import FrontendContext, add_frontend_args, frontend_options
+from common.protocol import BATCH_API
+from common.tcp_server import add_engine_args, engine_options, run_workers
 
 
 def _ok(req, data=None):
@@ -30,40 +31,12 @@ def _err(req, code, message):
     }
 
 
-def handle_request_factory(customer_host, customer_port, product_host, product_port):
-    def db_call(host, port, api, data, request_id):
-        return tcp_request(
-            host,
-            port,
-            {
-                "type": "Request",
-                "request_id": request_id,
-                "api": api,
-                "data": data,
-            },
-            reuse_socket=True,
-        )
-
-    def validate_session(session_id, request_id):
-        resp = db_call(
-            customer_host,
-            customer_port,
-            "ValidateSession",
-            {"session_id": session_id},
-            request_id,
-        )
-        return resp
-
-    def require_session(data, request_id):
-        session_id = data.get("session_id")
-        if not session_id:
-            return None, _err({"request_id": request_id}, "NOT_LOGGED_IN", "session_id required")
-        sess = validate_session(session_id, request_id)
-        if not sess.get("ok"):
-            return None, sess
-        return sess["data"], None
-
-    def handle(req: Dict[str, Any]):
+def handle_request_factory(customer_host, customer_port, product_host, product_port, **options):
+    frontend = FrontendContext(customer_host, customer_port, product_host, product_port, **options)
+    db_call = frontend.db_call
+    require_session = frontend.require_session
+
+    async def handle(req: Dict[str, Any], call=db_call):
         api = req.get("api")
         data = req.get("data") or {}
         request_id = req.get("request_id")
@@ -71,63 +44,93 @@ def handle_request_factory(customer_host, customer_port, product_host, product_p
         if api == "Ping":
             return _ok(req, {"ok": True})
 
+        if api == "GetStats":
+            return _ok(req, frontend.stats())
+
+        if api == BATCH_API:
+            return await frontend.batch_forwarder.run(req, handle)
+
         if api == "CreateAccount":
-            return db_call(customer_host, customer_port, "CreateSeller", data, request_id)
+            return await call(customer_host, customer_port, "CreateSeller", data, request_id)
 
         if api == "Login":
             payload = {"role": "seller", **data}
-            return db_call(customer_host, customer_port, "Login", payload, request_id)
+            return await call(customer_host, customer_port, "Login", payload, request_id)
 
         if api == "Logout":
-            return db_call(customer_host, customer_port, "Logout", {"session_id": data.get("session_id")}, request_id)
+            return await frontend.logout(data, request_id, call)
 
         if api in (
             "GetSellerRating",
             "RegisterItemForSale",
+            "RegisterItemsForSale",
             "ChangeItemPrice",
+            "ChangeItemPrices",
             "UpdateUnitsForSale",
+            "UpdateUnitsForSaleBulk",
             "DisplayItemsForSale",
         ):
-            sess_data, err = require_session(data, request_id)
+            sess_data, err = await require_session(data, request_id)
             if err:
                 return err
             seller_id = sess_data["user_id"]
 
             if api == "GetSellerRating":
-                return db_call(customer_host, customer_port, "GetSellerRating", {"seller_id": seller_id}, request_id)
+                return await call(customer_host, customer_port, "GetSellerRating", {"seller_id": seller_id}, request_id)
 
             if api == "RegisterItemForSale":
                 payload = {"seller_id": seller_id, **data}
-                return db_call(product_host, product_port, "RegisterItem", payload, request_id)
+                return await call(product_host, product_port, "RegisterItem", payload, request_id)
+
+            if api == "RegisterItemsForSale":
+                payload = {"items": data.get("items"), "seller_id": seller_id}
+                return await call(product_host, product_port, "RegisterItemsBulk", payload, request_id)
 
             if api == "ChangeItemPrice":
-                return db_call(product_host, product_port, "ChangeItemPrice", data, request_id)
+                return await call(product_host, product_port, "ChangeItemPrice", data, request_id)
+
+            if api == "ChangeItemPrices":
+                return await call(product_host, product_port, "ChangeItemPrices", data, request_id)
 
             if api == "UpdateUnitsForSale":
-                return db_call(product_host, product_port, "UpdateUnitsForSale", data, request_id)
+                return await call(product_host, product_port, "UpdateUnitsForSale", data, request_id)
+
+            if api == "UpdateUnitsForSaleBulk":
+                return await call(product_host, product_port, "UpdateUnitsBulk", data, request_id)
 
             if api == "DisplayItemsForSale":
-                return db_call(product_host, product_port, "DisplayItemsForSale", {"seller_id": seller_id}, request_id)
+                display = {"seller_id": seller_id}
+                for key in ("fields", "if_version"):
+                    if key in data:
+                        display[key] = data[key]
+                return await call(product_host, product_port, "DisplayItemsForSale", display, request_id)
 
         return _err(req, "UNIMPLEMENTED", f"unknown api {api}")
 
-    return handle
+    return frontend.handler(handle)
+
+
+def async_handle_request_factory(*args, **kwargs):
+    """Like handle_request_factory, but returns an `async def` handler for the asyncio
+    engine: DB calls go over pipelined asyncio connections and never block the loop."""
+    return handle_request_factory(*args, asynchronous=True, **kwargs)
 
 
 def main():
     import argparse
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("--host", default="127.0.0.1")
-    parser.add_argument("--port", type=int, default=6004)
-    parser.add_argument("--customer-host", default="127.0.0.1")
-    parser.add_argument("--customer-port", type=int, default=6001)
-    parser.add_argument("--product-host", default="127.0.0.1")
-    parser.add_argument("--product-port", type=int, default=6002)
+    add_frontend_args(parser, 6004)
+    add_engine_args(parser)
     args = parser.parse_args()
 
-    handler = handle_request_factory(args.customer_host, args.customer_port, args.product_host, args.product_port)
-    run_server(args.host, args.port, handler)
+    run_workers(
+        args.host,
+        args.port,
+        lambda: handle_request_factory(**frontend_options(args)),
+        args.workers,
+        **engine_options(args),
+    )
 
 
 if __name__ == "__main__":
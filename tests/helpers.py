@@ -1,16 +1,20 @@
 import threading
 from typing import Any, Dict
 
-from common.tcp_server import JsonRequestHandler, JsonTCPServer
+from common.tcp_server import AsyncJsonServer, JsonRequestHandler, JsonTCPServer
 
 
 class ThreadedServer:
-    def __init__(self, host: str, port: int, handler_fn):
-        class _Server(JsonTCPServer):
-            def handle_request_msg(self, req: Dict[str, Any], _addr):
-                return handler_fn(req)
+    def __init__(self, host: str, port: int, handler_fn, engine: str = "threading"):
+        if engine == "asyncio":
+            self._server = AsyncJsonServer(host, port, handler_fn)
+        else:
 
-        self._server = _Server((host, port), JsonRequestHandler)
+            class _Server(JsonTCPServer):
+                def handle_request_msg(self, req: Dict[str, Any], _addr):
+                    return handler_fn(req)
+
+            self._server = _Server((host, port), JsonRequestHandler)
         self.host, self.port = self._server.server_address
         self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
         self._thread.start()
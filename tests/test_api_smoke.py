@@ -10,6 +10,7 @@ TESTS_DIR = os.path.join(ROOT, "tests")
 if TESTS_DIR not in sys.path:
     sys.path.append(TESTS_DIR)
 
+from common.protocol import batch_request
 from common.tcp_client import tcp_request
 from db_customer.customer_server import handle_request_factory as customer_handler_factory
 from db_product.product_server import handle_request_factory as product_handler_factory
@@ -32,6 +33,8 @@ def _request(host, port, api, data=None, request_id="1"):
 
 
 class APISmokeTest(unittest.TestCase):
+    engine = "threading"
+
     def _assert_ok(self, resp):
         self.assertTrue(resp.get("ok"), msg=f"expected ok response, got: {resp}")
 
@@ -53,17 +56,16 @@ class APISmokeTest(unittest.TestCase):
         customer_state = os.path.join(cls._tmpdir.name, "customer_state.db")
         product_state = os.path.join(cls._tmpdir.name, "product_state.db")
 
-        cls.customer = ThreadedServer("127.0.0.1", 0, customer_handler_factory(customer_state))
-        cls.product = ThreadedServer("127.0.0.1", 0, product_handler_factory(product_state))
+        cls.customer = ThreadedServer("127.0.0.1", 0, customer_handler_factory(customer_state), cls.engine)
+        cls.product = ThreadedServer("127.0.0.1", 0, product_handler_factory(product_state), cls.engine)
+        # On the asyncio engine the frontends run coroutine handlers with async DB calls.
+        backends = (cls.customer.host, cls.customer.port, cls.product.host, cls.product.port)
+        asynchronous = cls.engine == "asyncio"
         cls.buyer = ThreadedServer(
-            "127.0.0.1",
-            0,
-            buyer_handler_factory(cls.customer.host, cls.customer.port, cls.product.host, cls.product.port),
+            "127.0.0.1", 0, buyer_handler_factory(*backends, asynchronous=asynchronous), cls.engine
         )
         cls.seller = ThreadedServer(
-            "127.0.0.1",
-            0,
-            seller_handler_factory(cls.customer.host, cls.customer.port, cls.product.host, cls.product.port),
+            "127.0.0.1", 0, seller_handler_factory(*backends, asynchronous=asynchronous), cls.engine
         )
 
         # Seed a seller and item for buyer tests.
@@ -201,6 +203,15 @@ class APISmokeTest(unittest.TestCase):
         )
         self._assert_ok(avail)
 
+        watch = _request(
+            self.product.host,
+            self.product.port,
+            "WatchItems",
+            {"since": feedback["data"]["version"] - 1, "item_ids": [item_id], "timeout_ms": 0},
+        )
+        self._assert_ok(watch)
+        self.assertEqual([e["type"] for e in watch["data"]["events"]], ["feedback"])
+
     def test_seller_interface_apis(self):
         ping = _request(self.seller.host, self.seller.port, "Ping")
         self._assert_ok(ping)
@@ -242,6 +253,20 @@ class APISmokeTest(unittest.TestCase):
 
         items = _request(self.seller.host, self.seller.port, "DisplayItemsForSale", {"session_id": session_id})
         self._assert_ok(items)
+        listed = _request(
+            self.seller.host,
+            self.seller.port,
+            "DisplayItemsForSale",
+            {"session_id": session_id, "fields": ["item_id", "quantity"]},
+        )
+        self.assertEqual(listed["data"]["items"], [{"item_id": item_id, "quantity": 3}])
+        unchanged = _request(
+            self.seller.host,
+            self.seller.port,
+            "DisplayItemsForSale",
+            {"session_id": session_id, "if_version": items["data"]["version"]},
+        )
+        self.assertTrue(unchanged["data"]["not_modified"])
 
         rating = _request(self.seller.host, self.seller.port, "GetSellerRating", {"session_id": session_id})
         self._assert_ok(rating)
@@ -307,3 +332,163 @@ class APISmokeTest(unittest.TestCase):
 
         logout = _request(self.buyer.host, self.buyer.port, "Logout", {"session_id": session_id})
         self._assert_ok(logout)
+
+    def test_bulk_item_apis(self):
+        session_id = self._seller_login()
+        items = [
+            {"name": f"Bulk {i}", "category": 6, "keywords": ["bulk"], "condition": "used", "price": 5.0, "quantity": 2}
+            for i in range(3)
+        ]
+        reg = _request(
+            self.seller.host, self.seller.port, "RegisterItemsForSale", {"session_id": session_id, "items": items}
+        )
+        self._assert_ok(reg)
+        item_ids = reg["data"]["item_ids"]
+        self.assertEqual(len(set(item_ids)), 3)
+        self.assertTrue(all(item_id.startswith("6:") for item_id in item_ids))
+
+        bad = _request(
+            self.seller.host,
+            self.seller.port,
+            "RegisterItemsForSale",
+            {"session_id": session_id, "items": [items[0], {"name": "no price"}]},
+        )
+        self.assertEqual(bad["error"]["code"], "INVALID_ARGUMENT")
+
+        prices = _request(
+            self.seller.host,
+            self.seller.port,
+            "ChangeItemPrices",
+            {"session_id": session_id, "updates": [{"item_id": item_id, "price": 7.5} for item_id in item_ids]},
+        )
+        self._assert_ok(prices)
+        units = _request(
+            self.seller.host,
+            self.seller.port,
+            "UpdateUnitsForSaleBulk",
+            {"session_id": session_id, "updates": [{"item_id": item_ids[0], "quantity_delta": -2}]},
+        )
+        self._assert_ok(units)
+        # A missing item fails the whole call and changes nothing.
+        partial = _request(
+            self.seller.host,
+            self.seller.port,
+            "ChangeItemPrices",
+            {
+                "session_id": session_id,
+                "updates": [{"item_id": item_ids[1], "price": 1.0}, {"item_id": "6:999", "price": 1.0}],
+            },
+        )
+        self.assertEqual(partial["error"]["code"], "NOT_FOUND")
+
+        got = _request(self.buyer.host, self.buyer.port, "GetItems", {"item_ids": item_ids + ["6:999"]})
+        self._assert_ok(got)
+        self.assertEqual([item["item_id"] for item in got["data"]["items"]], item_ids)
+        self.assertEqual([item["price"] for item in got["data"]["items"]], [7.5] * 3)
+        self.assertEqual([item["quantity"] for item in got["data"]["items"]], [0, 2, 2])
+        self.assertEqual(got["data"]["missing"], ["6:999"])
+
+        search = _request(self.product.host, self.product.port, "SearchItems", {"keywords": ["bulk"], "category": 6})
+        self.assertEqual(sorted(item["item_id"] for item in search["data"]["items"]), sorted(item_ids[1:]))
+
+    def test_batches_run_in_order_or_forwarded_together(self):
+        session_id = self._buyer_login(name="batcher")
+
+        def sub(api, **data):
+            return {"type": "Request", "request_id": api, "api": api, "data": {"session_id": session_id, **data}}
+
+        add = sub("AddItemToCart", item_id=self.item_id, quantity=1)
+        before = _request(self.buyer.host, self.buyer.port, "GetStats")["data"]["batches"]
+        resp = tcp_request(
+            self.buyer.host,
+            self.buyer.port,
+            batch_request([add, add, add, sub("GetItem", item_id=self.item_id), sub("Batch")], independent=True),
+        )
+        self._assert_ok(resp)
+        responses = resp["data"]["responses"]
+        self.assertEqual([r["request_id"] for r in responses], ["AddItemToCart"] * 3 + ["GetItem", "Batch"])
+        self.assertTrue(all(r["ok"] for r in responses[:4]), msg=responses)
+        self.assertEqual(responses[4]["error"]["code"], "INVALID_ARGUMENT")  # no nesting
+        after = _request(self.buyer.host, self.buyer.port, "GetStats")["data"]["batches"]
+        # CheckAvailability x3 + GetItem to db_product, then UpdateCart x3 to db_customer.
+        self.assertEqual(after["batches"] - before["batches"], 2)
+        self.assertEqual(after["forwarded"] - before["forwarded"], 7)
+
+        ordered = tcp_request(
+            self.buyer.host,
+            self.buyer.port,
+            batch_request([sub("RemoveItemFromCart", item_id=self.item_id, quantity=1), sub("DisplayCart")]),
+        )
+        self._assert_ok(ordered)
+        cart = ordered["data"]["responses"][1]["data"]["cart"]
+        self.assertEqual(cart, {self.item_id: 2})
+
+        direct = tcp_request(self.customer.host, self.customer.port, batch_request([{"api": "Ping"}, {"api": "Nope"}]))
+        self.assertEqual([r["ok"] for r in direct["data"]["responses"]], [True, False])
+
+    def test_search_uses_keyword_index(self):
+        def register(name, keywords, quantity):
+            resp = _request(
+                self.product.host,
+                self.product.port,
+                "RegisterItem",
+                {
+                    "name": name,
+                    "category": 9,
+                    "keywords": keywords,
+                    "condition": "new",
+                    "price": 5.0,
+                    "quantity": quantity,
+                    "seller_id": self.seller_id,
+                },
+            )
+            self._assert_ok(resp)
+            return resp["data"]["item_id"]
+
+        one_hit = register("Lamp", ["idxlamp"], 1)
+        two_hits = register("Desk lamp", ["idxlamp", "IdxDesk"], 1)
+        sold_out = register("Old lamp", ["idxlamp"], 0)
+
+        search = _request(
+            self.product.host,
+            self.product.port,
+            "SearchItems",
+            {"keywords": ["idxdesk", "idxlamp"], "category": 9},
+        )
+        self._assert_ok(search)
+        self.assertEqual([item["item_id"] for item in search["data"]["items"]], [two_hits, one_hit])
+
+        restock = _request(
+            self.product.host,
+            self.product.port,
+            "UpdateUnitsForSale",
+            {"item_id": sold_out, "quantity_delta": 2},
+        )
+        self._assert_ok(restock)
+        search = _request(self.product.host, self.product.port, "SearchItems", {"keywords": ["idxlamp"], "category": 9})
+        self.assertIn(sold_out, [item["item_id"] for item in search["data"]["items"]])
+
+        other = _request(self.product.host, self.product.port, "SearchItems", {"keywords": ["idxlamp"], "category": 8})
+        self.assertEqual(other["data"]["items"], [])
+
+        # The buyer frontend passes limit and cursor through to db_product.
+        pages, cursor = [], None
+        while True:
+            page = _request(
+                self.buyer.host,
+                self.buyer.port,
+                "SearchItemsForSale",
+                {"keywords": ["idxdesk", "idxlamp"], "category": 9, "limit": 2, "cursor": cursor},
+            )
+            self._assert_ok(page)
+            pages.append([item["item_id"] for item in page["data"]["items"]])
+            cursor = page["data"]["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(pages, [[two_hits, one_hit], [sold_out]])
+
+
+class AsyncioAPISmokeTest(APISmokeTest):
+    """Runs the same flows with every server on the asyncio engine."""
+
+    engine = "asyncio"
@@ -0,0 +1,51 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(__file__))
+if ROOT not in sys.path:
+    sys.path.append(ROOT)
+
+from db_customer.customer_server import handle_request_factory
+
+
+def _call(handler, api, data):
+    return handler({"type": "Request", "request_id": "1", "api": api, "data": data})
+
+
+class ReadWhileWritingTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.state = os.path.join(self._tmpdir.name, "customer_state.db")
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def test_reads_answer_while_a_write_holds_the_writer_lock(self):
+        handler = handle_request_factory(self.state)
+        buyer_id = _call(handler, "CreateBuyer", {"name": "bob", "password": "pass"})["data"]["buyer_id"]
+        add = {"buyer_id": buyer_id, "item_id": "1:1", "quantity_delta": 1}
+        _call(handler, "UpdateCart", add)
+        blocker = sqlite3.connect(self.state, check_same_thread=False)
+        self.addCleanup(blocker.close)
+        blocker.execute("BEGIN IMMEDIATE")
+        # This write takes the writer lock, then waits on the database lock held above.
+        writer = threading.Thread(target=_call, args=(handler, "UpdateCart", add))
+        writer.start()
+        time.sleep(0.2)
+        started = time.monotonic()
+        cart = _call(handler, "GetCart", {"buyer_id": buyer_id})
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(cart["data"]["cart"], {"1:1": 1})
+        self.assertTrue(writer.is_alive())
+        blocker.rollback()
+        writer.join()
+        self.assertEqual(_call(handler, "GetCart", {"buyer_id": buyer_id})["data"]["cart"], {"1:1": 2})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(__file__))
+if ROOT not in sys.path:
+    sys.path.append(ROOT)
+TESTS_DIR = os.path.join(ROOT, "tests")
+if TESTS_DIR not in sys.path:
+    sys.path.append(TESTS_DIR)
+
+from common.fanout import FanOut
+from common.tcp_server import run_sync
+from server_buyer.buyer_server import handle_request_factory as buyer_handler_factory
+from helpers import ThreadedServer
+
+
+class FanOutTest(unittest.TestCase):
+    def _call(self, fan_out, asynchronous, *calls):
+        if asynchronous:
+            return asyncio.run(fan_out(*calls))
+        return run_sync(fan_out(*calls))
+
+    def _modes(self):
+        for asynchronous in (False, True):
+            with self.subTest(asynchronous=asynchronous):
+                fan_out = FanOut(asynchronous)
+                self.addCleanup(fan_out.close)
+                yield fan_out, asynchronous
+
+    def test_runs_calls_concurrently_and_stops_at_first_failure(self):
+        for fan_out, asynchronous in self._modes():
+            finished = []
+
+            def call(name, delay, ok=True):
+                async def run():
+                    if asynchronous:
+                        await asyncio.sleep(delay)
+                    else:
+                        time.sleep(delay)
+                    finished.append(name)
+                    return {"ok": ok, "data": name}
+
+                return run
+
+            start = time.monotonic()
+            results = self._call(fan_out, asynchronous, call("a", 0.2), call("b", 0.1))
+            self.assertLess(time.monotonic() - start, 0.3)
+            self.assertEqual([r["data"] for r in results], ["a", "b"])
+
+            finished.clear()
+            start = time.monotonic()
+            results = self._call(fan_out, asynchronous, call("slow", 0.5), call("bad", 0.05, ok=False))
+            self.assertLess(time.monotonic() - start, 0.4)
+            self.assertEqual(results, [None, {"ok": False, "data": "bad"}])
+            if asynchronous:
+                self.assertEqual(finished, ["bad"])  # the slow call was cancelled
+
+            with self.assertRaises(TimeoutError):
+                self._call(fan_out, asynchronous, call("a", 0.01), (call("late", 0.5), 0.1))
+
+
+class BuyerFanOutTest(unittest.TestCase):
+    def _response(self, req, code=None):
+        return {
+            "type": "Response",
+            "request_id": req.get("request_id"),
+            "ok": code is None,
+            "error": {"code": code, "message": code} if code else None,
+            "data": None if code else {},
+        }
+
+    def test_side_call_errors_never_reach_callers_without_a_session(self):
+        # The session check is slow and fails; the side calls fail at once.
+        def customer(req):
+            if req["api"] == "ValidateSession":
+                time.sleep(0.2)
+                return self._response(req, "NOT_LOGGED_IN")
+            return self._response(req, "NOT_FOUND")
+
+        customer_server = ThreadedServer("127.0.0.1", 0, customer)
+        product_server = ThreadedServer("127.0.0.1", 0, lambda req: self._response(req, "NOT_FOUND"))
+        self.addCleanup(customer_server.stop)
+        self.addCleanup(product_server.stop)
+        backends = (customer_server.host, customer_server.port, product_server.host, product_server.port)
+        requests = [
+            ("AddItemToCart", {"session_id": "bogus", "item_id": "9:9", "quantity": 1}),
+            ("GetSellerRating", {"session_id": "bogus", "seller_id": 404}),
+        ]
+        for asynchronous in (False, True):
+            handler = buyer_handler_factory(*backends, session_cache_ttl=0, asynchronous=asynchronous)
+            for api, data in requests:
+                with self.subTest(asynchronous=asynchronous, api=api):
+                    req = {"type": "Request", "request_id": "r", "api": api, "data": data}
+                    resp = asyncio.run(handler(req)) if asynchronous else handler(req)
+                    self.assertEqual(resp["error"]["code"], "NOT_LOGGED_IN")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(__file__))
+if ROOT not in sys.path:
+    sys.path.append(ROOT)
+
+from common.sqlite_pool import GroupCommitter
+
+
+class GroupCommitTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.conn = sqlite3.connect(os.path.join(self._tmpdir.name, "state.db"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("CREATE TABLE counters (name TEXT PRIMARY KEY, value INTEGER)")
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+        self._tmpdir.cleanup()
+
+    def test_concurrent_ops_share_commits_and_failures_stay_isolated(self):
+        writer = GroupCommitter(self.conn, threading.Lock(), batch_size=16, max_wait=0.005)
+        applied = []
+
+        def insert(name):
+            def op(conn, after):
+                conn.execute("INSERT INTO counters(name, value) VALUES (?, 1)", (name,))
+                after.append(lambda: applied.append(name))
+                return name
+
+            return op
+
+        def failing(conn, after):
+            conn.execute("INSERT INTO counters(name, value) VALUES ('bad', 1)")
+            after.append(lambda: applied.append("bad"))
+            raise ValueError("boom")
+
+        errors = []
+
+        def submit(op):
+            try:
+                writer.run(op)
+            except ValueError as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=submit, args=(insert(f"n{i}"),)) for i in range(20)]
+        threads.append(threading.Thread(target=submit, args=(failing,)))
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        names = {row[0] for row in self.conn.execute("SELECT name FROM counters")}
+        self.assertEqual(names, {f"n{i}" for i in range(20)})
+        self.assertEqual(sorted(applied), sorted(names))
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(writer.stats()["ops"], 21)
+        self.assertLess(writer.stats()["batches"], 21)
+
+    def _run_together(self, writer, *ops):
+        results = [None] * len(ops)
+
+        def submit(i, op):
+            try:
+                results[i] = writer.run(op)
+            except Exception as exc:
+                results[i] = exc
+
+        threads = [threading.Thread(target=submit, args=(i, op)) for i, op in enumerate(ops)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_group_members_stay_invisible_until_the_shared_commit(self):
+        writer = GroupCommitter(self.conn, threading.Lock(), batch_size=2, max_wait=1.0)
+        observer = sqlite3.connect(os.path.join(self._tmpdir.name, "state.db"), check_same_thread=False)
+        self.addCleanup(observer.close)
+        seen = []
+
+        def insert(name):
+            def op(conn, after):
+                # Whichever op runs second must not see the first one's row yet.
+                seen.append(observer.execute("SELECT COUNT(*) FROM counters").fetchone()[0])
+                conn.execute("INSERT INTO counters(name, value) VALUES (?, 1)", (name,))
+
+            return op
+
+        self._run_together(writer, insert("first"), insert("second"))
+        self.assertEqual(writer.stats()["batches"], 1)
+        self.assertEqual(seen, [0, 0])
+        self.assertEqual(observer.execute("SELECT COUNT(*) FROM counters").fetchone()[0], 2)
+
+    def test_failed_commit_fails_the_whole_group(self):
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute(
+            "CREATE TABLE refs (name TEXT REFERENCES counters(name) DEFERRABLE INITIALLY DEFERRED)"
+        )
+        self.conn.commit()
+        writer = GroupCommitter(self.conn, threading.Lock(), batch_size=2, max_wait=1.0)
+        applied = []
+
+        def good(conn, after):
+            conn.execute("INSERT INTO counters(name, value) VALUES ('good', 1)")
+            after.append(lambda: applied.append("good"))
+
+        def dangling(conn, after):
+            # Only checked at COMMIT, so the whole group's commit fails.
+            conn.execute("INSERT INTO refs(name) VALUES ('missing')")
+            after.append(lambda: applied.append("dangling"))
+
+        results = self._run_together(writer, good, dangling)
+        self.assertTrue(all(isinstance(r, sqlite3.IntegrityError) for r in results))
+        self.assertEqual(applied, [])
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM counters").fetchone()[0], 0)
+        # The writer keeps working afterwards.
+        self._run_together(writer, good)
+        self.assertEqual(applied, ["good"])
@@ -0,0 +1,373 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(__file__))
+if ROOT not in sys.path:
+    sys.path.append(ROOT)
+
+from common.protocol import batch_request
+from common.tcp_server import WorkerPool
+from db_product.product_server import handle_request_factory
+
+
+def _call(handler, api, data):
+    return handler({"type": "Request", "request_id": "1", "api": api, "data": data})
+
+
+def _item(name, category=1, keywords=("book",), quantity=5, price=10.0):
+    return {
+        "name": name,
+        "category": category,
+        "keywords": list(keywords),
+        "condition": "new",
+        "price": price,
+        "quantity": quantity,
+        "seller_id": 1,
+    }
+
+
+class ItemSequenceTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.state = os.path.join(self._tmpdir.name, "product_state.db")
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def test_ids_continue_across_restarts_and_blocks(self):
+        handler = handle_request_factory(self.state)
+        self.assertEqual(_call(handler, "RegisterItem", _item("a"))["data"]["item_id"], "1:1")
+        bulk = _call(handler, "RegisterItemsBulk", {"seller_id": 1, "items": [_item("b"), _item("c", category=2)]})
+        self.assertEqual(bulk["data"]["item_ids"], ["1:2", "2:1"])
+
+        # A database written before item_sequences existed is seeded from its items.
+        with sqlite3.connect(self.state) as conn:
+            conn.execute("DROP TABLE item_sequences")
+        handler = handle_request_factory(self.state)
+        self.assertEqual(_call(handler, "RegisterItem", _item("d"))["data"]["item_id"], "1:3")
+        self.assertEqual(_call(handler, "RegisterItem", _item("e", category=2))["data"]["item_id"], "2:2")
+        self.assertEqual(_call(handler, "RegisterItem", _item("f", category=3))["data"]["item_id"], "3:1")
+
+
+class ReadWhileWritingTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.state = os.path.join(self._tmpdir.name, "product_state.db")
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def test_reads_answer_while_a_write_holds_the_writer_lock(self):
+        handler = handle_request_factory(self.state)
+        item_id = _call(handler, "RegisterItem", _item("a"))["data"]["item_id"]
+        blocker = sqlite3.connect(self.state, check_same_thread=False)
+        self.addCleanup(blocker.close)
+        blocker.execute("BEGIN IMMEDIATE")
+        # This write takes the writer lock, then waits on the database lock held above.
+        writer = threading.Thread(target=_call, args=(handler, "ChangeItemPrice", {"item_id": item_id, "price": 2.0}))
+        writer.start()
+        time.sleep(0.2)
+        started = time.monotonic()
+        item = _call(handler, "GetItem", {"item_id": item_id})
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(item["data"]["item"]["price"], 10.0)
+        self.assertTrue(writer.is_alive())
+        blocker.rollback()
+        writer.join()
+        self.assertEqual(_call(handler, "GetItem", {"item_id": item_id})["data"]["item"]["price"], 2.0)
+
+
+class GroupCommitBatchTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def test_independent_batch_writes_share_commits(self):
+        handler = handle_request_factory(os.path.join(self._tmpdir.name, "product_state.db"), 64, 0.05)
+        registered = _call(handler, "RegisterItemsBulk", {"seller_id": 1, "items": [_item(str(i)) for i in range(8)]})
+        subs = [
+            {"type": "Request", "request_id": i, "api": "ChangeItemPrice", "data": {"item_id": i, "price": 1}}
+            for i in registered["data"]["item_ids"]
+        ]
+        resp = handler(batch_request(subs, independent=True))
+        self.assertTrue(all(sub["ok"] for sub in resp["data"]["responses"]))
+        stats = _call(handler, "GetStats", {})["data"]["group_commit"]
+        # One commit for the registration, far fewer than eight for the batch.
+        self.assertEqual(stats["ops"], 9)
+        self.assertLess(stats["batches"], 5)
+
+
+class SearchCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.handler = handle_request_factory(os.path.join(self._tmpdir.name, "product_state.db"))
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def _search(self, keywords, category=1):
+        resp = _call(self.handler, "SearchItems", {"keywords": keywords, "category": category})
+        return [(item["item_id"], item["price"], item["quantity"]) for item in resp["data"]["items"]]
+
+    def _stats(self):
+        return _call(self.handler, "GetStats", {})["data"]["search_cache"]
+
+    def test_results_are_cached_until_a_write_touches_the_category(self):
+        item_id = _call(self.handler, "RegisterItem", _item("a"))["data"]["item_id"]
+        other_id = _call(self.handler, "RegisterItem", _item("b", category=2))["data"]["item_id"]
+        self.assertEqual(self._search(["book"]), [(item_id, 10.0, 5)])
+        self.assertEqual(self._search(["BOOK"]), [(item_id, 10.0, 5)])
+        self.assertEqual(self._stats()["hits"], 1)
+
+        _call(self.handler, "ChangeItemPrice", {"item_id": item_id, "price": 12.5})
+        self.assertEqual(self._search(["book"]), [(item_id, 12.5, 5)])
+        _call(self.handler, "UpdateUnitsForSale", {"item_id": item_id, "quantity_delta": -5})
+        self.assertEqual(self._search(["book"]), [])
+        new_id = _call(self.handler, "RegisterItem", _item("c"))["data"]["item_id"]
+        self.assertEqual(self._search(["book"]), [(new_id, 10.0, 5)])
+
+        # A write in another category leaves category 1 cached but not category-less searches.
+        self.assertEqual(len(self._search(["book"], category=None)), 2)
+        hits = self._stats()["hits"]
+        _call(self.handler, "ChangeItemPrice", {"item_id": other_id, "price": 3.0})
+        self._search(["book"])
+        self.assertEqual(self._stats()["hits"], hits + 1)
+        self.assertIn((other_id, 3.0, 5), self._search(["book"], category=None))
+
+        stats = self._stats()
+        self.assertEqual(stats["invalidations"], 6)
+        self.assertGreaterEqual(stats["stale"], 3)
+
+    def test_zero_size_disables_the_cache(self):
+        handler = handle_request_factory(os.path.join(self._tmpdir.name, "uncached.db"), search_cache_size=0)
+        _call(handler, "RegisterItem", _item("a"))
+        for _ in range(2):
+            self.assertEqual(len(_call(handler, "SearchItems", {"keywords": ["book"]})["data"]["items"]), 1)
+        stats = _call(handler, "GetStats", {})["data"]["search_cache"]
+        self.assertEqual((stats["entries"], stats["hits"]), (0, 0))
+
+
+class SearchPagingTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.handler = handle_request_factory(os.path.join(self._tmpdir.name, "product_state.db"))
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def _pages(self, data, limit):
+        pages, cursor = [], None
+        while True:
+            resp = _call(self.handler, "SearchItems", {**data, "limit": limit, "cursor": cursor})
+            pages.append([item["item_id"] for item in resp["data"]["items"]])
+            cursor = resp["data"]["next_cursor"]
+            if cursor is None:
+                return pages
+
+    def test_pages_follow_score_then_category_then_age(self):
+        items = [_item("a", 2), _item("b", 1, ("book", "red")), _item("c", 1), _item("d", 2, ("book", "red"))]
+        _call(self.handler, "RegisterItemsBulk", {"seller_id": 1, "items": items})
+        query = {"keywords": ["book", "red"]}
+        everything = _call(self.handler, "SearchItems", query)["data"]
+        self.assertEqual([item["item_id"] for item in everything["items"]], ["1:1", "2:2", "1:2", "2:1"])
+        self.assertIsNone(everything["next_cursor"])
+        self.assertEqual(self._pages(query, 3), [["1:1", "2:2", "1:2"], ["2:1"]])
+        self.assertEqual(self._pages(query, 2), [["1:1", "2:2"], ["1:2", "2:1"]])
+
+        # A cursor resumes after its item even when items were added or sold out meanwhile.
+        first = _call(self.handler, "SearchItems", {**query, "limit": 2})["data"]
+        _call(self.handler, "UpdateUnitsForSale", {"item_id": "1:2", "quantity_delta": -5})
+        _call(self.handler, "RegisterItem", _item("e", 1, ("red", "book")))
+        rest = _call(self.handler, "SearchItems", {**query, "limit": 2, "cursor": first["next_cursor"]})["data"]
+        self.assertEqual([item["item_id"] for item in rest["items"]], ["2:1"])
+
+    def test_rejects_bad_paging_arguments(self):
+        for data in ({"limit": 0}, {"limit": "5"}, {"limit": 100000}, {"cursor": "x"}, {"cursor": 3}):
+            with self.subTest(data=data):
+                resp = _call(self.handler, "SearchItems", {"keywords": ["book"], **data})
+                self.assertEqual(resp["error"]["code"], "INVALID_ARGUMENT")
+
+
+class ProjectionTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.handler = handle_request_factory(os.path.join(self._tmpdir.name, "product_state.db"))
+        self.item_id = _call(self.handler, "RegisterItem", _item("a", price=4.5))["data"]["item_id"]
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def test_reads_return_only_requested_fields(self):
+        fields = {"fields": ["price", "item_id"]}
+        expected = {"item_id": self.item_id, "price": 4.5}
+        search = _call(self.handler, "SearchItems", {"keywords": ["book"], **fields})["data"]["items"]
+        self.assertEqual(search, [expected])
+        listed = _call(self.handler, "DisplayItemsForSale", {"seller_id": 1, **fields})["data"]["items"]
+        self.assertEqual(listed, [expected])
+        self.assertEqual(_call(self.handler, "GetItem", {"item_id": self.item_id, **fields})["data"]["item"], expected)
+        got = _call(self.handler, "GetItems", {"item_ids": [self.item_id, "1:99"], **fields})["data"]
+        self.assertEqual((got["items"], got["missing"]), ([expected], ["1:99"]))
+
+        item = _call(self.handler, "GetItem", {"item_id": self.item_id, "fields": ["feedback", "keywords"]})
+        self.assertEqual(item["data"]["item"], {"keywords": ["book"], "feedback": {"up": 0, "down": 0}})
+        # Without a projection every field is returned, also past the cached projected search.
+        full = _call(self.handler, "SearchItems", {"keywords": ["book"]})["data"]["items"][0]
+        self.assertEqual(full["name"], "a")
+        self.assertEqual(len(full), 10)
+
+    def test_rejects_unknown_fields(self):
+        for fields in ([], "price", ["price", "secret"], [["price"]], [{"a": 1}], [7]):
+            with self.subTest(fields=fields):
+                resp = _call(self.handler, "GetItem", {"item_id": self.item_id, "fields": fields})
+                self.assertEqual(resp["error"]["code"], "INVALID_ARGUMENT")
+
+
+class ConditionalReadTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.state = os.path.join(self._tmpdir.name, "product_state.db")
+        self.handler = handle_request_factory(self.state)
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def _get(self, item_id, version=None):
+        return _call(self.handler, "GetItem", {"item_id": item_id, "if_version": version})["data"]
+
+    def _listing(self, version=None):
+        return _call(self.handler, "DisplayItemsForSale", {"seller_id": 1, "if_version": version})["data"]
+
+    def test_every_write_bumps_the_version_and_unchanged_reads_are_not_modified(self):
+        item_id = _call(self.handler, "RegisterItem", _item("a"))["data"]["item_id"]
+        version = self._get(item_id)["item"]["version"]
+        self.assertEqual(self._get(item_id, version), {"item_id": item_id, "version": version, "not_modified": True})
+        listing = self._listing()
+        self.assertEqual(len(listing["items"]), 1)
+        self.assertEqual(self._listing(listing["version"]), {"version": listing["version"], "not_modified": True})
+
+        writes = [
+            ("ChangeItemPrice", {"item_id": item_id, "price": 11.0}),
+            ("UpdateUnitsForSale", {"item_id": item_id, "quantity_delta": 1}),
+            ("ProvideFeedback", {"item_id": item_id, "vote": "up"}),
+            ("ChangeItemPrices", {"updates": [{"item_id": item_id, "price": 12.0}]}),
+            ("UpdateUnitsBulk", {"updates": [{"item_id": item_id, "quantity_delta": -1}]}),
+        ]
+        for api, data in writes:
+            with self.subTest(api=api):
+                _call(self.handler, api, data)
+                item = self._get(item_id, version)["item"]
+                self.assertGreater(item["version"], version)
+                version = item["version"]
+
+        # A new item changes the seller's listing version, also after a restart.
+        listing_version = self._listing()["version"]
+        self.handler = handle_request_factory(self.state)
+        _call(self.handler, "RegisterItemsBulk", {"seller_id": 1, "items": [_item("b")]})
+        listing = self._listing(listing_version)
+        self.assertEqual(len(listing["items"]), 2)
+        self.assertGreater(listing["version"], listing_version)
+
+    def test_existing_items_start_at_version_one(self):
+        item_id = _call(self.handler, "RegisterItem", _item("a"))["data"]["item_id"]
+        with sqlite3.connect(self.state) as conn:
+            conn.execute("DROP INDEX idx_items_seller_version")
+            conn.execute("ALTER TABLE items DROP COLUMN version")
+        self.handler = handle_request_factory(self.state)
+        self.assertEqual(self._get(item_id)["item"]["version"], 1)
+        _call(self.handler, "ChangeItemPrice", {"item_id": item_id, "price": 11.0})
+        self.assertEqual(self._get(item_id)["item"]["version"], 2)
+
+
+class WatchItemsTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.state = os.path.join(self._tmpdir.name, "product_state.db")
+        self.handler = handle_request_factory(self.state, change_feed_size=4)
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def _watch(self, since=None, **data):
+        data.setdefault("timeout_ms", 0)
+        return _call(self.handler, "WatchItems", {"since": since, **data})["data"]
+
+    def test_events_follow_writes_and_filters(self):
+        start = self._watch()
+        self.assertTrue(start["resync"])
+        item_id = _call(self.handler, "RegisterItem", _item("a"))["data"]["item_id"]
+        other_id = _call(self.handler, "RegisterItem", _item("b", category=2))["data"]["item_id"]
+        _call(self.handler, "ChangeItemPrice", {"item_id": item_id, "price": 9.0})
+
+        feed = self._watch(start["last_seq"])
+        self.assertFalse(feed["resync"])
+        self.assertEqual(
+            [(e["type"], e["item_id"]) for e in feed["events"]],
+            [("created", item_id), ("created", other_id), ("price", item_id)],
+        )
+        self.assertEqual(feed["events"][2]["price"], 9.0)
+        item = _call(self.handler, "GetItem", {"item_id": item_id})["data"]["item"]
+        self.assertEqual(feed["events"][2]["seq"], item["version"])
+        self.assertEqual([e["item_id"] for e in self._watch(start["last_seq"], category=2)["events"]], [other_id])
+        self.assertEqual(len(self._watch(start["last_seq"], item_ids=[item_id])["events"]), 2)
+        nothing = self._watch(start["last_seq"], seller_id=7)
+        self.assertEqual(nothing, {"resync": False, "events": [], "last_seq": feed["last_seq"]})
+        page = self._watch(start["last_seq"], limit=2)
+        self.assertEqual(self._watch(page["last_seq"])["events"], feed["events"][2:])
+
+        # A watcher waits for the next matching write.
+        sell_one = {"item_id": item_id, "quantity_delta": -1}
+        threading.Timer(0.1, _call, (self.handler, "UpdateUnitsForSale", sell_one)).start()
+        started = time.monotonic()
+        woken = self._watch(feed["last_seq"], item_ids=[item_id], timeout_ms=5000)
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual([(e["type"], e["quantity"]) for e in woken["events"]], [("quantity", 4)])
+
+    def test_watchers_behind_the_log_or_after_a_restart_must_resync(self):
+        since = self._watch()["last_seq"]
+        _call(self.handler, "RegisterItemsBulk", {"seller_id": 1, "items": [_item(str(i)) for i in range(5)]})
+        self.assertTrue(self._watch(since)["resync"])
+        last_seq = self._watch(since + 1)["last_seq"]
+        self.assertEqual(last_seq, since + 5)
+
+        self.handler = handle_request_factory(self.state, change_feed_size=4)
+        self.assertEqual(self._watch(last_seq)["events"], [])
+        self.assertTrue(self._watch(last_seq - 1)["resync"])
+
+    def test_parked_watchers_leave_handler_threads_for_other_requests(self):
+        handler = handle_request_factory(self.state, max_watchers=2)
+        pool = WorkerPool(handler, size=3, queue_size=16, queue_timeout=1.0)
+        since = self._watch()["last_seq"]
+
+        def submit(api, data):
+            return pool.submit({"type": "Request", "request_id": api, "api": api, "data": data})
+
+        parked = [submit("WatchItems", {"since": since, "timeout_ms": 3000}) for _ in range(2)]
+        while _call(handler, "GetStats", {})["data"]["change_feed"]["watching"] < 2:
+            time.sleep(0.001)
+        started = time.monotonic()
+        rejected = submit("WatchItems", {"since": since, "timeout_ms": 3000}).result(timeout=1)
+        self.assertEqual(rejected["error"]["code"], "OVERLOADED")
+        self.assertTrue(submit("Ping", {}).result(timeout=1)["ok"])
+        self.assertLess(time.monotonic() - started, 0.5)
+        # Polls that don't wait need no slot.
+        self.assertTrue(submit("WatchItems", {"since": since, "timeout_ms": 0}).result(timeout=1)["ok"])
+
+        _call(handler, "RegisterItem", _item("a"))
+        self.assertEqual([len(f.result(timeout=2)["data"]["events"]) for f in parked], [1, 1])
+
+    def test_rejects_malformed_arguments(self):
+        for data in ({"limit": 0}, {"timeout_ms": -1}, {"item_ids": "1:1"}, {"item_ids": [["1:1"]]}, {"item_ids": [7]}):
+            with self.subTest(data=data):
+                resp = _call(self.handler, "WatchItems", data)
+                self.assertEqual(resp["error"]["code"], "INVALID_ARGUMENT")
+
+
+if __name__ == "__main__":
+    unittest.main()
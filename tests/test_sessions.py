@@ -0,0 +1,259 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(__file__))
+if ROOT not in sys.path:
+    sys.path.append(ROOT)
+TESTS_DIR = os.path.join(ROOT, "tests")
+if TESTS_DIR not in sys.path:
+    sys.path.append(TESTS_DIR)
+
+from common.session_token import check_token
+from db_customer.customer_server import _init_db, _SessionStore, handle_request_factory
+from server_seller.seller_server import handle_request_factory as seller_handler_factory
+from helpers import ThreadedServer
+
+
+def _call(handler, api, data):
+    return handler({"type": "Request", "request_id": "1", "api": api, "data": data})
+
+
+class SessionStoreTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.state = os.path.join(self._tmpdir.name, "customer_state.db")
+        self.handler = handle_request_factory(self.state, session_flush_interval=0.05)
+        _call(self.handler, "CreateBuyer", {"name": "bob", "password": "pass"})
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def _last_active(self, session_id):
+        with sqlite3.connect(self.state) as conn:
+            row = conn.execute("SELECT last_active FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else None
+
+    def test_validate_is_served_from_memory_and_flushed_in_batches(self):
+        login = _call(self.handler, "Login", {"role": "buyer", "name": "bob", "password": "pass"})
+        session_id = login["data"]["session_id"]
+        created = self._last_active(session_id)
+        self.assertIsNotNone(created)
+
+        time.sleep(0.01)
+        valid = _call(self.handler, "ValidateSession", {"session_id": session_id})
+        self.assertTrue(valid["ok"])
+        self.assertEqual(valid["data"]["role"], "buyer")
+
+        deadline = time.time() + 2
+        while self._last_active(session_id) == created and time.time() < deadline:
+            time.sleep(0.02)
+        self.assertGreater(self._last_active(session_id), created)
+
+        _call(self.handler, "Logout", {"session_id": session_id})
+        self.assertIsNone(self._last_active(session_id))
+        invalid = _call(self.handler, "ValidateSession", {"session_id": session_id})
+        self.assertEqual(invalid["error"]["code"], "NOT_LOGGED_IN")
+
+    def test_sweeper_evicts_abandoned_sessions_per_role_timeout(self):
+        handler = handle_request_factory(
+            os.path.join(self._tmpdir.name, "sweep_state.db"),
+            session_flush_interval=0.05,
+            session_timeouts={"buyer": 0.1, "seller": 60},
+        )
+        _call(handler, "CreateBuyer", {"name": "bob", "password": "pass"})
+        _call(handler, "CreateSeller", {"name": "sue", "password": "pass"})
+        for _ in range(3):
+            _call(handler, "Login", {"role": "buyer", "name": "bob", "password": "pass"})
+        _call(handler, "Login", {"role": "seller", "name": "sue", "password": "pass"})
+
+        deadline = time.time() + 2
+        stats = _call(handler, "GetStats", {})["data"]["sessions"]
+        while stats["active"] > 1 and time.time() < deadline:
+            time.sleep(0.05)
+            stats = _call(handler, "GetStats", {})["data"]["sessions"]
+        self.assertEqual(stats["by_role"], {"seller": 1})
+        self.assertEqual(stats["evicted_by_sweep"], 3)
+
+    def test_sweeper_survives_unexpected_errors(self):
+        sweep = _SessionStore.sweep
+        calls = []
+
+        def flaky_sweep(store, now, limit):
+            calls.append(now)
+            if len(calls) == 1:
+                raise RuntimeError("boom")
+            return sweep(store, now, limit)
+
+        with mock.patch.object(_SessionStore, "sweep", flaky_sweep), self.assertLogs("db_customer.customer_server"):
+            handler = handle_request_factory(
+                os.path.join(self._tmpdir.name, "flaky_state.db"),
+                session_flush_interval=0.05,
+                session_timeouts={"buyer": 0.1},
+            )
+            _call(handler, "CreateBuyer", {"name": "bob", "password": "pass"})
+            _call(handler, "Login", {"role": "buyer", "name": "bob", "password": "pass"})
+            deadline = time.time() + 2
+            while _call(handler, "GetStats", {})["data"]["sessions"]["active"] and time.time() < deadline:
+                time.sleep(0.05)
+        self.assertEqual(_call(handler, "GetStats", {})["data"]["sessions"]["evicted_by_sweep"], 1)
+
+    def test_failed_flush_is_rolled_back_and_retried(self):
+        conn = sqlite3.connect(os.path.join(self._tmpdir.name, "flush_state.db"))
+        self.addCleanup(conn.close)
+        _init_db(conn)
+        conn.executemany("INSERT INTO sessions VALUES (?, 'buyer', 1, 0)", [("live",), ("stale",)])
+        conn.commit()
+        store = _SessionStore({"buyer": 10})
+        store.load(conn)
+        store.touch("live", 5.0)
+        store.sweep(11.0, 10)
+        lock = threading.Lock()
+
+        # The UPDATE chunk commits, then the DELETE chunk fails and must not stick.
+        conn.execute("CREATE TEMP TRIGGER fail_delete BEFORE DELETE ON sessions BEGIN SELECT RAISE(ABORT, 'io'); END")
+        with self.assertRaises(sqlite3.Error):
+            store.flush(conn, lock)
+        self.assertFalse(conn.in_transaction)
+        self.assertEqual(
+            conn.execute("SELECT session_id, last_active FROM sessions ORDER BY session_id").fetchall(),
+            [("live", 5.0), ("stale", 0.0)],
+        )
+
+        conn.execute("DROP TRIGGER fail_delete")
+        store.flush(conn, lock)
+        self.assertEqual(conn.execute("SELECT session_id, last_active FROM sessions").fetchall(), [("live", 5.0)])
+
+    def test_flush_releases_the_writer_lock_between_chunks(self):
+        conn = sqlite3.connect(os.path.join(self._tmpdir.name, "chunk_state.db"))
+        self.addCleanup(conn.close)
+        _init_db(conn)
+        conn.executemany("INSERT INTO sessions VALUES (?, 'buyer', 1, 0)", [(f"s{i}",) for i in range(1200)])
+        conn.commit()
+        store = _SessionStore({"buyer": 10})
+        store.load(conn)
+        self.assertEqual(store.sweep(11.0, 2000), 1200)
+
+        # Each chunk commits before the lock is let go.
+        released_mid_transaction = []
+
+        class RecordingLock:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                released_mid_transaction.append(conn.in_transaction)
+
+        store.flush(conn, RecordingLock(), chunk=500)
+        self.assertEqual(released_mid_transaction, [False, False, False])
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0], 0)
+
+
+class SessionTokenTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        key = b"test-key"
+        customer = handle_request_factory(os.path.join(self._tmpdir.name, "customer_state.db"), token_key=key)
+        self.validations = 0
+
+        def counting_customer(req):
+            if req.get("api") == "ValidateSession":
+                self.validations += 1
+            return customer(req)
+
+        self.customer = ThreadedServer("127.0.0.1", 0, counting_customer)
+        self.seller = seller_handler_factory(
+            self.customer.host,
+            self.customer.port,
+            "127.0.0.1",
+            1,
+            token_key=key,
+            revocation_refresh=0.05,
+        )
+        _call(self.seller, "CreateAccount", {"name": "sue", "password": "pass"})
+
+    def tearDown(self):
+        self.customer.stop()
+        self._tmpdir.cleanup()
+
+    def test_tokens_are_verified_locally_and_revoked_on_logout(self):
+        login = _call(self.seller, "Login", {"name": "sue", "password": "pass"})
+        token = login["data"]["session_id"]
+        self.assertTrue(token.startswith("v1."))
+
+        for _ in range(3):
+            rating = _call(self.seller, "GetSellerRating", {"session_id": token})
+            self.assertTrue(rating["ok"], rating)
+        self.assertEqual(self.validations, 0)
+
+        tampered = token[:-2] + ("AA" if not token.endswith("AA") else "BB")
+        self.assertEqual(_call(self.seller, "GetSellerRating", {"session_id": tampered})["error"]["code"], "NOT_LOGGED_IN")
+        # Non-ASCII signatures or claims are rejected like any bad signature.
+        for forged in ("v1.abc.\u00e9", token.rsplit(".", 1)[0] + ".\u00e9", "v1.\u00e9.abc"):
+            claims, error = check_token(b"test-key", forged, lambda sid: False)
+            self.assertEqual((claims, error[0]), (None, "NOT_LOGGED_IN"))
+            rating = _call(self.seller, "GetSellerRating", {"session_id": forged})
+            self.assertEqual(rating["error"]["code"], "NOT_LOGGED_IN")
+
+        # Another frontend learns about the logout through the DB's revocation list.
+        other = seller_handler_factory(
+            self.customer.host, self.customer.port, "127.0.0.1", 1, token_key=b"test-key", revocation_refresh=0.05
+        )
+        self.assertTrue(_call(self.seller, "Logout", {"session_id": token})["ok"])
+        self.assertFalse(_call(self.seller, "GetSellerRating", {"session_id": token})["ok"])
+        deadline = time.time() + 2
+        while _call(other, "GetSellerRating", {"session_id": token})["ok"] and time.time() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(_call(other, "GetSellerRating", {"session_id": token})["error"]["code"], "NOT_LOGGED_IN")
+
+
+class SessionCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        customer = handle_request_factory(os.path.join(self._tmpdir.name, "customer_state.db"))
+        self.validations = 0
+
+        def counting_customer(req):
+            if req.get("api") == "ValidateSession":
+                self.validations += 1
+                time.sleep(0.01)
+            return customer(req)
+
+        self.customer = ThreadedServer("127.0.0.1", 0, counting_customer)
+        self.seller = seller_handler_factory(self.customer.host, self.customer.port, "127.0.0.1", 1, session_cache_ttl=5)
+        _call(self.seller, "CreateAccount", {"name": "sue", "password": "pass"})
+        self.session_id = _call(self.seller, "Login", {"name": "sue", "password": "pass"})["data"]["session_id"]
+
+    def tearDown(self):
+        self.customer.stop()
+        self._tmpdir.cleanup()
+
+    def test_repeated_and_concurrent_lookups_hit_db_once(self):
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(_call(self.seller, "GetSellerRating", {"session_id": self.session_id}))
+            )
+            for _ in range(10)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for _ in range(200):
+            results.append(_call(self.seller, "GetSellerRating", {"session_id": self.session_id}))
+
+        self.assertTrue(all(r["ok"] for r in results))
+        self.assertEqual(self.validations, 1)
+        stats = _call(self.seller, "GetStats", {})["data"]["session_cache"]
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hits"] + stats["coalesced"], 209)
+
+        _call(self.seller, "Logout", {"session_id": self.session_id})
+        resp = _call(self.seller, "GetSellerRating", {"session_id": self.session_id})
+        self.assertEqual(resp["error"]["code"], "NOT_LOGGED_IN")
@@ -0,0 +1,298 @@
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(__file__))
+if ROOT not in sys.path:
+    sys.path.append(ROOT)
+TESTS_DIR = os.path.join(ROOT, "tests")
+if TESTS_DIR not in sys.path:
+    sys.path.append(TESTS_DIR)
+
+from common.async_tcp_client import AsyncConnectionPool
+from common.protocol import BINARY, JSON, FrameReader, client_hello, encode_msg, recv_msg, send_msg
+from common.tcp_client import ConnectionPool, MultiplexedConnection, tcp_request
+from common.tcp_server import WorkerPool
+from helpers import ThreadedServer
+
+
+class WorkerPoolTest(unittest.TestCase):
+    def test_sheds_load_when_queue_is_full_or_stale(self):
+        release = threading.Event()
+
+        def slow_handler(req):
+            release.wait(timeout=2)
+            return {"type": "Response", "request_id": req["request_id"], "ok": True, "error": None, "data": None}
+
+        pool = WorkerPool(slow_handler, size=1, queue_size=1, queue_timeout=0.05)
+        running = pool.submit({"request_id": "1"})
+        # Give the worker time to take the first request off the queue.
+        while pool.stats()["queued"]:
+            time.sleep(0.001)
+        queued = pool.submit({"request_id": "2"})
+        rejected = pool.submit({"request_id": "3"})
+
+        self.assertEqual(rejected.result(timeout=1)["error"]["code"], "OVERLOADED")
+        time.sleep(0.1)
+        release.set()
+        self.assertTrue(running.result(timeout=1)["ok"])
+        self.assertEqual(queued.result(timeout=1)["error"]["code"], "OVERLOADED")
+        self.assertEqual(queued.result()["request_id"], "2")
+        stats = pool.stats()
+        self.assertEqual((stats["completed"], stats["rejected"], stats["expired"]), (1, 1, 1))
+
+
+class PipeliningTest(unittest.TestCase):
+    def test_responses_return_out_of_order_on_one_connection(self):
+        def handler(req):
+            time.sleep(req["data"]["delay"])
+            return {"type": "Response", "request_id": req["request_id"], "ok": True, "error": None, "data": req["data"]}
+
+        for engine in ("threading", "asyncio"):
+            with self.subTest(engine=engine):
+                server = ThreadedServer("127.0.0.1", 0, handler, engine=engine)
+                conn = MultiplexedConnection(server.host, server.port)
+                try:
+                    # A read that brings in several requests switches a threading-engine
+                    # connection to concurrent dispatch.
+                    warmup = [
+                        conn.submit({"type": "Request", "request_id": i, "api": "Echo", "data": {"delay": 0.0}})
+                        for i in range(50)
+                    ]
+                    self.assertEqual([f.result(timeout=2)["request_id"] for f in warmup], list(range(50)))
+                    started = time.monotonic()
+                    slow = conn.submit({"type": "Request", "request_id": "same", "api": "Echo", "data": {"delay": 0.3}})
+                    fast = conn.submit({"type": "Request", "request_id": "same", "api": "Echo", "data": {"delay": 0.0}})
+                    self.assertEqual(fast.result(timeout=2)["data"], {"delay": 0.0})
+                    self.assertFalse(slow.done())
+                    self.assertEqual(slow.result(timeout=2)["data"], {"delay": 0.3})
+                    self.assertEqual(slow.result()["request_id"], "same")
+                    self.assertLess(time.monotonic() - started, 0.5)
+                    # Plain one-at-a-time clients are still served.
+                    resp = tcp_request(server.host, server.port, {"type": "Request", "request_id": "r", "api": "Echo", "data": {"delay": 0}})
+                    self.assertEqual(resp["request_id"], "r")
+                finally:
+                    conn.close()
+                    server.stop()
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def _echo(self, delay=0.0):
+        def handler(req):
+            time.sleep(delay)
+            return {"type": "Response", "request_id": req["request_id"], "ok": True, "error": None, "data": None}
+
+        server = ThreadedServer("127.0.0.1", 0, handler)
+        self.addCleanup(server.stop)
+        return server
+
+    def test_caps_connections_and_reports_waits(self):
+        server = self._echo(delay=0.05)
+        pool = ConnectionPool(server.host, server.port, max_size=2)
+        req = {"type": "Request", "request_id": "r", "api": "Echo"}
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(pool.request(req))) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(results), 6)
+        stats = pool.stats()
+        self.assertEqual((stats["created"], stats["size"], stats["idle"]), (2, 2, 2))
+        self.assertEqual(stats["checkouts"], 6)
+        self.assertGreaterEqual(stats["waits"], 4)
+        self.assertGreater(stats["wait_ms_max"], 0)
+
+        with self.assertRaises(TimeoutError):
+            held = [pool.checkout(), pool.checkout()]
+            try:
+                pool.checkout(timeout=0.05)
+            finally:
+                for conn in held:
+                    pool.checkin(conn)
+
+    def test_evicts_idle_and_replaces_closed_connections(self):
+        server = self._echo()
+        pool = ConnectionPool(server.host, server.port, idle_timeout=0.05)
+        req = {"type": "Request", "request_id": "r", "api": "Echo"}
+        pool.request(req)
+        time.sleep(0.1)
+        pool.request(req)
+        self.assertEqual((pool.stats()["evicted"], pool.stats()["created"]), (1, 2))
+
+        conn = pool.checkout()
+        conn.sock.shutdown(socket.SHUT_WR)  # the server sees EOF and closes its end
+        time.sleep(0.1)
+        pool.checkin(conn)
+        self.assertTrue(pool.request(req)["ok"])
+        stats = pool.stats()
+        self.assertEqual((stats["discarded"], stats["created"], stats["size"]), (1, 3, 1))
+
+
+class AsyncConnectionPoolTest(unittest.TestCase):
+    def test_concurrent_coroutines_share_pipelined_connections(self):
+        def handler(req):
+            time.sleep(0.2 if req["request_id"] == 0 else 0.01)
+            return {"type": "Response", "request_id": req["request_id"], "ok": True, "error": None, "data": req["data"]}
+
+        server = ThreadedServer("127.0.0.1", 0, handler)
+        self.addCleanup(server.stop)
+
+        async def run():
+            pool = AsyncConnectionPool(server.host, server.port, size=2)
+            try:
+                reqs = [{"type": "Request", "request_id": i, "api": "Echo", "data": i} for i in range(20)]
+                resps = await asyncio.gather(*(pool.request(req) for req in reqs))
+                return resps, pool.stats()
+            finally:
+                await pool.close()
+
+        resps, stats = asyncio.run(run())
+        # Request 0 is answered last; every caller still gets its own response back.
+        self.assertEqual([(r["request_id"], r["data"]) for r in resps], [(i, i) for i in range(20)])
+        self.assertEqual((stats["created"], stats["open"], stats["requests"]), (2, 2, 20))
+
+
+class FrameReaderTest(unittest.TestCase):
+    def test_reads_batched_split_and_oversized_frames(self):
+        client, server = socket.socketpair()
+        reader = FrameReader(server, size=64)
+        msgs = [{"n": i} for i in range(3)] + [{"blob": "x" * 200_000}, {"n": 4}]
+        frames = b"".join(encode_msg(m) for m in msgs)
+        try:
+            # Three whole frames plus the first bytes of the big one arrive together.
+            split = len(b"".join(encode_msg(m) for m in msgs[:3])) + 2
+            client.sendall(frames[:split])
+            self.assertEqual([reader.recv_msg() for _ in range(3)], msgs[:3])
+            threading.Thread(target=client.sendall, args=(frames[split:],), daemon=True).start()
+            self.assertEqual(reader.recv_msg(), msgs[3])
+            self.assertEqual(reader.recv_msg(), msgs[4])
+            self.assertFalse(reader.buffered())
+            # Large payloads go out as a scatter write.
+            threading.Thread(target=send_msg, args=(client, msgs[3]), daemon=True).start()
+            self.assertEqual(reader.recv_msg(), msgs[3])
+            client.close()
+            with self.assertRaises(ConnectionError):
+                reader.read_frame()
+        finally:
+            server.close()
+
+
+class CodecTest(unittest.TestCase):
+    def test_binary_codec_round_trips_and_is_smaller(self):
+        msg = {
+            "type": "Response",
+            "request_id": "r1",
+            "ok": True,
+            "error": None,
+            "data": {
+                "items": [{"item_id": "1:1", "price": 9.5, "quantity": 3, "keywords": ["a", "ü" * 40]}] * 20,
+                "ints": [0, 127, 128, -1, -32, -33, 2**40, -(2**63)],
+                "long": "x" * 70000,
+                "flags": [True, False, None],
+                "many": {str(i): i for i in range(20)},
+            },
+        }
+        payload = BINARY.encode(msg)
+        self.assertEqual(BINARY.decode(payload), msg)
+        self.assertLess(len(payload), len(JSON.encode(msg)))
+        with self.assertRaises(ValueError):
+            BINARY.decode(payload[:-1])
+
+    def test_codec_is_negotiated_per_connection(self):
+        def handler(req):
+            return {"type": "Response", "request_id": req["request_id"], "ok": True, "error": None, "data": req["data"]}
+
+        data = {"price": 1.5, "keywords": ["x"]}
+        for engine in ("threading", "asyncio"):
+            with self.subTest(engine=engine):
+                server = ThreadedServer("127.0.0.1", 0, handler, engine=engine)
+                try:
+                    with socket.create_connection((server.host, server.port)) as sock:
+                        self.assertIs(client_hello(sock, "bin1"), BINARY)
+                    for multiplex in (False, True):
+                        resp = tcp_request(
+                            server.host,
+                            server.port,
+                            {"type": "Request", "request_id": "r", "api": "Echo", "data": data},
+                            reuse_socket=True,
+                            multiplex=multiplex,
+                            codec_name="bin1",
+                        )
+                        self.assertEqual((resp["request_id"], resp["data"]), ("r", data))
+                finally:
+                    server.stop()
+
+    def test_old_peers_stay_on_json(self):
+        client, server = socket.socketpair()
+
+        def old_server():
+            req = recv_msg(server)
+            error = {"code": "UNIMPLEMENTED", "message": "unknown api Hello"}
+            send_msg(server, {"type": "Response", "request_id": req["request_id"], "ok": False, "error": error, "data": None})
+
+        threading.Thread(target=old_server, daemon=True).start()
+        try:
+            self.assertIs(client_hello(client, "bin1"), JSON)
+        finally:
+            client.close()
+            server.close()
+
+
+_PID_SERVER = textwrap.dedent(
+    """
+    import os, sys
+    sys.path.append({root!r})
+    from common.tcp_server import run_workers
+
+    def make_handler():
+        return lambda req: {{"type": "Response", "request_id": req.get("request_id"), "ok": True,
+                            "error": None, "data": {{"pid": os.getpid()}}}}
+
+    run_workers("127.0.0.1", {port}, make_handler, 2)
+    """
+)
+
+
+class RunWorkersTest(unittest.TestCase):
+    def _free_port(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            return sock.getsockname()[1]
+
+    def _pids(self, port, attempts=40):
+        pids = set()
+        deadline = time.time() + 5
+        while len(pids) < attempts and time.time() < deadline:
+            try:
+                resp = tcp_request("127.0.0.1", port, {"type": "Request", "request_id": "p", "api": "Ping", "data": {}}, timeout=1)
+            except OSError:
+                time.sleep(0.05)
+                continue
+            pids.add(resp["data"]["pid"])
+            if len(pids) == 2:
+                break
+        return pids
+
+    def test_workers_share_port_and_are_restarted(self):
+        port = self._free_port()
+        proc = subprocess.Popen([sys.executable, "-c", _PID_SERVER.format(root=ROOT, port=port)])
+        try:
+            pids = self._pids(port)
+            self.assertEqual(len(pids), 2)
+            victim = pids.pop()
+            os.kill(victim, signal.SIGKILL)
+            time.sleep(1.0)
+            after = self._pids(port)
+            self.assertEqual(len(after), 2)
+            self.assertNotIn(victim, after)
+        finally:
+            proc.terminate()
+            proc.wait(timeout=5)